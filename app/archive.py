@@ -0,0 +1,199 @@
+"""
+Append-only segment store for archived Episode transcripts.
+
+A segment is a file of independently zlib-compressed JSON lines, each
+{"id", "uid", "conversation", "archived_at"}. Next to it is an offset index
+(`<segment>.idx`, JSON lines of {"id", "offset", "length"}). An archived Episode keeps a
+pointer "archive:<segment>:<offset>:<length>" in place of its transcript. Reading one
+record is one seek and one small read, with no scan. Segments are sealed once they reach
+ARCHIVE_SEGMENT_BYTES.
+
+Segments are rewritten only by compaction (see app.retention). Compaction copies their live
+records into the active segment and then retires the old file. A retired file is renamed
+rather than deleted, so readers still holding an old pointer find it until it is purged.
+
+One process archives or compacts at a time (the writer holds `<path>/LOCK`, and `append` and
+`retire` also serialize on an in-process lock); any number may read.
+"""
+import fcntl
+import json
+import os
+import re
+import threading
+import time
+import zlib
+from loguru import logger
+from app.episode_store import ARCHIVE_PREFIX
+
+ARCHIVE_PATH = os.getenv("ARCHIVE_PATH", "./archive")
+ARCHIVE_SEGMENT_BYTES = int(os.getenv("ARCHIVE_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+ARCHIVE_COMPRESSION_LEVEL = int(os.getenv("ARCHIVE_COMPRESSION_LEVEL", "9"))
+
+SEGMENT_SUFFIX = ".seg"
+RETIRED_SUFFIX = ".retired"
+_SEGMENT_NAME = re.compile(r"^segment-(\d{6})$")
+
+
+class ArchiveLockedError(RuntimeError):
+    """Raised when another process is already writing to the archive."""
+
+
+def make_ref(segment: str, offset: int, length: int) -> str:
+    return f"{ARCHIVE_PREFIX}{segment}:{offset}:{length}"
+
+
+def parse_ref(ref: str) -> tuple[str, int, int]:
+    segment, offset, length = ref[len(ARCHIVE_PREFIX):].rsplit(":", 2)
+    return segment, int(offset), int(length)
+
+
+class SegmentStore:
+    def __init__(self, path: str = ARCHIVE_PATH, segment_bytes: int = ARCHIVE_SEGMENT_BYTES,
+                 level: int = ARCHIVE_COMPRESSION_LEVEL):
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.level = level
+        self._lock = threading.Lock()
+        self._lock_fd: int | None = None
+
+    def _file(self, segment: str, suffix: str = SEGMENT_SUFFIX) -> str:
+        return os.path.join(self.path, segment + suffix)
+
+    def segments(self) -> list[str]:
+        """
+        Segment names, oldest first; the last one is the active (appendable) segment.
+        """
+        if not os.path.isdir(self.path):
+            return []
+        names = [name[:-len(SEGMENT_SUFFIX)] for name in os.listdir(self.path) if name.endswith(SEGMENT_SUFFIX)]
+        return sorted(name for name in names if _SEGMENT_NAME.match(name))
+
+    def acquire(self) -> None:
+        """
+        Take the single-writer lock; raises ArchiveLockedError if another process holds it.
+        """
+        if self._lock_fd is not None:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        fd = os.open(os.path.join(self.path, "LOCK"), os.O_CREAT | os.O_RDWR)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            raise ArchiveLockedError(f"archive at {self.path} is being written by another process")
+        self._lock_fd = fd
+
+    def release(self) -> None:
+        if self._lock_fd is not None:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def _active(self, incoming: int) -> str:
+        segments = self.segments()
+        if segments and os.path.getsize(self._file(segments[-1])) + incoming <= self.segment_bytes:
+            return segments[-1]
+        number = int(_SEGMENT_NAME.match(segments[-1]).group(1)) + 1 if segments else 1
+        return f"segment-{number:06d}"
+
+    def append(self, records: list[dict]) -> list[str]:
+        """
+        Append {"id", "uid", "conversation"} records durably; returns one pointer per record.
+        """
+        self.acquire()
+        blobs = []
+        for record in records:
+            line = json.dumps({**record, "archived_at": time.time()}, ensure_ascii=False, separators=(",", ":"))
+            blobs.append(zlib.compress(line.encode(), self.level))
+        refs = []
+        with self._lock:
+            segment = self._active(sum(len(blob) for blob in blobs))
+            with open(self._file(segment), "ab") as data, open(self._file(segment, ".idx"), "a") as index:
+                offset = data.tell()
+                for record, blob in zip(records, blobs):
+                    data.write(blob)
+                    index.write(json.dumps({"id": record["id"], "offset": offset, "length": len(blob)}) + "\n")
+                    refs.append(make_ref(segment, offset, len(blob)))
+                    offset += len(blob)
+                data.flush()
+                os.fsync(data.fileno())
+                index.flush()
+                os.fsync(index.fileno())
+        return refs
+
+    def read_record(self, ref: str) -> dict:
+        segment, offset, length = parse_ref(ref)
+        for suffix in (SEGMENT_SUFFIX, RETIRED_SUFFIX):
+            try:
+                with open(self._file(segment, suffix), "rb") as fh:
+                    fh.seek(offset)
+                    return json.loads(zlib.decompress(fh.read(length)))
+            except FileNotFoundError:
+                continue
+        raise FileNotFoundError(f"archive segment {segment} not found for {ref}")
+
+    def read(self, ref: str) -> str:
+        """
+        Transcript JSON text of an archived Episode.
+        """
+        return self.read_record(ref)["conversation"]
+
+    def index(self, segment: str) -> list[dict]:
+        """
+        The segment's offset index: [{"id", "offset", "length", "ref"}], in file order.
+        """
+        entries = []
+        with open(self._file(segment, ".idx")) as fh:
+            for line in fh:
+                if line.strip():
+                    entry = json.loads(line)
+                    entry["ref"] = make_ref(segment, entry["offset"], entry["length"])
+                    entries.append(entry)
+        return entries
+
+    def retire(self, segment: str) -> bool:
+        """
+        Take a compacted segment out of service; it stays readable until `purge_retired`.
+
+        Holds the writer lock like `append`, and refuses (returns False) when the segment has
+        become the active one, so an append can never land in a file being retired.
+        """
+        self.acquire()
+        with self._lock:
+            segments = self.segments()
+            if segment not in segments[:-1]:
+                logger.warning(f"Not retiring archive segment {segment}: it is active or already retired")
+                return False
+            os.replace(self._file(segment), self._file(segment, RETIRED_SUFFIX))
+            # The grace period of `purge_retired` counts from now
+            os.utime(self._file(segment, RETIRED_SUFFIX))
+            os.remove(self._file(segment, ".idx"))
+        logger.info(f"Retired archive segment {segment}")
+        return True
+
+    def purge_retired(self, older_than: float) -> int:
+        """
+        Delete retired segments retired more than `older_than` seconds ago.
+        """
+        if not os.path.isdir(self.path):
+            return 0
+        purged = 0
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            if name.endswith(RETIRED_SUFFIX) and time.time() - os.path.getmtime(path) > older_than:
+                os.remove(path)
+                purged += 1
+        return purged
+
+    def stats(self) -> dict:
+        segments = self.segments()
+        return {
+            "path": self.path,
+            "segments": len(segments),
+            "bytes": sum(os.path.getsize(self._file(s)) for s in segments),
+            "records": sum(len(self.index(s)) for s in segments),
+        }
+
+
+# Process-wide store used by the Episode read path and the retention job
+archive_store = SegmentStore()
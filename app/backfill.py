@@ -0,0 +1,124 @@
+"""
+Offline backfill of historical conversations through the bulk ingestion pipeline.
+
+    python -m app.backfill conversations.jsonl --checkpoint backfill.ckpt
+    python -m app.backfill exports/ --checkpoint backfill.ckpt --concurrency 16
+
+SOURCE is a JSONL file (one ConversationIn per line) or a directory of `*.json` /
+`*.jsonl` files in the `convo.json` shape, read in sorted order. The checkpoint stores
+the number of leading items that are finished, so an interrupted run resumes where it
+stopped; failed items are appended to `<checkpoint>.errors.jsonl`.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+from typing import AsyncIterator, Iterator
+from loguru import logger
+
+
+def iter_source(source: Path) -> Iterator[str]:
+    """
+    Yield one JSON document per conversation from a JSONL file or a directory.
+    """
+    files = sorted(p for p in source.iterdir() if p.suffix in (".json", ".jsonl")) if source.is_dir() else [source]
+    for path in files:
+        if path.suffix == ".json":
+            yield path.read_text()
+            continue
+        with path.open() as fh:
+            for line in fh:
+                if line.strip():
+                    yield line
+
+
+class Checkpoint:
+    """
+    Contiguous completion watermark: every item with index < `done` is finished.
+    """
+
+    def __init__(self, path: Path | None):
+        self.path = path
+        self.done = 0
+        self._finished: set[int] = set()
+        if path is not None and path.exists():
+            self.done = json.loads(path.read_text()).get("done", 0)
+
+    def mark(self, index: int) -> None:
+        self._finished.add(index)
+        while self.done in self._finished:
+            self._finished.discard(self.done)
+            self.done += 1
+
+    def save(self) -> None:
+        if self.path is not None:
+            tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+            tmp.write_text(json.dumps({"done": self.done, "updated_at": time.time()}))
+            tmp.replace(self.path)
+
+
+async def _items(source: Path, skip: int) -> AsyncIterator[str]:
+    for index, doc in enumerate(iter_source(source)):
+        if index >= skip:
+            yield doc
+            # Let extraction tasks run between reads of large local files
+            await asyncio.sleep(0)
+
+
+async def run(source: Path, checkpoint_path: Path | None, concurrency: int, batch_size: int, save_every: int) -> dict:
+    from app import bulk_ingest
+    from app.llm import llm
+    import app.graphiti_client as graphiti_client
+
+    checkpoint = Checkpoint(checkpoint_path)
+    errors_path = checkpoint_path.with_suffix(checkpoint_path.suffix + ".errors.jsonl") if checkpoint_path else None
+    if checkpoint.done:
+        logger.info(f"Resuming backfill of {source} after {checkpoint.done} items")
+    counts = {"ok": 0, "skipped": 0, "error": 0}
+    started = time.perf_counter()
+    try:
+        results = bulk_ingest.ingest_stream(
+            _items(source, checkpoint.done), concurrency=concurrency, batch_size=batch_size, start_index=checkpoint.done,
+        )
+        async for result in results:
+            counts[result["status"]] += 1
+            if result["status"] == "error":
+                logger.warning(f"Item {result['index']} failed: {result['error']}")
+                if errors_path is not None:
+                    with errors_path.open("a") as fh:
+                        fh.write(json.dumps(result) + "\n")
+            if result["index"] is not None:
+                checkpoint.mark(result["index"])
+            if sum(counts.values()) % save_every == 0:
+                checkpoint.save()
+    finally:
+        checkpoint.save()
+        await llm.aclose()
+        await graphiti_client.driver.close()
+    elapsed = time.perf_counter() - started
+    total = sum(counts.values())
+    return {**counts, "checkpoint": checkpoint.done, "seconds": round(elapsed, 2),
+            "per_second": round(total / elapsed, 2) if elapsed else None}
+
+
+def main(argv: list[str] | None = None) -> int:
+    from dotenv import load_dotenv
+    load_dotenv()
+    from app import bulk_ingest
+
+    parser = argparse.ArgumentParser(description="Backfill conversations through the bulk ingestion pipeline")
+    parser.add_argument("source", type=Path, help="JSONL file or directory of .json/.jsonl files")
+    parser.add_argument("--checkpoint", type=Path, default=None, help="progress file used to resume")
+    parser.add_argument("--concurrency", type=int, default=bulk_ingest.BULK_EXTRACT_CONCURRENCY)
+    parser.add_argument("--batch-size", type=int, default=bulk_ingest.BULK_WRITE_BATCH)
+    parser.add_argument("--save-every", type=int, default=100, help="items between checkpoint writes")
+    args = parser.parse_args(argv)
+    summary = asyncio.run(run(args.source, args.checkpoint, args.concurrency, args.batch_size, args.save_every))
+    print(json.dumps(summary))
+    return 1 if summary["error"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
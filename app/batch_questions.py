@@ -0,0 +1,106 @@
+"""
+Next questions for many users in one call, behind `POST /next_questions`.
+
+Items are taken a page at a time. Each page's top-k preferences come from one `UNWIND $uids`
+query. A question already in the user's buffer is served from there. The others are
+generated with at most `concurrency` LLM calls in flight. Results are yielded as they
+complete, through a queue of at most `2 * concurrency` results: when the client reads slowly,
+generation waits instead of buffering the whole batch in memory. A failed item (or a failed preference page) yields an error result for just
+those items; the rest of the batch carries on.
+"""
+import asyncio
+import os
+from typing import AsyncIterator
+from loguru import logger
+from app.models.question_request import NextQuestionIn
+from app.question_buffer import question_buffer
+import app.graphiti_client as graphiti_client
+
+NEXT_QUESTIONS_CONCURRENCY = int(os.getenv("NEXT_QUESTIONS_CONCURRENCY", "16"))
+# Users whose preferences are fetched per Neo4j round trip
+NEXT_QUESTIONS_PAGE_SIZE = int(os.getenv("NEXT_QUESTIONS_PAGE_SIZE", "500"))
+NEXT_QUESTIONS_MAX_ITEMS = int(os.getenv("NEXT_QUESTIONS_MAX_ITEMS", "5000"))
+
+_DONE = object()
+
+
+class _Batch:
+    def __init__(self, concurrency: int):
+        self.slots = asyncio.Semaphore(concurrency)
+        # Bounded, so a slow reader holds up generation (a blocked put keeps its slot)
+        self.results: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+        self.tasks: set[asyncio.Task] = set()
+
+    async def generate(self, index: int, item: NextQuestionIn, prefs: list[str]) -> None:
+        try:
+            question = await graphiti_client.generate_next_question(preferences=prefs)
+            await self.results.put({"index": index, "uid": item.uid, "status": "ok", "question": question})
+        except Exception as e:
+            await self.results.put({"index": index, "uid": item.uid, "status": "error", "error": str(e)})
+        finally:
+            self.slots.release()
+
+    async def page(self, start: int, items: list[NextQuestionIn]) -> None:
+        pending = []
+        for index, item in enumerate(items, start):
+            question = question_buffer.pop(item.uid, item.num_preferences)
+            if question is not None:
+                await self.results.put({"index": index, "uid": item.uid, "status": "ok", "question": question, "buffered": True})
+            else:
+                pending.append((index, item))
+        if not pending:
+            return
+        try:
+            top_k = max(item.num_preferences for _, item in pending)
+            prefs = await graphiti_client.get_preferences_many([item.uid for _, item in pending], top_k)
+        except Exception as e:
+            logger.error(f"Preference lookup for {len(pending)} batch item(s) failed: {e}")
+            for index, item in pending:
+                await self.results.put({"index": index, "uid": item.uid, "status": "error", "error": str(e)})
+            return
+        for index, item in pending:
+            # Backpressure: the next page is not fetched while `concurrency` generations are in flight
+            await self.slots.acquire()
+            task = asyncio.create_task(self.generate(index, item, prefs[item.uid][:item.num_preferences]))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def feed(self, items: list[NextQuestionIn], page_size: int) -> None:
+        cancelled = False
+        try:
+            for start in range(0, len(items), page_size):
+                await self.page(start, items[start:start + page_size])
+            if self.tasks:
+                await asyncio.gather(*self.tasks)
+        except asyncio.CancelledError:
+            # The reader is gone and the queue may be full: nobody is left to take _DONE
+            cancelled = True
+            raise
+        finally:
+            if not cancelled:
+                await self.results.put(_DONE)
+
+
+async def next_questions_stream(
+    items: list[NextQuestionIn],
+    concurrency: int = NEXT_QUESTIONS_CONCURRENCY,
+    page_size: int = NEXT_QUESTIONS_PAGE_SIZE,
+) -> AsyncIterator[dict]:
+    """
+    Yield one result dict per item, in completion order; each carries the item's zero-based `index`.
+    """
+    batch = _Batch(concurrency)
+    feeder = asyncio.create_task(batch.feed(items, page_size))
+    try:
+        while True:
+            result = await batch.results.get()
+            if result is _DONE:
+                break
+            yield result
+    finally:
+        # Client went away or the consumer stopped early: stop fetching and generating
+        if not feeder.done():
+            feeder.cancel()
+            for task in list(batch.tasks):
+                task.cancel()
+            await asyncio.gather(feeder, *batch.tasks, return_exceptions=True)
@@ -0,0 +1,178 @@
+"""
+Bulk ingestion pipeline shared by `POST /ingest_conversations:bulk` and the backfill CLI.
+
+Conversations are read one at a time from an async iterator, extracted with bounded
+concurrency, and written in large cross-conversation transactions by a single writer.
+Per-item results are yielded as soon as their batch commits, through a queue of at most
+`2 * concurrency` results: a slow reader holds up extraction and input instead of letting
+results pile up in memory.
+"""
+import asyncio
+import json
+import os
+from typing import AsyncIterator
+from loguru import logger
+from pydantic import ValidationError
+from app.models.conversation import ConversationIn
+import app.graphiti_client as graphiti_client
+
+BULK_EXTRACT_CONCURRENCY = int(os.getenv("BULK_EXTRACT_CONCURRENCY", "8"))
+BULK_WRITE_BATCH = int(os.getenv("BULK_WRITE_BATCH", "100"))
+
+_DONE = object()
+
+
+def parse_item(raw: str | bytes | dict) -> ConversationIn:
+    """
+    Validate one NDJSON line (or already-decoded object) as a ConversationIn.
+    """
+    if isinstance(raw, dict):
+        return ConversationIn.model_validate(raw)
+    return ConversationIn.model_validate_json(raw)
+
+
+async def ndjson_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """
+    Split a byte stream into non-empty lines without buffering more than one partial line.
+    """
+    pending = b""
+    async for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield line
+    if pending.strip():
+        yield pending
+
+
+class _Pipeline:
+    def __init__(self, concurrency: int, batch_size: int):
+        self.batch_size = batch_size
+        self.slots = asyncio.Semaphore(concurrency)
+        # Bounded, so a slow reader holds up the pipeline (a blocked put keeps its caller waiting)
+        self.results: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+        self.batch: list[dict] = []
+        self.write_lock = asyncio.Lock()
+        self.tasks: set[asyncio.Task] = set()
+
+    async def flush(self) -> None:
+        async with self.write_lock:
+            batch, self.batch = self.batch, []
+            if not batch:
+                return
+            try:
+                rel_count = await graphiti_client.write_episode_batch(batch)
+                logger.info(f"Bulk batch committed: {len(batch)} conversations, {rel_count} relationships")
+                for item in batch:
+                    graphiti_client.schedule_episode_summary(item["uid"], item["episode_id"], item["conv"], item["plan"])
+                    await self.results.put({
+                        "index": item["index"], "conversation_id": item["conversation_id"],
+                        "status": "ok", "episode_id": item["episode_id"],
+                        "relationships": sum(len(names) for names in item["groups"].values()),
+                    })
+            except Exception as e:
+                logger.error(f"Bulk batch of {len(batch)} conversations failed: {e}")
+                for item in batch:
+                    await self.results.put({
+                        "index": item["index"], "conversation_id": item["conversation_id"],
+                        "status": "error", "error": str(e),
+                    })
+
+    async def extract(self, index: int, payload: ConversationIn) -> None:
+        conv = [{"speaker": turn.speaker, "text": turn.text} for turn in payload.conversation]
+        try:
+            if graphiti_client._USE_GRAPHITI:
+                episode_id = await graphiti_client.add_episode(payload.uid, conv)
+                await self.results.put({
+                    "index": index, "conversation_id": payload.conversation_id,
+                    "status": "ok", "episode_id": episode_id,
+                })
+                return
+            plan = await graphiti_client.plan_episode(
+                payload.uid, conv, payload.conversation_id, payload.created_at, payload.updated_at,
+            )
+            if plan.skip:
+                await self.results.put({
+                    "index": index, "conversation_id": payload.conversation_id,
+                    "status": "skipped", "reason": plan.mode, "episode_id": plan.episode_id,
+                })
+                return
+            groups, summary = await graphiti_client.extract_episode(payload.uid, conv, plan)
+        except Exception as e:
+            await self.results.put({
+                "index": index, "conversation_id": payload.conversation_id, "status": "error", "error": str(e),
+            })
+            return
+        finally:
+            self.slots.release()
+        self.batch.append({
+            "index": index, "conversation_id": payload.conversation_id, "uid": payload.uid,
+            "episode_id": plan.episode_id, "conv": conv, "groups": groups, "summary": summary, "plan": plan,
+        })
+        if len(self.batch) >= self.batch_size:
+            await self.flush()
+
+    async def feed(self, items: AsyncIterator, start_index: int) -> None:
+        cancelled = False
+        try:
+            index = start_index
+            async for raw in items:
+                try:
+                    payload = parse_item(raw)
+                except (ValidationError, ValueError) as e:
+                    await self.results.put({"index": index, "status": "error", "error": f"invalid item: {e}"})
+                    index += 1
+                    continue
+                # Backpressure: stop reading input while `concurrency` extractions are in flight
+                await self.slots.acquire()
+                task = asyncio.create_task(self.extract(index, payload))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+                index += 1
+            if self.tasks:
+                await asyncio.gather(*self.tasks)
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Bulk ingestion input failed: {e}")
+            await self.results.put({"index": None, "status": "error", "error": f"input failed: {e}"})
+        except asyncio.CancelledError:
+            # The reader is gone and the queue may be full: nobody is left to take _DONE
+            cancelled = True
+            raise
+        finally:
+            if not cancelled:
+                await self.results.put(_DONE)
+
+
+async def ingest_stream(
+    items: AsyncIterator,
+    concurrency: int = BULK_EXTRACT_CONCURRENCY,
+    batch_size: int = BULK_WRITE_BATCH,
+    start_index: int = 0,
+) -> AsyncIterator[dict]:
+    """
+    Ingest conversations from `items` (NDJSON lines or dicts) and yield one result dict per item.
+
+    Results arrive in completion order; each carries the item's zero-based `index`.
+    """
+    pipeline = _Pipeline(concurrency, batch_size)
+    feeder = asyncio.create_task(pipeline.feed(items, start_index))
+    try:
+        while True:
+            result = await pipeline.results.get()
+            if result is _DONE:
+                break
+            yield result
+    finally:
+        # Client went away or the consumer stopped early: stop reading and extracting
+        if not feeder.done():
+            feeder.cancel()
+            for task in list(pipeline.tasks):
+                task.cancel()
+            await asyncio.gather(feeder, *pipeline.tasks, return_exceptions=True)
+
+
+async def ndjson_results(results: AsyncIterator[dict]) -> AsyncIterator[str]:
+    async for result in results:
+        yield json.dumps(result) + "\n"
@@ -0,0 +1,122 @@
+"""
+In-process LRU + TTL cache for LLM-generated summaries.
+
+Entries are keyed by (uid, ordered episode ids, their revisions, prompt kind, model, generation),
+so a new Episode for a user naturally misses; ingest also invalidates every entry of that uid
+eagerly so memory is released as soon as a summary is known to be stale.
+
+A delta ingest keeps the episode ids but changes their content. It bumps the stored revision of
+the Episode, so every worker's key changes, including workers that never saw the ingest. In the
+ingesting worker, invalidation also moves the uid to a new generation. Requests read
+`generation(uid)` before loading episodes and put it in their key; `set` drops a value whose
+generation is no longer current, so a summary computed from data read before the ingest is
+never cached after it.
+"""
+import os
+import itertools
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+SUMMARY_CACHE_MAX_ENTRIES = int(os.getenv("SUMMARY_CACHE_MAX_ENTRIES", "1024"))
+SUMMARY_CACHE_TTL = float(os.getenv("SUMMARY_CACHE_TTL", "3600"))
+
+
+def summary_key(uid: str, episode_ids: list[str], kind: str, model: str | None, generation: int = 0,
+                revisions: list[int | None] | None = None) -> tuple:
+    return (uid, tuple(episode_ids), tuple(revisions or ()), kind, model, generation)
+
+
+class SummaryCache:
+    """
+    Bounded LRU with per-entry TTL, a uid -> keys index for invalidation and per-uid generations.
+
+    Generations come from one increasing clock. Only the most recent `max_entries` invalidated
+    uids are remembered; a forgotten uid reports the newest forgotten generation, which never
+    matches a key taken before it was forgotten.
+    """
+
+    def __init__(self, max_entries: int = SUMMARY_CACHE_MAX_ENTRIES, ttl: float = SUMMARY_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._by_uid: dict[str, set[Hashable]] = {}
+        self._clock = itertools.count(1)
+        self._generations: OrderedDict[str, int] = OrderedDict()
+        self._forgotten = 0
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0, "stale_sets": 0}
+
+    def generation(self, uid: str) -> int:
+        """
+        Current generation of a user's summaries; read it before loading the data to summarize.
+        """
+        return self._generations.get(uid, self._forgotten)
+
+    def get(self, key: tuple) -> Any | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            self._counters["misses"] += 1
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            self._drop(key)
+            self._counters["expirations"] += 1
+            self._counters["misses"] += 1
+            return None
+        self._entries.move_to_end(key)
+        self._counters["hits"] += 1
+        return value
+
+    def set(self, key: tuple, value: Any) -> None:
+        uid = key[0]
+        if key[-1] != self.generation(uid):
+            # Invalidated while the value was computed
+            self._counters["stale_sets"] += 1
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        self._by_uid.setdefault(uid, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self._counters["evictions"] += 1
+
+    def invalidate_uid(self, uid: str) -> int:
+        """
+        Drop every cached entry for a user and start a new generation; returns how many were removed.
+        """
+        self._generations[uid] = next(self._clock)
+        self._generations.move_to_end(uid)
+        while len(self._generations) > self.max_entries:
+            _, self._forgotten = self._generations.popitem(last=False)
+        keys = self._by_uid.pop(uid, set())
+        for key in keys:
+            self._entries.pop(key, None)
+        self._counters["invalidations"] += len(keys)
+        return len(keys)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._by_uid.clear()
+
+    def stats(self) -> dict:
+        lookups = self._counters["hits"] + self._counters["misses"]
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            **self._counters,
+            "hit_rate": round(self._counters["hits"] / lookups, 4) if lookups else None,
+        }
+
+    def _drop(self, key: tuple) -> None:
+        self._entries.pop(key, None)
+        keys = self._by_uid.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_uid[key[0]]
+
+
+# Process-wide cache shared by the summary and content routes
+summary_cache = SummaryCache()
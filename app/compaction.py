@@ -0,0 +1,278 @@
+"""
+Offline compaction of object nodes onto the canonical vocabulary of app.normalize.
+
+    python -m app.compaction --dry-run          # plan only: groups and nodes that would merge
+    python -m app.compaction --batch-size 200   # merge, 200 nodes per write transaction
+
+Object nodes are grouped by (canonical label, key). A group is compacted when it has
+duplicates, or a node or edge that is not already canonical; a node written before object
+keys existed has no `key`, so this also backfills it. The canonical node keeps its `name`
+(or, when it is new, the first member's). Each user's edges into the group are folded into
+one edge of the canonical type on the canonical node:
+- counts are summed;
+- first_seen and last_seen take the earliest and latest;
+- ranks are log-add-exp'd, as in ingest.
+
+An edge or node that falls back to RELATES_TO or Entity keeps its old type in
+`extracted_relation` or `extracted_type`, as at ingest.
+
+The duplicates are then deleted. Every batch is its own short write transaction, so locks
+are held only for `batch_size` nodes at a time and an interrupted run can simply be
+restarted. Label, relationship type and node counts are reported before and after.
+
+Afterwards the profile document of every user whose edges moved is rebuilt from the graph,
+and with VECTOR_BACKEND=neo4j their new canonical objects are embedded. The local vector
+backend lives in the API workers' memory: a worker sees the merged objects once it reloads
+the user (after a restart or an LRU eviction).
+"""
+import argparse
+import asyncio
+import json
+import math
+import sys
+import time
+from loguru import logger
+from app import schema
+from app.normalize import vocabulary, Vocabulary, ObjectName, display_name, EXTRACTED_SET, FALLBACK_LABEL, FALLBACK_RELATION
+
+COMPACTION_BATCH_SIZE = 500
+
+
+async def graph_counts(session) -> dict:
+    """
+    Labels and relationship types in use, with node and relationship totals.
+    """
+    result = await session.run("MATCH (n) UNWIND labels(n) AS label RETURN label, count(*) AS n")
+    labels = {record["label"]: record["n"] async for record in result}
+    result = await session.run("MATCH ()-[r]->() RETURN type(r) AS type, count(*) AS n")
+    types = {record["type"]: record["n"] async for record in result}
+    result = await session.run("MATCH (n) RETURN count(n) AS n")
+    record = await result.single()
+    return {
+        "labels": len(labels), "relationship_types": len(types), "nodes": record["n"] if record else 0,
+        "object_nodes": sum(n for label, n in labels.items() if label not in schema.CORE_LABELS),
+        "relationships": sum(types.values()),
+    }
+
+
+def plan_groups(nodes: list[dict], dirty_ids: set[str], vocab: Vocabulary = vocabulary) -> list[tuple[tuple[str, str, str], list[dict]]]:
+    """
+    Group object nodes ({"id", "label", "name", "key"}) by their canonical (label, key).
+
+    Each target is (label, key, name the merged node keeps). Only groups that need work are
+    returned: more than one node, a node whose label or key is not canonical, or a node with
+    a non-canonical edge type (`dirty_ids`).
+    """
+    groups: dict[tuple[str, str], list[dict]] = {}
+    for node in nodes:
+        target = (vocab.label(node["label"]), vocab.key(node["name"]))
+        if target[1]:
+            groups.setdefault(target, []).append(node)
+    planned = []
+    for (label, key), members in groups.items():
+        canonical = [m for m in members if (m["label"], m.get("key")) == (label, key)]
+        if len(members) > 1 or not canonical or any(m["id"] in dirty_ids for m in members):
+            name = canonical[0]["name"] if canonical else display_name(members[0]["name"])
+            planned.append(((label, key, name), members))
+    return planned
+
+
+def _is_canonical(node: dict, target: tuple[str, str, str]) -> bool:
+    return (node["label"], node.get("key")) == target[:2]
+
+
+def _log_add(a: float | None, b: float | None) -> float | None:
+    if a is None or b is None:
+        return a if b is None else b
+    high, low = max(a, b), min(a, b)
+    return high + math.log1p(math.exp(low - high))
+
+
+def _extracted(label: str, rel_type: str, old_label: str | None, old_type: str) -> dict | None:
+    # The old label or type of an object or edge that falls back, as kept at ingest
+    extracted_type = old_label if label == FALLBACK_LABEL and old_label not in (None, FALLBACK_LABEL) else None
+    extracted_relation = old_type if rel_type == FALLBACK_RELATION and old_type != FALLBACK_RELATION else None
+    if extracted_type or extracted_relation:
+        return {"type": extracted_type, "relation": extracted_relation}
+    return None
+
+
+def merge_edges(edges: list[dict], targets: dict[str, tuple[str, str, str]], vocab: Vocabulary = vocabulary,
+                origins: dict[str, str] | None = None) -> dict[tuple[str, str], list[dict]]:
+    """
+    Fold user->object edges onto canonical edges; rows grouped by (label, rel_type) for UNWIND.
+
+    `edges` carry node, uid, type, count, first_seen, last_seen and rank. `targets` maps a node
+    id to its canonical (label, key, name), `origins` to its current label.
+    """
+    merged: dict[tuple[str, str, str, str], dict] = {}
+    for edge in edges:
+        label, key, name = targets[edge["node"]]
+        rel_type = vocab.relation(edge["type"])
+        row = merged.get((label, rel_type, edge["uid"], key))
+        count = edge.get("count") or 1
+        if row is None:
+            merged[(label, rel_type, edge["uid"], key)] = {"uid": edge["uid"], "key": key, "name": name, "count": count, "first_seen": edge.get("first_seen"),
+                           "last_seen": edge.get("last_seen"), "rank": edge.get("rank"),
+                           "extracted": _extracted(label, rel_type, (origins or {}).get(edge["node"]), edge["type"])}
+            continue
+        row["extracted"] = row["extracted"] or _extracted(label, rel_type, (origins or {}).get(edge["node"]), edge["type"])
+        row["count"] += count
+        firsts = [t for t in (row["first_seen"], edge.get("first_seen")) if t is not None]
+        lasts = [t for t in (row["last_seen"], edge.get("last_seen")) if t is not None]
+        row["first_seen"] = min(firsts) if firsts else None
+        row["last_seen"] = max(lasts) if lasts else None
+        row["rank"] = _log_add(row["rank"], edge.get("rank"))
+    rows: dict[tuple[str, str], list[dict]] = {}
+    for (label, rel_type, _, _), row in merged.items():
+        rows.setdefault((label, rel_type), []).append(row)
+    return rows
+
+
+async def _compact_batch_tx(tx, batch: list[tuple[tuple[str, str, str], list[dict]]]) -> tuple[dict, dict]:
+    """
+    Merge one batch of groups; returns its counts and the canonical objects written per user.
+    """
+    targets = {m["id"]: target for target, members in batch for m in members}
+    origins = {m["id"]: m["label"] for _, members in batch for m in members}
+    result = await tx.run(
+        "MATCH (u:User)-[r]->(o) WHERE elementId(o) IN $ids "
+        "RETURN elementId(o) AS node, elementId(r) AS rid, u.uid AS uid, type(r) AS type, "
+        "r.count AS count, r.first_seen AS first_seen, r.last_seen AS last_seen, r.rank AS rank",
+        ids=list(targets),
+    )
+    edges = [dict(record) async for record in result]
+    result = await tx.run("MATCH ()-[r]->() WHERE elementId(r) IN $rids DELETE r", rids=[e["rid"] for e in edges])
+    await result.consume()
+    rows = merge_edges(edges, targets, origins=origins)
+    touched: dict[str, dict[tuple[str, str], list[str]]] = {}
+    for (label, rel_type), group in rows.items():
+        result = await tx.run(
+            f"UNWIND $rows AS row "
+            f"MATCH (u:User {{uid: row.uid}}) "
+            f"MERGE (o:`{label}` {{key: row.key}}) ON CREATE SET o.name = row.name "
+            f"MERGE (u)-[r:`{rel_type}`]->(o) "
+            f"SET r.count = row.count, r.first_seen = row.first_seen, r.last_seen = row.last_seen, r.rank = row.rank"
+            + (EXTRACTED_SET.format(source="row.extracted") if any(row["extracted"] for row in group) else ""),
+            rows=group,
+        )
+        await result.consume()
+        for row in group:
+            touched.setdefault(row["uid"], {}).setdefault((label, rel_type), []).append(ObjectName(row["name"], row["key"]))
+    # Every node that is not already the canonical node goes, once nothing points at it any more
+    drop = [m["id"] for target, members in batch for m in members if not _is_canonical(m, target)]
+    result = await tx.run(
+        "MATCH (o) WHERE elementId(o) IN $ids AND NOT (o)--() DELETE o RETURN count(*) AS deleted", ids=drop,
+    )
+    record = await result.single()
+    return {"edges_read": len(edges), "edges_written": sum(len(group) for group in rows.values()),
+            "nodes_deleted": record["deleted"] if record else 0}, touched
+
+
+async def _object_nodes(session) -> list[dict]:
+    nodes: dict[str, dict] = {}
+    for label in await schema.object_labels(session):
+        result = await session.run(
+            f"MATCH (o:`{label}`) WHERE o.name IS NOT NULL RETURN elementId(o) AS id, o.name AS name, o.key AS key",
+        )
+        async for record in result:
+            nodes.setdefault(record["id"], {"id": record["id"], "label": label, "name": record["name"], "key": record["key"]})
+    return list(nodes.values())
+
+
+async def _dirty_node_ids(session, vocab: Vocabulary) -> set[str]:
+    result = await session.run("CALL db.relationshipTypes() YIELD relationshipType RETURN relationshipType")
+    types = [record["relationshipType"] async for record in result]
+    dirty: set[str] = set()
+    for rel_type in types:
+        if rel_type == "CREATED" or rel_type in vocab.relations:
+            continue
+        result = await session.run(f"MATCH (:User)-[:`{rel_type}`]->(o) RETURN DISTINCT elementId(o) AS id")
+        dirty.update([record["id"] async for record in result])
+    return dirty
+
+
+async def refresh_users(driver, touched: dict[str, dict[tuple[str, str], list[str]]]) -> dict:
+    """
+    Rebuild the profile of every user whose edges were merged, and embed their canonical objects.
+    """
+    import app.graphiti_client as graphiti_client
+    from app import embeddings, profiles
+    counts = {"profiles_rebuilt": 0, "objects_indexed": 0}
+    for uid, groups in touched.items():
+        if profiles.PROFILE_ENABLED:
+            async with driver.session() as session:
+                if await session.execute_write(graphiti_client._rebuild_profile_tx, uid) is not None:
+                    counts["profiles_rebuilt"] += 1
+        if embeddings.configured() and embeddings.VECTOR_BACKEND == "neo4j":
+            counts["objects_indexed"] += await embeddings.index_objects(uid, groups)
+    return counts
+
+
+def _batches(groups, batch_size: int):
+    batch, size = [], 0
+    for group in groups:
+        batch.append(group)
+        size += len(group[1])
+        if size >= batch_size:
+            yield batch
+            batch, size = [], 0
+    if batch:
+        yield batch
+
+
+async def compact(driver, batch_size: int = COMPACTION_BATCH_SIZE, dry_run: bool = False) -> dict:
+    """
+    Merge duplicate object nodes onto the canonical vocabulary; returns before/after counts.
+    """
+    started = time.perf_counter()
+    async with driver.session() as session:
+        before = await graph_counts(session)
+        groups = plan_groups(await _object_nodes(session), await _dirty_node_ids(session, vocabulary))
+    report = {"before": before, "groups": len(groups), "nodes_in_groups": sum(len(m) for _, m in groups),
+              "batches": 0, "edges_read": 0, "edges_written": 0, "nodes_deleted": 0, "dry_run": dry_run}
+    touched: dict[str, dict[tuple[str, str], list[str]]] = {}
+    if dry_run:
+        report["sample"] = [{"target": list(target), "nodes": [[m["label"], m["name"]] for m in members]}
+                            for target, members in groups[:20]]
+        return report
+    for batch in _batches(groups, batch_size):
+        async with driver.session() as session:
+            for label in {target[0] for target, _ in batch}:
+                await schema.ensure_label_index(session, label)
+            counts, batch_touched = await session.execute_write(_compact_batch_tx, batch)
+        for uid, groups in batch_touched.items():
+            for key, names in groups.items():
+                touched.setdefault(uid, {}).setdefault(key, []).extend(names)
+        report["batches"] += 1
+        for name, value in counts.items():
+            report[name] += value
+        logger.info(f"Compaction batch {report['batches']}: {counts}")
+    report.update(await refresh_users(driver, touched))
+    logger.info(f"Refreshed {len(touched)} user(s) after compaction")
+    async with driver.session() as session:
+        report["after"] = await graph_counts(session)
+    report["seconds"] = round(time.perf_counter() - started, 2)
+    return report
+
+
+async def main(argv: list[str] | None = None) -> int:
+    from dotenv import load_dotenv
+    load_dotenv()
+    import app.graphiti_client as graphiti_client
+
+    parser = argparse.ArgumentParser(description="Merge duplicate object nodes onto the canonical graph vocabulary")
+    parser.add_argument("--batch-size", type=int, default=COMPACTION_BATCH_SIZE, help="object nodes per write transaction")
+    parser.add_argument("--dry-run", action="store_true", help="report the merge plan without writing")
+    args = parser.parse_args(argv)
+    driver = graphiti_client.driver
+    try:
+        report = await compact(driver, args.batch_size, args.dry_run)
+    finally:
+        await driver.close()
+    print(json.dumps(report, indent=2, default=str))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
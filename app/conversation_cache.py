@@ -0,0 +1,251 @@
+"""
+Bounded cache of recently ingested conversations, used when Neo4j cannot serve them.
+
+Each user keeps a ring of their last CONVERSATION_CACHE_DEPTH conversations (keyed by
+episode id, so a re-ingested conversation replaces its old copy and becomes the newest). The
+whole cache holds at most CONVERSATION_CACHE_MAX_BYTES of compact JSON; when over budget, the
+oldest conversation of the least recently used user is evicted first.
+
+Two backends: "memory" (per process) and "sqlite", a local file that every worker on the
+host opens, so they share one consistent cache. Hit/miss/eviction counters are per process.
+Async code goes through `put_async`/`recent_async`; the sqlite backend runs them in a worker
+thread, since a write can wait on another process's lock.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from loguru import logger
+
+CONVERSATION_CACHE_BACKEND = os.getenv("CONVERSATION_CACHE_BACKEND", "memory").lower()
+CONVERSATION_CACHE_MAX_BYTES = int(os.getenv("CONVERSATION_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+CONVERSATION_CACHE_DEPTH = int(os.getenv("CONVERSATION_CACHE_DEPTH", "10"))
+CONVERSATION_CACHE_PATH = os.getenv(
+    "CONVERSATION_CACHE_PATH", os.path.join(tempfile.gettempdir(), "preference-backend-conversations.sqlite3")
+)
+
+
+def _encode(conv: list[dict]) -> bytes:
+    return json.dumps(conv, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+class _Counters:
+    def __init__(self):
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "ring_drops": 0, "rejected": 0}
+
+    async def put_async(self, uid: str, episode_id: str, conv: list[dict]) -> None:
+        self.put(uid, episode_id, conv)
+
+    async def recent_async(self, uid: str, n: int) -> list[str]:
+        return self.recent(uid, n)
+
+    def _stats(self, users: int, entries: int, resident_bytes: int, max_bytes: int, depth: int, backend: str) -> dict:
+        lookups = self.counters["hits"] + self.counters["misses"]
+        return {
+            "backend": backend,
+            "users": users,
+            "entries": entries,
+            "resident_bytes": resident_bytes,
+            "max_bytes": max_bytes,
+            "depth": depth,
+            **self.counters,
+            "hit_rate": round(self.counters["hits"] / lookups, 4) if lookups else None,
+        }
+
+
+class MemoryConversationCache(_Counters):
+    """
+    In-process backend: OrderedDict of users (LRU order) -> OrderedDict of episode id -> JSON bytes.
+    """
+
+    def __init__(self, max_bytes: int = CONVERSATION_CACHE_MAX_BYTES, depth: int = CONVERSATION_CACHE_DEPTH):
+        super().__init__()
+        self.max_bytes = max_bytes
+        self.depth = depth
+        self._users: OrderedDict[str, OrderedDict[str, bytes]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def put(self, uid: str, episode_id: str, conv: list[dict]) -> None:
+        payload = _encode(conv)
+        with self._lock:
+            if len(payload) > self.max_bytes or self.depth <= 0:
+                self.counters["rejected"] += 1
+                return
+            ring = self._users.setdefault(uid, OrderedDict())
+            self._users.move_to_end(uid)
+            previous = ring.pop(episode_id, None)
+            if previous is not None:
+                self._bytes -= len(previous)
+            ring[episode_id] = payload
+            self._bytes += len(payload)
+            while len(ring) > self.depth:
+                _, dropped = ring.popitem(last=False)
+                self._bytes -= len(dropped)
+                self.counters["ring_drops"] += 1
+            while self._bytes > self.max_bytes:
+                lru_uid, lru_ring = next(iter(self._users.items()))
+                _, dropped = lru_ring.popitem(last=False)
+                self._bytes -= len(dropped)
+                self.counters["evictions"] += 1
+                if not lru_ring:
+                    del self._users[lru_uid]
+
+    def recent(self, uid: str, n: int) -> list[str]:
+        """
+        Raw JSON of the user's last `n` cached conversations, newest first.
+        """
+        with self._lock:
+            ring = self._users.get(uid)
+            if not ring:
+                self.counters["misses"] += 1
+                return []
+            self._users.move_to_end(uid)
+            self.counters["hits"] += 1
+            return [payload.decode() for payload in reversed(ring.values())][:n]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._users.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = sum(len(ring) for ring in self._users.values())
+            return self._stats(len(self._users), entries, self._bytes, self.max_bytes, self.depth, "memory")
+
+
+class SQLiteConversationCache(_Counters):
+    """
+    Local-file backend shared by every worker process on the host (WAL mode, one short write transaction per put).
+
+    The resident byte total is kept in a one-row `totals` table by triggers, so a put never sums the table.
+    """
+
+    def __init__(self, path: str = CONVERSATION_CACHE_PATH, max_bytes: int = CONVERSATION_CACHE_MAX_BYTES,
+                 depth: int = CONVERSATION_CACHE_DEPTH):
+        super().__init__()
+        self.path = path
+        self.max_bytes = max_bytes
+        self.depth = depth
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(
+                "CREATE TABLE IF NOT EXISTS conversations ("
+                " seq INTEGER PRIMARY KEY AUTOINCREMENT, uid TEXT NOT NULL, episode_id TEXT NOT NULL,"
+                " payload BLOB NOT NULL, size INTEGER NOT NULL, UNIQUE (uid, episode_id));"
+                "CREATE INDEX IF NOT EXISTS conversations_uid_seq ON conversations (uid, seq);"
+                "CREATE TABLE IF NOT EXISTS users (uid TEXT PRIMARY KEY, last_used REAL NOT NULL);"
+                "CREATE INDEX IF NOT EXISTS users_last_used ON users (last_used);"
+                "CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER NOT NULL);"
+                "INSERT OR IGNORE INTO totals (id, bytes) SELECT 0, coalesce(sum(size), 0) FROM conversations;"
+                "CREATE TRIGGER IF NOT EXISTS conversations_added AFTER INSERT ON conversations "
+                "BEGIN UPDATE totals SET bytes = bytes + new.size WHERE id = 0; END;"
+                "CREATE TRIGGER IF NOT EXISTS conversations_removed AFTER DELETE ON conversations "
+                "BEGIN UPDATE totals SET bytes = bytes - old.size WHERE id = 0; END;"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def put(self, uid: str, episode_id: str, conv: list[dict]) -> None:
+        payload = _encode(conv)
+        if len(payload) > self.max_bytes or self.depth <= 0:
+            self.counters["rejected"] += 1
+            return
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Delete and re-insert so an updated conversation gets a fresh seq and counts as newest
+            conn.execute("DELETE FROM conversations WHERE uid = ? AND episode_id = ?", (uid, episode_id))
+            conn.execute(
+                "INSERT INTO conversations (uid, episode_id, payload, size) VALUES (?, ?, ?, ?)",
+                (uid, episode_id, payload, len(payload)),
+            )
+            conn.execute(
+                "INSERT INTO users (uid, last_used) VALUES (?, ?) "
+                "ON CONFLICT (uid) DO UPDATE SET last_used = excluded.last_used",
+                (uid, time.time()),
+            )
+            dropped = conn.execute(
+                "DELETE FROM conversations WHERE uid = ? AND seq NOT IN "
+                "(SELECT seq FROM conversations WHERE uid = ? ORDER BY seq DESC LIMIT ?)",
+                (uid, uid, self.depth),
+            ).rowcount
+            self.counters["ring_drops"] += dropped
+            total = conn.execute("SELECT bytes FROM totals WHERE id = 0").fetchone()[0]
+            while total > self.max_bytes:
+                seq, size, lru_uid = conn.execute(
+                    "SELECT c.seq, c.size, c.uid FROM users u JOIN conversations c ON c.uid = u.uid "
+                    "ORDER BY u.last_used, c.seq LIMIT 1"
+                ).fetchone()
+                conn.execute("DELETE FROM conversations WHERE seq = ?", (seq,))
+                conn.execute(
+                    "DELETE FROM users WHERE uid = ? AND NOT EXISTS (SELECT 1 FROM conversations WHERE uid = ?)",
+                    (lru_uid, lru_uid),
+                )
+                total -= size
+                self.counters["evictions"] += 1
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    async def put_async(self, uid: str, episode_id: str, conv: list[dict]) -> None:
+        try:
+            await asyncio.to_thread(self.put, uid, episode_id, conv)
+        except sqlite3.Error as e:
+            # The cache is best effort; a busy or broken file must not fail the ingest
+            logger.warning(f"Conversation cache write failed for uid={uid}: {e}")
+
+    async def recent_async(self, uid: str, n: int) -> list[str]:
+        return await asyncio.to_thread(self.recent, uid, n)
+
+    def recent(self, uid: str, n: int) -> list[str]:
+        """
+        Raw JSON of the user's last `n` cached conversations, newest first.
+        """
+        conn = self._connect()
+        rows = conn.execute(
+            "SELECT payload FROM conversations WHERE uid = ? ORDER BY seq DESC LIMIT ?", (uid, n)
+        ).fetchall()
+        if not rows:
+            self.counters["misses"] += 1
+            return []
+        self.counters["hits"] += 1
+        conn.execute("UPDATE users SET last_used = ? WHERE uid = ?", (time.time(), uid))
+        return [bytes(payload).decode() for (payload,) in rows]
+
+    def clear(self) -> None:
+        conn = self._connect()
+        conn.execute("DELETE FROM conversations")
+        conn.execute("DELETE FROM users")
+
+    def stats(self) -> dict:
+        conn = self._connect()
+        entries = conn.execute("SELECT count(*) FROM conversations").fetchone()[0]
+        resident = conn.execute("SELECT bytes FROM totals WHERE id = 0").fetchone()[0]
+        users = conn.execute("SELECT count(*) FROM users").fetchone()[0]
+        return {**self._stats(users, entries, resident, self.max_bytes, self.depth, "sqlite"), "path": self.path}
+
+
+def make_conversation_cache(backend: str = CONVERSATION_CACHE_BACKEND):
+    if backend == "sqlite":
+        return SQLiteConversationCache()
+    if backend != "memory":
+        raise ValueError(f"Unknown CONVERSATION_CACHE_BACKEND: {backend}")
+    return MemoryConversationCache()
+
+
+# Process-wide cache of recent conversations filled at ingest
+conversation_cache = make_conversation_cache()
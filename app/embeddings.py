@@ -0,0 +1,294 @@
+"""
+Object embeddings for context-aware preference retrieval.
+
+After ingest, a background job embeds the user's new preference objects. It calls the
+OpenAI-compatible /embeddings endpoint with EMBEDDING_MODEL_NAME in batches. Vectors are
+stored in one of two backends, selected by VECTOR_BACKEND:
+- "neo4j": a vector index on the object nodes.
+- "local": an in-process NumPy matrix per user. Each process builds a user's matrix from their
+  preference objects in Neo4j the first time it touches that user (after a restart, or on
+  another worker), then keeps it current from its own ingests. Other workers' later ingests
+  are not seen until the user is evicted from the LRU, so multi-worker deployments should
+  prefer "neo4j".
+
+Query texts such as the previous question are memoized in an LRU, so a repeated context
+makes no embedding call. Retrieval is a vectorized top-k cosine search.
+"""
+import asyncio
+import os
+from collections import OrderedDict
+import numpy as np
+from loguru import logger
+from app.llm import llm
+from app.metrics import timed_query
+from app.ingest_queue import background_queue, QueueFullError
+from app.normalize import object_key
+
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "2048"))
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "local").lower()
+# Neo4j backend: index candidates fetched per requested preference before restricting to the user's objects
+VECTOR_OVERSAMPLE = int(os.getenv("VECTOR_OVERSAMPLE", "20"))
+VECTOR_LOCAL_MAX_USERS = int(os.getenv("VECTOR_LOCAL_MAX_USERS", "10000"))
+# Local backend: preference objects (best ranked first) loaded from the graph to build a user's matrix
+VECTOR_LOCAL_REBUILD_LIMIT = int(os.getenv("VECTOR_LOCAL_REBUILD_LIMIT", "1000"))
+# Objects at or below this cosine similarity are not considered related to the context
+VECTOR_MIN_SCORE = float(os.getenv("VECTOR_MIN_SCORE", "0.0"))
+
+VECTOR_INDEX_NAME = "object_embedding"
+# Extra label carried by object nodes that have an `embedding` (the vector index is on it)
+EMBEDDED_LABEL = "Embedded"
+
+
+def configured() -> bool:
+    return bool(EMBEDDING_MODEL_NAME) and llm.configured
+
+
+class EmbeddingCache:
+    """
+    LRU of text -> unit-length vector.
+    """
+
+    def __init__(self, max_entries: int = EMBEDDING_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._counters = {"hits": 0, "misses": 0}
+
+    def get(self, text: str) -> np.ndarray | None:
+        vector = self._entries.get(text)
+        if vector is None:
+            self._counters["misses"] += 1
+            return None
+        self._entries.move_to_end(text)
+        self._counters["hits"] += 1
+        return vector
+
+    def set(self, text: str, vector: np.ndarray) -> None:
+        self._entries[text] = vector
+        self._entries.move_to_end(text)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "max_entries": self.max_entries, **self._counters}
+
+
+embedding_cache = EmbeddingCache()
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+async def embed_texts(texts: list[str]) -> np.ndarray:
+    """
+    Return unit-length embeddings for `texts` (one row each, in order).
+
+    Texts missing from the LRU are sent in batches of EMBEDDING_BATCH_SIZE, concurrently.
+    """
+    vectors = {text: embedding_cache.get(text) for text in dict.fromkeys(texts)}
+    missing = [text for text, vector in vectors.items() if vector is None]
+    batches = [missing[i:i + EMBEDDING_BATCH_SIZE] for i in range(0, len(missing), EMBEDDING_BATCH_SIZE)]
+    results = await asyncio.gather(*(llm.embed(batch, model=EMBEDDING_MODEL_NAME) for batch in batches))
+    for batch, embedded in zip(batches, results):
+        for text, vector in zip(batch, _normalize(np.asarray(embedded, dtype=np.float32))):
+            embedding_cache.set(text, vector)
+            vectors[text] = vector
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.stack([vectors[text] for text in texts])
+
+
+async def embed_query(text: str) -> np.ndarray:
+    return (await embed_texts([text]))[0]
+
+
+class LocalVectorIndex:
+    """
+    Per-user matrix of object embeddings (rows unit-length), LRU-bounded by user.
+
+    A user missing from the LRU is (re)built from their preference objects in the graph
+    before it is searched or extended.
+    """
+
+    def __init__(self, max_users: int = VECTOR_LOCAL_MAX_USERS, rebuild_limit: int = VECTOR_LOCAL_REBUILD_LIMIT):
+        self.max_users = max_users
+        self.rebuild_limit = rebuild_limit
+        self._users: OrderedDict[str, tuple[list[str], np.ndarray | None]] = OrderedDict()
+
+    async def _add(self, uid: str, names: list[str]) -> int:
+        known, _ = self._users.get(uid, ([], None))
+        new = [name for name in dict.fromkeys(names) if name not in known]
+        vectors = await embed_texts(new) if new else None
+        # Another job may have indexed some of these names while we were waiting on the embeddings
+        known, matrix = self._users.get(uid, ([], None))
+        keep = [i for i, name in enumerate(new) if name not in known]
+        if keep:
+            new, vectors = [new[i] for i in keep], vectors[keep]
+            matrix = vectors if matrix is None else np.vstack([matrix, vectors])
+            known = known + new
+        self._users[uid] = (known, matrix)
+        self._users.move_to_end(uid)
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+        return len(keep)
+
+    async def _load(self, uid: str) -> int:
+        """
+        Build the user's matrix from their ranked preference objects in Neo4j.
+        """
+        import app.graphiti_client as graphiti_client
+        names = await graphiti_client.get_ranked_preferences(uid, self.rebuild_limit)
+        count = await self._add(uid, names)
+        if count:
+            logger.info(f"Rebuilt local vector index of uid={uid} from {count} graph object(s)")
+        return count
+
+    async def index(self, uid: str, objects: list[tuple[str, str]]) -> int:
+        count = 0
+        if uid not in self._users:
+            try:
+                # Includes these objects: the index job runs after their write committed
+                count = await self._load(uid)
+            except Exception as e:
+                logger.warning(f"Local vector index rebuild failed for uid={uid}: {e}")
+        names = [name for _, name in objects]
+        if uid not in self._users and not names:
+            return count
+        return count + await self._add(uid, names)
+
+    async def search(self, uid: str, vector: np.ndarray, k: int) -> list[str]:
+        if k <= 0:
+            return []
+        if uid not in self._users:
+            try:
+                await self._load(uid)
+            except Exception as e:
+                # Retrieval falls back to the ranked preferences
+                logger.warning(f"Local vector index rebuild failed for uid={uid}: {e}")
+                return []
+        names, matrix = self._users[uid]
+        if matrix is None:
+            return []
+        scores = matrix @ vector
+        candidates = np.flatnonzero(scores > VECTOR_MIN_SCORE)
+        k = min(k, len(candidates))
+        if k == 0:
+            return []
+        top = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        return [names[i] for i in top[np.argsort(-scores[top])]]
+
+
+class Neo4jVectorIndex:
+    """
+    Embeddings stored on the object nodes, searched through the `object_embedding` vector index.
+    """
+
+    async def index(self, uid: str, objects: list[tuple[str, str]]) -> int:
+        from app.graphiti_client import driver
+        by_label: dict[str, list[str]] = {}
+        for label, name in objects:
+            by_label.setdefault(label, []).append(object_key(name))
+
+        @timed_query("vector_missing")
+        async def missing_tx(tx) -> list[tuple[str, str, str]]:
+            missing = []
+            for label, keys in by_label.items():
+                result = await tx.run(
+                    f"UNWIND $keys AS key MATCH (o:`{label}` {{key: key}}) "
+                    f"WHERE o.embedding IS NULL RETURN DISTINCT key, o.name AS name",
+                    keys=keys,
+                )
+                missing.extend([(label, record["key"], record["name"]) async for record in result])
+            return missing
+
+        async with driver.session() as session:
+            missing = await session.execute_read(missing_tx)
+        if not missing:
+            return 0
+        # Embedding is an HTTP round trip: no session is held while it runs
+        vectors = await embed_texts([name for _, _, name in missing])
+        rows: dict[str, list[dict]] = {}
+        for (label, key, _), vector in zip(missing, vectors):
+            rows.setdefault(label, []).append({"key": key, "vector": vector.tolist()})
+
+        @timed_query("vector_write")
+        async def write_tx(tx) -> None:
+            for label, group in rows.items():
+                result = await tx.run(
+                    f"UNWIND $rows AS row MATCH (o:`{label}` {{key: row.key}}) "
+                    f"SET o:`{EMBEDDED_LABEL}`, o.embedding = row.vector",
+                    rows=group,
+                )
+                await result.consume()
+
+        async with driver.session() as session:
+            await session.execute_write(write_tx)
+        return len(missing)
+
+    async def search(self, uid: str, vector: np.ndarray, k: int) -> list[str]:
+        from app.graphiti_client import driver, PREFERENCE_RELATIONS, PREFERENCE_LABELS
+
+        @timed_query("vector_search")
+        async def work(tx):
+            result = await tx.run(
+                "CALL db.index.vector.queryNodes($index, $candidates, $vector) YIELD node AS o, score "
+                "MATCH (u:User {uid: $uid})-[r]->(o) "
+                "WHERE score > $min_score AND (type(r) IN $relations OR any(label IN labels(o) WHERE label IN $labels)) "
+                "WITH coalesce(o.name, o.text) AS name, max(score) AS score "
+                "RETURN name ORDER BY score DESC LIMIT $k",
+                index=VECTOR_INDEX_NAME, candidates=k * VECTOR_OVERSAMPLE, vector=vector.tolist(),
+                uid=uid, relations=PREFERENCE_RELATIONS, labels=PREFERENCE_LABELS, k=k, min_score=VECTOR_MIN_SCORE,
+            )
+            return [record["name"] async for record in result]
+
+        async with driver.session() as session:
+            return await session.execute_read(work)
+
+
+def make_vector_index(backend: str = VECTOR_BACKEND):
+    if backend == "neo4j":
+        return Neo4jVectorIndex()
+    if backend != "local":
+        raise ValueError(f"Unknown VECTOR_BACKEND: {backend}")
+    return LocalVectorIndex()
+
+
+vector_index = make_vector_index()
+
+
+def preference_objects(groups: dict[tuple[str, str], list[str]]) -> list[tuple[str, str]]:
+    """
+    (label, name) of the objects in `groups` whose relation type or label counts as a preference.
+    """
+    from app.graphiti_client import PREFERENCE_RELATIONS, PREFERENCE_LABELS
+    return [
+        (label, name)
+        for (label, rel_type), names in groups.items()
+        if rel_type in PREFERENCE_RELATIONS or label in PREFERENCE_LABELS
+        for name in names
+    ]
+
+
+async def index_objects(uid: str, groups: dict[tuple[str, str], list[str]]) -> int:
+    """
+    Embed and store the preference objects of freshly written relation groups.
+    """
+    count = await vector_index.index(uid, preference_objects(groups))
+    if count:
+        logger.info(f"Embedded {count} preference object(s) for uid={uid}")
+    return count
+
+
+def schedule_index(uid: str, groups: dict[tuple[str, str], list[str]]) -> None:
+    if not configured() or not preference_objects(groups):
+        return
+    try:
+        background_queue.submit(uid, index_objects, uid, groups)
+    except QueueFullError:
+        logger.warning(f"Background queue full; skipped preference embeddings for uid={uid}")
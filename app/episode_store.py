@@ -0,0 +1,115 @@
+"""
+Compact Episode transcript storage and the paging helpers of /get_conversations.
+
+New Episodes keep the transcript as a zlib-compressed blob of its JSON in `e.conversation_z`,
+with the uncompressed size in `e.conversation_bytes` next to `e.turn_count`. Legacy rows that
+hold a plain JSON string in `e.conversation` are read alongside, and are converted the next
+time the Episode is rewritten. Transcripts moved to the archive by the retention job leave an
+"archive:..." pointer in `e.archive_ref`. Read transactions return the stored values as they
+are; `resolve` turns them into transcripts after the transaction, reading archived ones in a
+worker thread so file I/O never runs on the event loop or inside a Neo4j transaction.
+"""
+import asyncio
+import base64
+import json
+import os
+import zlib
+from loguru import logger
+
+# "compressed" (default) or "json" to keep writing the legacy uncompressed string
+EPISODE_STORAGE = os.getenv("EPISODE_STORAGE", "compressed").lower()
+EPISODE_COMPRESSION_LEVEL = int(os.getenv("EPISODE_COMPRESSION_LEVEL", "6"))
+
+# Cypher expression returning whichever transcript form an Episode `e` has (or its archive pointer)
+STORED_CONVERSATION = "coalesce(e.conversation_z, e.conversation, e.archive_ref)"
+ARCHIVE_PREFIX = "archive:"
+
+
+def pack(conv_json: str) -> dict:
+    """
+    Query parameters for storing a transcript: conv_z (blob), conv_bytes and conv_legacy.
+    """
+    raw = conv_json.encode()
+    if EPISODE_STORAGE == "json":
+        return {"conv_z": None, "conv_bytes": len(raw), "conv_legacy": conv_json}
+    return {"conv_z": zlib.compress(raw, EPISODE_COMPRESSION_LEVEL), "conv_bytes": len(raw), "conv_legacy": None}
+
+
+def is_archived(stored) -> bool:
+    return isinstance(stored, str) and stored.startswith(ARCHIVE_PREFIX)
+
+
+def unpack(stored) -> str | None:
+    """
+    Transcript JSON text of an inline storage form (compressed blob or legacy string).
+
+    Archive pointers are not read here; see `resolve`.
+    """
+    if is_archived(stored):
+        raise ValueError(f"archived transcript must be read with resolve(): {stored}")
+    if stored is None or isinstance(stored, str):
+        return stored
+    return zlib.decompress(bytes(stored)).decode()
+
+
+def _read_archived(refs: list[str]) -> dict[str, str | None]:
+    from app.archive import archive_store
+    texts: dict[str, str | None] = {}
+    for ref in refs:
+        try:
+            texts[ref] = archive_store.read(ref)
+        except (OSError, ValueError) as e:
+            # A purged or damaged segment costs this one transcript, not the whole read
+            logger.error(f"Archived transcript {ref} is unreadable: {e}")
+            texts[ref] = None
+    return texts
+
+
+async def resolve(values: list) -> list[str | None]:
+    """
+    Transcript JSON texts of stored values (`STORED_CONVERSATION`), in order.
+
+    Archived transcripts are read in a worker thread; one whose segment is missing comes back
+    as None.
+    """
+    refs = [value for value in values if is_archived(value)]
+    archived = await asyncio.to_thread(_read_archived, refs) if refs else {}
+    return [archived[value] if is_archived(value) else unpack(value) for value in values]
+
+
+def encode_cursor(created_at: str, episode_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([created_at, episode_id]).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[str, str]:
+    """
+    (created_at ISO string, episode id) from a cursor; raises ValueError when malformed.
+    """
+    try:
+        created_at, episode_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except Exception as e:
+        raise ValueError(f"invalid cursor: {cursor}") from e
+    return str(created_at), str(episode_id)
+
+
+def parse_turns(spec: str | None) -> slice | None:
+    """
+    Python-style turn range "start:stop" (either side optional, negatives allowed).
+    """
+    if not spec:
+        return None
+    start, _, stop = spec.partition(":")
+    return slice(int(start) if start else None, int(stop) if stop else None)
+
+
+def project_turns(conv_json: str, turns: slice | None) -> str:
+    """
+    The stored JSON itself when no turn range is asked for; otherwise the decoded, sliced turns.
+    """
+    if turns is None:
+        # Transcripts are always written as a JSON array; anything else is returned as a JSON string
+        return conv_json if conv_json.lstrip().startswith("[") else json.dumps(conv_json)
+    try:
+        return json.dumps(json.loads(conv_json)[turns])
+    except ValueError:
+        return json.dumps(conv_json)
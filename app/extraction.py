@@ -0,0 +1,189 @@
+"""
+Token-budgeted relationship extraction over long conversations.
+
+A transcript is no longer sent to the LLM in one request. Instead:
+- turns are packed, in order, into windows of about EXTRACTION_WINDOW_TOKENS estimated tokens;
+- each window also shows the EXTRACTION_OVERLAP_TURNS turns before it, as context only, so a
+  relation split across a boundary is still understood;
+- windows are extracted concurrently (at most EXTRACTION_CONCURRENCY at a time), so latency
+  follows the longest window rather than the whole conversation;
+- the per-window relations are merged and deduplicated before anything is written.
+
+The model's output is read with `RelationParser`, an incremental parser that yields every
+complete object of the JSON array as soon as its closing brace arrives. Output cut off by the
+token limit therefore keeps all the relations before the cut, where the old
+`find('[')`/`rfind(']')` parse dropped the whole array.
+"""
+import asyncio
+import json
+import os
+from collections.abc import Awaitable, Callable, Iterable
+from loguru import logger
+from app.summaries import estimate_tokens
+
+# Estimated tokens of new turns per extraction request
+EXTRACTION_WINDOW_TOKENS = int(os.getenv("EXTRACTION_WINDOW_TOKENS", "2000"))
+# Turns before each window shown as read-only context
+EXTRACTION_OVERLAP_TURNS = int(os.getenv("EXTRACTION_OVERLAP_TURNS", "2"))
+# Windows of one conversation extracted at the same time
+EXTRACTION_CONCURRENCY = int(os.getenv("EXTRACTION_CONCURRENCY", "4"))
+# Completion limit per window
+EXTRACTION_MAX_TOKENS = int(os.getenv("EXTRACTION_MAX_TOKENS", "800"))
+
+RELATION_FIELDS = ("relation", "object", "object_type")
+
+
+def format_turns(turns: list[dict]) -> str:
+    return "\n".join(f"{turn.get('speaker')}: {turn.get('text', '')}" for turn in turns)
+
+
+def windows(conv: list[dict], context: list[dict] | None = None, budget: int = EXTRACTION_WINDOW_TOKENS,
+            overlap: int = EXTRACTION_OVERLAP_TURNS) -> list[tuple[list[dict], list[dict]]]:
+    """
+    Split `conv` into consecutive (turns, context) windows of about `budget` estimated tokens.
+
+    Every turn is extracted in exactly one window; a turn larger than the budget gets a window
+    of its own. The first window keeps the caller's `context`, later ones the `overlap` turns
+    before them.
+    """
+    result: list[tuple[list[dict], list[dict]]] = []
+    start = 0
+    while start < len(conv):
+        end, used = start, 0
+        while end < len(conv):
+            cost = estimate_tokens(format_turns([conv[end]]))
+            if end > start and used + cost > budget:
+                break
+            used += cost
+            end += 1
+        before = conv[max(0, start - overlap):start] if start else list(context or [])
+        result.append((conv[start:end], before))
+        start = end
+    return result
+
+
+class RelationParser:
+    """
+    Incremental parser for a JSON array of relation objects embedded in model output.
+
+    `feed` takes text as it arrives (a whole completion or streamed deltas) and returns the
+    objects completed by it. Text before the first '[' is ignored, as are elements that are
+    not objects or fail to decode. `started` tells whether an array was found, `complete`
+    whether it was closed.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self.started = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._object_start: int | None = None
+        self.complete = False
+        self.skipped = 0
+
+    def feed(self, text: str) -> list[dict]:
+        objects: list[dict] = []
+        if self.complete:
+            return objects
+        self._buffer += text
+        buffer = self._buffer
+        pos = self._pos
+        while pos < len(buffer):
+            char = buffer[pos]
+            if not self.started:
+                self.started = char == "["
+            elif self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                if self._depth == 0 and char == "{":
+                    self._object_start = pos
+                self._depth += 1
+            elif char in "}]":
+                if self._depth == 0:
+                    # The top-level array closed
+                    self.complete = char == "]"
+                    if self.complete:
+                        break
+                else:
+                    self._depth -= 1
+                    if self._depth == 0 and self._object_start is not None:
+                        self._emit(buffer[self._object_start:pos + 1], objects)
+                        self._object_start = None
+            pos += 1
+        # Keep only the unfinished object, if any
+        keep = self._object_start if self._object_start is not None else pos
+        self._buffer = buffer[keep:]
+        self._pos = pos - keep
+        if self._object_start is not None:
+            self._object_start = 0
+        return objects
+
+    def _emit(self, text: str, objects: list[dict]) -> None:
+        try:
+            value = json.loads(text)
+        except ValueError:
+            self.skipped += 1
+            return
+        if isinstance(value, dict):
+            objects.append(value)
+
+
+def parse_relations(content: str) -> list[dict]:
+    """
+    Every complete relation object in `content`, including from a truncated array.
+    """
+    parser = RelationParser()
+    rels = parser.feed(content)
+    if not parser.started:
+        logger.error(f"No JSON array found in LLM output: {content}")
+    elif not parser.complete:
+        logger.warning(f"LLM output truncated; recovered {len(rels)} complete relation(s)")
+    if parser.skipped:
+        logger.warning(f"Skipped {parser.skipped} malformed relation object(s) in LLM output")
+    return rels
+
+
+def merge_relations(batches: Iterable[list[dict]]) -> list[dict]:
+    """
+    Concatenate per-window relations in order, dropping repeats (compared trimmed and case-folded).
+    """
+    seen: set[tuple[str, ...]] = set()
+    merged: list[dict] = []
+    for rels in batches:
+        for rel in rels:
+            key = tuple(" ".join(str(rel.get(field) or "").split()).casefold() for field in RELATION_FIELDS)
+            if key in seen:
+                continue
+            seen.add(key)
+            merged.append(rel)
+    return merged
+
+
+async def gather_bounded(calls: list[Callable[[], Awaitable]], limit: int = EXTRACTION_CONCURRENCY) -> list:
+    """
+    Run the coroutine factories `calls` with at most `limit` running at once; the first failure
+    cancels the rest. Each coroutine is created only once it has a slot, so none is left unawaited.
+    """
+    semaphore = asyncio.Semaphore(max(1, limit))
+
+    async def run(call: Callable[[], Awaitable]):
+        async with semaphore:
+            return await call()
+
+    tasks = [asyncio.ensure_future(run(call)) for call in calls]
+    try:
+        return list(await asyncio.gather(*tasks))
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
@@ -1,178 +1,679 @@
+import asyncio
+import functools
+import hashlib
+import inspect
+import math
 import os
+from collections.abc import AsyncIterator
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
 from dotenv import load_dotenv
-import httpx
 import json
-import re
 import uuid
-from neo4j import GraphDatabase
 from loguru import logger
-# Attempt to import Graphiti client and LLM client, with stubs if unavailable
-try:
-    from graphiti_core import Graphiti
-    from graphiti_core.llm_client import OpenAIGenericClient
-    _USE_GRAPHITI = True
-except ImportError:
-    class OpenAIGenericClient:
-        def __init__(self, *args, **kwargs):
-            pass
-
-    class Graphiti:
-        def __init__(self, *args, **kwargs):
-            pass
-
-        def add_episode(self, uid, conversation):
-            # stub that returns dummy episode with id equal to uid
-            class Episode:
-                id = uid
-            return Episode()
-    _USE_GRAPHITI = False
+from app import schema
+from app.llm import llm
+from app.cache import summary_cache
+from app.conversation_cache import conversation_cache
+from app.question_buffer import question_buffer
+from app import embeddings
+from app import episode_store
+from app import summaries
+from app import extraction
+from app import profiles
+from app.normalize import vocabulary, ObjectName, extracted, object_key, EXTRACTED_SET, FALLBACK_LABEL, FALLBACK_RELATION
+from app.metrics import timed_query, PARSE_SECONDS, INGEST_RELATIONS
+from app.ingest_queue import background_queue, QueueFullError
+from app.services import services, LazyDriver, graphiti_available, unavailable_errors
 
 # Environment variables
-NEO4J_URI = os.getenv("NEO4J_URI")
-NEO4J_USER = os.getenv("NEO4J_USER")
-NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD")
 OPENAI_API_BASE = os.getenv("OPENAI_API_BASE")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-MODEL_NAME = os.getenv("NEBIUS_MODEL_NAME")
-EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME")
-GRAPHITI_LLM_TIMEOUT = int(os.getenv("GRAPHITI_LLM_TIMEOUT", "25"))
-
-# Honor USE_GRAPHITI override: set to "false" to disable Graphiti core ingestion and use manual fallback
-USE_GRAPHITI_ENV = os.getenv("USE_GRAPHITI", "true").lower() in ("true","1","yes")
-if not USE_GRAPHITI_ENV:
-    logger.info("USE_GRAPHITI environment flag is false; disabling Graphiti core ingestion.")
-    _USE_GRAPHITI = False
-
-# Initialize LLM client
-llm_client = OpenAIGenericClient(
-    base_url=OPENAI_API_BASE,
-    api_key=OPENAI_API_KEY,
-    model_name=MODEL_NAME,
-    timeout=GRAPHITI_LLM_TIMEOUT,
-)
+# When to compute the per-episode summary: "inline" (alongside extraction), "background" (background queue job) or "off"
+EPISODE_SUMMARY_MODE = os.getenv("EPISODE_SUMMARY_MODE", "inline").lower()
+# Already-ingested turns sent as read-only context when only appended turns are extracted
+DELTA_CONTEXT_TURNS = int(os.getenv("DELTA_CONTEXT_TURNS", "4"))
+# Relation types and object labels whose edges count as preferences, and the half-life of a mention's weight
+PREFERENCE_RELATIONS = [r.strip().upper() for r in os.getenv(
+    "PREFERENCE_RELATIONS", "LIKES,LOVES,ENJOYS,PREFERS,WANTS,VALUES,INTERESTED_IN").split(",") if r.strip()]
+PREFERENCE_LABELS = [l.strip().capitalize() for l in os.getenv(
+    "PREFERENCE_LABELS", "Preference,Interest,Hobby,Activity,Food").split(",") if l.strip()]
+PREFERENCE_HALF_LIFE_DAYS = float(os.getenv("PREFERENCE_HALF_LIFE_DAYS", "30"))
+# Preference labels and relation types are always canonical, so normalization never maps them away
+vocabulary.extend(labels={label: [] for label in PREFERENCE_LABELS}, relations={rel: [] for rel in PREFERENCE_RELATIONS})
+# Maintains the per-user profile document inside the ingest write transactions
+profile_builder = profiles.ProfileBuilder(PREFERENCE_RELATIONS, PREFERENCE_LABELS)
+
+# Graphiti core ingestion when graphiti_core is installed and USE_GRAPHITI is not false;
+# the package itself is only imported when the Graphiti client is first used
+_USE_GRAPHITI = graphiti_available()
+
+# Neo4j driver, created by the service container on first use
+driver = LazyDriver(services)
+
+class EpisodeConflictError(ValueError):
+    """Raised when a conversation_id is already stored as another user's Episode."""
+
+def conversation_hash(conv: list[dict]) -> str:
+    """
+    Stable digest of a conversation's turns, used to recognise unchanged and appended re-posts.
+    """
+    canonical = json.dumps([[turn.get("speaker"), turn.get("text", "")] for turn in conv],
+                           ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+@dataclass
+class EpisodePlan:
+    """
+    What an ingest of one conversation has to do, decided against the stored Episode.
+
+    `mode` is "new" (no Episode yet), "full" (content changed, re-extract everything),
+    "delta" (turns appended; extract from `extract_from` on), "unchanged" or "stale"
+    (older `updated_at` than what is stored); the last two are no-ops. `relations` are the
+    relations the stored Episode already counted (see `_unrecorded`).
+    """
+    episode_id: str
+    mode: str
+    content_hash: str
+    turn_count: int
+    created_at: datetime | None = None
+    updated_at: datetime | None = None
+    extract_from: int = 0
+    previous_summary: str | None = None
+    relations: list[str] = field(default_factory=list)
+
+    @property
+    def skip(self) -> bool:
+        return self.mode in ("unchanged", "stale")
+
+    def meta(self) -> dict:
+        return {
+            "content_hash": self.content_hash,
+            "turn_count": self.turn_count,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+            "relations": self.relations,
+        }
+
+    def pending_meta(self) -> dict:
+        """
+        Meta for storing the transcript before extraction: the Episode keeps the content hash, turn
+        count and relations of what was last extracted, so a failed extraction is redone by the next post.
+        """
+        return {**self.meta(), "content_hash": None, "turn_count": None, "relations": None}
+
+@timed_query("episode_state")
+async def _episode_state_tx(tx, episode_id: str) -> dict | None:
+    result = await tx.run(
+        "MATCH (e:Episode {id: $episode_id}) "
+        "OPTIONAL MATCH (u:User)-[:CREATED]->(e) "
+        "RETURN u.uid AS uid, e.content_hash AS content_hash, e.turn_count AS turn_count, "
+        "e.updated_at AS updated_at, e.summary AS summary, e.relations AS relations LIMIT 1",
+        episode_id=episode_id,
+    )
+    record = await result.single()
+    return dict(record) if record is not None else None
+
+async def read_episode_state(episode_id: str) -> dict | None:
+    async with driver.session() as session:
+        return await session.execute_read(_episode_state_tx, episode_id)
+
+def as_utc(value: datetime | None) -> datetime | None:
+    """
+    Timezone-aware UTC form of a client timestamp; naive ones are taken to be UTC.
+
+    Every stored `created_at`/`updated_at` is then a zoned DateTime, like the server-side
+    `datetime()` default, so they order and page consistently.
+    """
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+def _is_older(incoming: datetime | None, stored) -> bool:
+    if incoming is None or stored is None:
+        return False
+    if hasattr(stored, "to_native"):
+        stored = stored.to_native()
+    try:
+        return incoming < stored
+    except TypeError:
+        # Naive vs. aware timestamps cannot be ordered; treat the re-post as current
+        return False
+
+async def plan_episode(uid: str, conv: list[dict], conversation_id: str | None = None,
+                       created_at: datetime | None = None, updated_at: datetime | None = None) -> EpisodePlan:
+    """
+    Decide how to ingest `conv`, keyed on the client's conversation_id.
 
-# Initialize Neo4j driver
-driver = GraphDatabase.driver(
-    NEO4J_URI,
-    auth=(NEO4J_USER, NEO4J_PASSWORD),
+    Without a conversation_id every ingest is a new Episode with a random id.
+    """
+    created_at, updated_at = as_utc(created_at), as_utc(updated_at)
+    plan = EpisodePlan(
+        episode_id=conversation_id or str(uuid.uuid4()), mode="new",
+        content_hash=conversation_hash(conv), turn_count=len(conv),
+        created_at=created_at, updated_at=updated_at,
+    )
+    if conversation_id is None:
+        return plan
+    state = await read_episode_state(conversation_id)
+    if state is None:
+        return plan
+    if state.get("uid") not in (None, uid):
+        raise EpisodeConflictError(f"conversation_id {conversation_id} belongs to another user")
+    plan.relations = list(state.get("relations") or [])
+    stored_turns = state.get("turn_count") or 0
+    if state.get("content_hash") == plan.content_hash:
+        plan.mode = "unchanged"
+    elif _is_older(updated_at, state.get("updated_at")):
+        plan.mode = "stale"
+    elif 0 < stored_turns < len(conv) and conversation_hash(conv[:stored_turns]) == state.get("content_hash"):
+        plan.mode = "delta"
+        plan.extract_from = stored_turns
+        plan.previous_summary = state.get("summary")
+    else:
+        plan.mode = "full"
+    logger.info(f"Episode {plan.episode_id} for uid={uid}: {plan.mode} ({stored_turns} -> {len(conv)} turns)")
+    return plan
+
+def _sanitize_relations(rels: list[dict]) -> dict[tuple[str, str], list[str]]:
+    """
+    Normalize LLM relations onto the canonical vocabulary and group the object names by (label, rel_type).
+
+    Names with the same key within a group are dropped (the first spelling is kept) so each
+    UNWIND row is one MERGE.
+    """
+    with PARSE_SECONDS.time(stage="sanitize"):
+        return _group_relations(rels)
+
+def _group_relations(rels: list[dict]) -> dict[tuple[str, str], list[str]]:
+    groups: dict[tuple[str, str], list[str]] = {}
+    for rel in rels:
+        if not isinstance(rel, dict):
+            continue
+        # Canonical relationship type, object label and object name with its folded key (see app.normalize)
+        rel_type = vocabulary.relation(rel.get("relation"))
+        obj_type = vocabulary.label(rel.get("object_type"))
+        obj = vocabulary.name(rel.get("object"))
+        if not obj and vocabulary.enabled:
+            continue
+        if vocabulary.enabled and (obj_type == FALLBACK_LABEL or rel_type == FALLBACK_RELATION):
+            # Keep what the model said alongside the fallback (see app.normalize)
+            raw_type, raw_relation = str(rel.get("object_type") or ""), str(rel.get("relation") or "")
+            obj = ObjectName(obj, obj.key, raw_type if obj_type == FALLBACK_LABEL and raw_type else None,
+                             raw_relation if rel_type == FALLBACK_RELATION and raw_relation else None)
+        names = groups.setdefault((obj_type, rel_type), [])
+        if not any(object_key(name) == obj.key for name in names):
+            names.append(obj)
+    return groups
+
+def mention_rank(seen: datetime) -> float:
+    """
+    Log-weight of one mention at `seen`: log(2 ** (days since epoch / half-life)).
+    """
+    return seen.timestamp() / 86400 * math.log(2) / PREFERENCE_HALF_LIFE_DAYS
+
+def _mention_time(meta: dict | None) -> datetime:
+    seen = (meta or {}).get("updated_at") or datetime.now(timezone.utc)
+    return seen if seen.tzinfo is not None else seen.replace(tzinfo=timezone.utc)
+
+# Counters kept on every user->object edge. `rank` is the log of the summed mention weights
+# (see `mention_rank`), so ordering by it equals ordering by the exponentially decayed mention
+# count at any read time. A new mention is folded in with a numerically stable log-add-exp.
+_EDGE_COUNTERS = (
+    "ON CREATE SET r.count = 1, r.first_seen = {seen}, r.last_seen = {seen}, r.rank = {rank} "
+    "ON MATCH SET r.count = coalesce(r.count, 0) + 1, r.first_seen = coalesce(r.first_seen, {seen}), "
+    "r.last_seen = CASE WHEN r.last_seen IS NULL OR r.last_seen < {seen} THEN {seen} ELSE r.last_seen END, "
+    "r.rank = CASE WHEN r.rank IS NULL THEN {rank} "
+    "WHEN r.rank >= {rank} THEN r.rank + log(1 + exp({rank} - r.rank)) "
+    "ELSE {rank} + log(1 + exp(r.rank - {rank})) END"
 )
 
-# Initialize Graphiti client if available
-if _USE_GRAPHITI:
-    graphiti = Graphiti(driver=driver, llm_client=llm_client, embedding_model_name=EMBEDDING_MODEL_NAME)
-else:
-    graphiti = None
+def _relation_ref(obj_type: str, rel_type: str, name: str) -> str:
+    return f"{rel_type}:{obj_type}:{object_key(name)}"
 
-# In-memory store of conversations per user for fallback summarization
-conversation_store: dict[str, list[list[dict]]] = {}
+def _unrecorded(groups: dict[tuple[str, str], list[str]], recorded: list[str]
+                ) -> tuple[dict[tuple[str, str], list[str]], list[str]]:
+    """
+    Drop the relations an Episode has already counted; returns the remaining groups and all its relations.
 
-def add_episode(uid: str, conv: list[dict]) -> str:
+    A "full" re-extraction repeats most of what the Episode said before, and every mention
+    written bumps the edge counters, so each relation is counted once per Episode.
     """
-    Ingests a conversation as a Graphiti Episode and extracts multiple relationships.
+    seen = set(recorded)
+    fresh: dict[tuple[str, str], list[str]] = {}
+    for (obj_type, rel_type), names in groups.items():
+        names = [name for name in names if _relation_ref(obj_type, rel_type, name) not in seen]
+        if names:
+            fresh[(obj_type, rel_type)] = names
+    added = [_relation_ref(obj_type, rel_type, name) for (obj_type, rel_type), names in fresh.items() for name in names]
+    return fresh, [*recorded, *added]
+
+async def _register_labels(session, groups: dict[tuple[str, str], list[str]]) -> None:
+    """
+    Make sure every object label about to be MERGEd has a key index.
+    """
+    for obj_type, _ in groups:
+        try:
+            await schema.ensure_label_index(session, obj_type)
+        except Exception as e:
+            logger.warning(f"Could not create key index for label {obj_type}: {e}")
+
+@timed_query("write_episode")
+async def _write_episode_tx(tx, uid: str, episode_id: str | None, conv_json: str | None,
+                      groups: dict[tuple[str, str], list[str]], summary: str | None = None,
+                      meta: dict | None = None) -> int:
+    """
+    Unit of work for one ingest: user, optional Episode + CREATED edge, and one UNWIND per relation group.
+
+    Runs inside a single managed write transaction, so the round-trip count is
+    1 + number of (label, rel_type) groups regardless of how many relations were extracted,
+    plus one statement storing the user's profile (see app.profiles).
+    With `conv_json` omitted, an existing Episode only gets its `summary` and, when `meta` is
+    given, its content hash and turn count set. `meta` carries the content hash, turn count and
+    client timestamps from `EpisodePlan.meta()`; an existing Episode is updated in place and
+    keeps its original `created_at`. A null hash or turn count leaves the stored one. Every
+    transcript write bumps `e.revision`, which guards the archive swap of app.retention.
+    When `meta` carries the Episode's recorded `relations`, only relations not among them are
+    written (see `_unrecorded`) and the Episode records the union; null leaves them as stored.
+    """
+    relations = (meta or {}).get("relations")
+    if relations is not None:
+        groups, relations = _unrecorded(groups, relations)
+    profile = profiles.PROFILE_ENABLED and (conv_json is not None or summary is not None or bool(groups))
+    read_profile = f" {profiles.LOCK_AND_READ}" if profile else ""
+    if conv_json is not None:
+        meta = meta or {}
+        result = await tx.run(
+            "MERGE (u:User {uid: $uid}) "
+            "WITH u OPTIONAL MATCH (prior:Episode {id: $episode_id}) "
+            "WITH u, prior IS NULL AS created "
+            "MERGE (e:Episode {id: $episode_id}) "
+            "ON CREATE SET e.created_at = coalesce($created_at, datetime()) "
+            "SET e.conversation_z = $conv_z, e.conversation_bytes = $conv_bytes, e.conversation = $conv_legacy, e.archive_ref = null, "
+            "e.revision = coalesce(e.revision, 0) + 1, "
+            "e.summary = $summary, e.content_hash = coalesce($content_hash, e.content_hash), "
+            "e.turn_count = coalesce($turn_count, e.turn_count), e.updated_at = coalesce($updated_at, datetime()), "
+            "e.relations = coalesce($relations, e.relations) "
+            "MERGE (u)-[:CREATED]->(e)" + read_profile,
+            uid=uid, episode_id=episode_id, summary=summary, **episode_store.pack(conv_json),
+            content_hash=meta.get("content_hash"), turn_count=meta.get("turn_count"), relations=relations,
+            created_at=meta.get("created_at"), updated_at=meta.get("updated_at"),
+        )
+    elif episode_id is not None and (summary is not None or meta):
+        meta = meta or {}
+        result = await tx.run(
+            "MERGE (u:User {uid: $uid}) "
+            "WITH u MATCH (u)-[:CREATED]->(e:Episode {id: $episode_id}) "
+            "SET e.summary = coalesce($summary, e.summary), e.content_hash = coalesce($content_hash, e.content_hash), "
+            "e.turn_count = coalesce($turn_count, e.turn_count), e.relations = coalesce($relations, e.relations)"
+            + (f" WITH u, e, false AS created{read_profile}" if profile else ""),
+            uid=uid, episode_id=episode_id, summary=summary,
+            content_hash=meta.get("content_hash"), turn_count=meta.get("turn_count"), relations=relations,
+        )
+    else:
+        result = await tx.run(
+            "MERGE (u:User {uid:$uid})" + (f" WITH u, null AS e, false AS created{read_profile}" if profile else ""),
+            uid=uid,
+        )
+    states: dict[str, dict] = {}
+    if profile:
+        record = await result.single()
+        if record is not None:
+            profiles.collect_state(states, record)
+    else:
+        await result.consume()
+    edges: list[dict] = []
+    rel_count = 0
+    seen = _mention_time(meta)
+    for (obj_type, rel_type), names in groups.items():
+        logger.info(f"Creating {len(names)} relationship(s) {uid}-[:{rel_type}]->{obj_type}")
+        objects = [{"key": object_key(name), "name": str(name), "extracted": extracted(name)} for name in names]
+        result = await tx.run(
+            f"MATCH (u:User {{uid:$uid}}) "
+            f"UNWIND $objects AS obj "
+            f"MERGE (o:`{obj_type}` {{key: obj.key}}) ON CREATE SET o.name = obj.name "
+            f"MERGE (u)-[r:`{rel_type}`]->(o) "
+            + _EDGE_COUNTERS.format(seen="$seen", rank="$rank")
+            + (EXTRACTED_SET.format(source="obj.extracted") if any(obj["extracted"] for obj in objects) else "")
+            + (f" {profiles.EDGE_RETURN}" if states else ""),
+            uid=uid, objects=objects, seen=seen, rank=mention_rank(seen),
+        )
+        if states:
+            edges.extend([dict(record, label=obj_type, type=rel_type) async for record in result])
+        else:
+            await result.consume()
+        rel_count += len(names)
+    if states:
+        await profile_builder.refresh(tx, states, {uid: edges})
+    return rel_count
+
+@timed_query("write_batch")
+async def _write_batch_tx(tx, episodes: list[dict], rel_rows: dict[tuple[str, str], list[dict]]) -> int:
+    """
+    Cross-conversation variant of `_write_episode_tx` used by bulk ingestion.
+
+    One UNWIND writes every Episode of the batch, then one UNWIND per (label, rel_type)
+    group writes that group's relations for all users at once, and one statement stores
+    the profiles of every user in the batch.
+    """
+    profile = profiles.PROFILE_ENABLED
+    result = await tx.run(
+        "UNWIND $episodes AS ep "
+        "MERGE (u:User {uid: ep.uid}) "
+        "WITH u, ep OPTIONAL MATCH (prior:Episode {id: ep.episode_id}) "
+        "WITH u, ep, prior IS NULL AS created "
+        "MERGE (e:Episode {id: ep.episode_id}) "
+        "ON CREATE SET e.created_at = coalesce(ep.created_at, datetime()) "
+        "SET e.conversation_z = ep.conv_z, e.conversation_bytes = ep.conv_bytes, e.conversation = ep.conv_legacy, e.archive_ref = null, "
+        "e.revision = coalesce(e.revision, 0) + 1, "
+        "e.summary = ep.summary, e.content_hash = ep.content_hash, "
+        "e.turn_count = ep.turn_count, e.updated_at = coalesce(ep.updated_at, datetime()), "
+        "e.relations = coalesce(ep.relations, e.relations) "
+        "MERGE (u)-[:CREATED]->(e)" + (f" {profiles.LOCK_AND_READ}" if profile else ""),
+        episodes=episodes,
+    )
+    states: dict[str, dict] = {}
+    if profile:
+        async for record in result:
+            profiles.collect_state(states, record)
+    else:
+        await result.consume()
+    edges: dict[str, list[dict]] = {}
+    rel_count = 0
+    for (obj_type, rel_type), rows in rel_rows.items():
+        result = await tx.run(
+            f"UNWIND $rows AS row "
+            f"MATCH (u:User {{uid: row.uid}}) "
+            f"MERGE (o:`{obj_type}` {{key: row.key}}) ON CREATE SET o.name = row.name "
+            f"MERGE (u)-[r:`{rel_type}`]->(o) "
+            + _EDGE_COUNTERS.format(seen="row.seen", rank="row.rank")
+            + (EXTRACTED_SET.format(source="row.extracted") if any(row.get("extracted") for row in rows) else "")
+            + (f" {profiles.EDGE_RETURN}, row.uid AS uid" if profile else ""),
+            rows=rows,
+        )
+        if profile:
+            async for record in result:
+                edges.setdefault(record["uid"], []).append(dict(record, label=obj_type, type=rel_type))
+        else:
+            await result.consume()
+        rel_count += len(rows)
+    if states:
+        await profile_builder.refresh(tx, states, edges)
+    return rel_count
+
+async def write_episode_batch(items: list[dict]) -> int:
+    """
+    Write many extracted conversations in one transaction.
+
+    Each item has 'uid', 'episode_id', 'conv', 'groups' (from `_sanitize_relations`), 'summary'
+    and optionally its 'plan'. When a batch holds several versions of one conversation, the
+    Episode keeps the latest; relations from every version are written, each counted once.
+    Returns the number of relationships written.
+    """
+    latest: dict[str, dict] = {}
+    rel_rows: dict[tuple[str, str], list[dict]] = {}
+    # Relations each planned Episode has counted, including earlier versions in this batch
+    recorded: dict[str, list[str]] = {}
+    for item in items:
+        plan = item.get("plan")
+        groups = item["groups"]
+        if plan is not None:
+            groups, recorded[item["episode_id"]] = _unrecorded(groups, recorded.get(item["episode_id"], plan.relations))
+        row = {
+            "uid": item["uid"],
+            "episode_id": item["episode_id"],
+            **episode_store.pack(json.dumps(item["conv"])),
+            "summary": item.get("summary"),
+            **(plan.meta() if plan is not None else {
+                "content_hash": conversation_hash(item["conv"]), "turn_count": len(item["conv"]),
+                "created_at": None, "updated_at": None,
+            }),
+        }
+        current = latest.get(row["episode_id"])
+        if current is None or not _is_older(row["updated_at"], current["updated_at"]):
+            latest[row["episode_id"]] = row
+        for key, names in groups.items():
+            seen = _mention_time(row)
+            rel_rows.setdefault(key, []).extend(
+                {"uid": item["uid"], "key": object_key(name), "name": str(name), "seen": seen, "rank": mention_rank(seen),
+                 "extracted": extracted(name)} for name in names
+            )
+    for episode_id, relations in recorded.items():
+        latest[episode_id]["relations"] = relations
+    async with driver.session() as session:
+        await _register_labels(session, rel_rows)
+        rel_count = await session.execute_write(_write_batch_tx, list(latest.values()), rel_rows)
+    for item in items:
+        if item["groups"]:
+            INGEST_RELATIONS.observe(sum(len(names) for names in item["groups"].values()))
+    for uid in {item["uid"] for item in items}:
+        summary_cache.invalidate_uid(uid)
+    for uid in {item["uid"] for item in items if item["groups"]}:
+        question_buffer.invalidate(uid)
+    for item in items:
+        embeddings.schedule_index(item["uid"], item["groups"])
+    for item in items:
+        await conversation_cache.put_async(item["uid"], item["episode_id"], item["conv"])
+    return rel_count
+
+async def store_episode(uid: str, conv: list[dict], plan: EpisodePlan | None = None) -> str:
+    """
+    Persist the raw conversation as an Episode linked to the user, without extraction.
 
     Returns the episode id.
     """
+    if plan is None:
+        plan = await plan_episode(uid, conv)
+    conv_json = json.dumps(conv)
+    # The content hash is only recorded once extraction has committed (see `process_episode`)
+    await _write_episode(uid, plan.episode_id, conv_json, {}, meta=plan.pending_meta())
+    # Keep a copy for reads while Neo4j is unavailable
+    await conversation_cache.put_async(uid, plan.episode_id, conv)
+    return plan.episode_id
+
+async def request_relationships(uid: str, conv: list[dict], context: list[dict] | None = None) -> list[dict]:
+    """
+    Ask the LLM for the relationships the user expresses in a conversation.
+
+    With `context`, those earlier turns are shown for reference only and just `conv` is extracted.
+    Long conversations are split into token-budgeted windows extracted concurrently (see
+    app.extraction); their relations are merged and deduplicated.
+    Returns the raw relation dicts ('relation', 'object', 'object_type'); empty if the output has none.
+    """
+    # Log raw user texts
+    logger.debug(f"User turns: {[t.get('text','') for t in conv if t.get('speaker')=='User']}")
+    # Validate LLM endpoint and credentials
+    if not llm.configured:
+        logger.error(f"Missing OPENAI_API_BASE or OPENAI_API_KEY; skipping LLM request for uid={uid}")
+        return []
+    chunks = extraction.windows(conv, context)
+    if len(chunks) > 1:
+        logger.info(f"Extracting {len(conv)} turns for uid={uid} in {len(chunks)} windows")
+    # One window failing (LLM unavailable) fails the whole extraction, as a single request did
+    results = await extraction.gather_bounded([functools.partial(_extract_window, turns, before) for turns, before in chunks])
+    return extraction.merge_relations(results)
+
+async def _extract_window(conv: list[dict], context: list[dict]) -> list[dict]:
+    # Prepare the window with speaker labels for the LLM
+    conv_formatted = extraction.format_turns(conv)
+    if context:
+        conv_formatted = f"Earlier turns (context only):\n{extraction.format_turns(context)}\n\nNew turns:\n{conv_formatted}"
+    logger.debug(f"conv_formatted for LLM: {conv_formatted}")
+    logger.info(f"Sending relationship extraction request to {OPENAI_API_BASE}")
+    system_instruction = (
+        "You are a relationship extraction assistant. "
+        "Given the full conversation between 'AI' and 'User', extract all distinct relationships "
+        "the user expresses, including emotions, problems, actions, preferences, and coping strategies. "
+        "Output a JSON array of objects with fields: 'relation', 'object', 'object_type'."
+    )
+    if context:
+        system_instruction += " Only extract relationships expressed in the new turns; earlier turns were already processed."
+    messages = [
+        {"role": "system", "content": system_instruction},
+        {"role": "user", "content": conv_formatted},
+    ]
+    # Transport errors and 429/5xx are retried by the client; an LLM that stays unavailable raises
+    # UpstreamUnavailableError rather than storing the Episode without its relationships
+    content = await llm.complete(messages, max_tokens=extraction.EXTRACTION_MAX_TOKENS, temperature=0)
+    logger.debug(f"LLM response content: {content}")
+    with PARSE_SECONDS.time(stage="relations_json"):
+        return _parse_relations(content)
+
+def _parse_relations(content: str) -> list[dict]:
+    # Recovers every complete object, even when the array was cut off by the token limit
+    rels = extraction.parse_relations(content)
+    logger.debug(f"Extracted relationships: {rels}")
+    return rels
+
+async def _write_episode(uid: str, episode_id: str | None, conv_json: str | None,
+                         groups: dict[tuple[str, str], list[str]], summary: str | None = None,
+                         meta: dict | None = None) -> int:
+    async with driver.session() as session:
+        await _register_labels(session, groups)
+        rel_count = await session.execute_write(_write_episode_tx, uid, episode_id, conv_json, groups, summary, meta)
+    if groups:
+        INGEST_RELATIONS.observe(rel_count)
+    # Anything summarized for this user before the write is now stale
+    summary_cache.invalidate_uid(uid)
+    if groups:
+        # New relationships change the preferences buffered questions were generated from
+        question_buffer.invalidate(uid)
+        embeddings.schedule_index(uid, groups)
+    return rel_count
+
+async def _episode_summary(uid: str, conv: list[dict]) -> str | None:
+    """
+    Compact summary stored on the Episode; None when disabled, deferred or on LLM failure.
+    """
+    if EPISODE_SUMMARY_MODE != "inline" or not llm.configured:
+        return None
+    try:
+        return await summarize_conversation(uid, conv)
+    except Exception as e:
+        logger.warning(f"Episode summary failed for uid={uid}; it will be computed on first read: {e}")
+        return None
+
+def _summary_input(conv: list[dict], plan: EpisodePlan | None) -> list[dict]:
+    """
+    Turns to summarize: for an appended conversation, the previous summary plus the new turns.
+    """
+    if plan is not None and plan.mode == "delta" and plan.previous_summary:
+        return [{"speaker": "Summary of earlier turns", "text": plan.previous_summary}] + conv[plan.extract_from:]
+    return conv
+
+async def store_episode_summary(uid: str, episode_id: str, conv: list[dict]) -> str:
+    """
+    Summarize one conversation and store the result on its Episode (background summary job).
+    """
+    summary = await summarize_conversation(uid, conv)
+    await _write_episode(uid, episode_id, None, {}, summary)
+    return episode_id
+
+async def extract_episode(uid: str, conv: list[dict], plan: EpisodePlan | None = None
+                          ) -> tuple[dict[tuple[str, str], list[str]], str | None]:
+    """
+    Run relationship extraction and the inline episode summary concurrently.
+
+    For a "delta" plan only the appended turns are extracted, with up to DELTA_CONTEXT_TURNS
+    earlier turns as context. Returns (relation groups as from `_sanitize_relations`, summary or None).
+    """
+    if plan is not None and plan.mode == "delta":
+        start = plan.extract_from
+        context = conv[max(0, start - DELTA_CONTEXT_TURNS):start]
+        logger.info(f"Extracting {len(conv) - start} appended turn(s) of episode {plan.episode_id} with {len(context)} context turn(s)")
+        extraction = request_relationships(uid, conv[start:], context=context)
+    else:
+        extraction = request_relationships(uid, conv)
+    rels, summary = await asyncio.gather(extraction, _episode_summary(uid, _summary_input(conv, plan)))
+    return _sanitize_relations(rels), summary
+
+def schedule_episode_summary(uid: str, episode_id: str, conv: list[dict], plan: EpisodePlan | None = None) -> None:
+    if EPISODE_SUMMARY_MODE == "background" and llm.configured:
+        try:
+            background_queue.submit(uid, store_episode_summary, uid, episode_id, _summary_input(conv, plan),
+                                    episode_id=episode_id)
+        except QueueFullError:
+            # The summary is backfilled the first time it is read (see `get_episode_summaries`)
+            logger.warning(f"Background queue full; episode {episode_id} will be summarized on first read")
+
+async def extract_relationships(uid: str, conv: list[dict], episode_id: str | None = None) -> int:
+    """
+    Extract relationships from a conversation and write them to Neo4j in one transaction.
+
+    When `episode_id` is given, the episode summary is computed alongside and stored on it.
+    Returns the number of relationships written.
+    """
+    if episode_id is None:
+        rels, summary = await request_relationships(uid, conv), None
+    else:
+        rels, summary = await asyncio.gather(request_relationships(uid, conv), _episode_summary(uid, conv))
+    groups = _sanitize_relations(rels)
+    rel_count = await _write_episode(uid, episode_id, None, groups, summary)
+    logger.info(f"Total relationships created for uid={uid}: {rel_count}")
+    if episode_id is not None:
+        schedule_episode_summary(uid, episode_id, conv)
+    return rel_count
+
+async def persist_episode(uid: str, conv: list[dict], conversation_id: str | None = None,
+                          created_at: datetime | None = None, updated_at: datetime | None = None) -> EpisodePlan | None:
+    """
+    First half of a deferred ingest: plan against the stored Episode and store the raw conversation now.
+
+    Returns the plan (nothing is written when `plan.skip`), or None when Graphiti owns episode creation.
+    """
+    if _USE_GRAPHITI:
+        return None
+    plan = await plan_episode(uid, conv, conversation_id, created_at, updated_at)
+    if not plan.skip:
+        await store_episode(uid, conv, plan)
+    return plan
+
+async def process_episode(uid: str, conv: list[dict], plan: EpisodePlan | None) -> str:
+    """
+    Second half of a deferred ingest: run extraction for an episode stored by `persist_episode`.
+
+    Returns the episode id.
+    """
+    if plan is None:
+        return await add_episode(uid, conv)
+    groups, summary = await extract_episode(uid, conv, plan)
+    # Commits the relations together with the content hash, marking the Episode as extracted
+    rel_count = await _write_episode(uid, plan.episode_id, None, groups, summary, plan.meta())
+    logger.info(f"Total relationships created for uid={uid}: {rel_count}")
+    schedule_episode_summary(uid, plan.episode_id, conv, plan)
+    return plan.episode_id
+
+async def add_episode(uid: str, conv: list[dict], conversation_id: str | None = None,
+                      created_at: datetime | None = None, updated_at: datetime | None = None) -> str:
+    """
+    Ingests a conversation as a Graphiti Episode and extracts multiple relationships.
+
+    With a conversation_id the Episode is keyed on it: an unchanged re-post is a no-op and
+    appended turns are extracted on their own. Returns the episode id.
+    """
     logger.info(f"add_episode called with uid={uid}, num_turns={len(conv)}, USE_GRAPHITI={_USE_GRAPHITI}")
     if not _USE_GRAPHITI:
         logger.info(f"Using fallback manual ingestion for uid={uid}")
-        with driver.session() as session:
-            # Log raw user texts
-            logger.debug(f"User turns: {[t.get('text','') for t in conv if t.get('speaker')=='User']}")
-            # Ensure user node exists
-            session.run("MERGE (u:User {uid:$uid})", uid=uid)
-            # Prepare full conversation with speaker labels for LLM
-            conv_formatted = "\n".join([f"{turn.get('speaker')}: {turn.get('text','')}" for turn in conv])
-            logger.debug(f"conv_formatted for LLM: {conv_formatted}")
-            # Ask LLM to extract relationships
-            # Validate LLM endpoint and credentials
-            if not OPENAI_API_BASE or not OPENAI_API_KEY:
-                logger.error(f"Missing OPENAI_API_BASE or OPENAI_API_KEY; skipping LLM request for uid={uid}")
-                return uid
-            logger.info(f"Sending LLM request to {OPENAI_API_BASE}/chat/completions")
-            system_instruction = (
-                "You are a relationship extraction assistant. "
-                "Given the full conversation between 'AI' and 'User', extract all distinct relationships "
-                "the user expresses, including emotions, problems, actions, preferences, and coping strategies. "
-                "Output a JSON array of objects with fields: 'relation', 'object', 'object_type'."
-            )
-            chat_payload = {
-                "model": MODEL_NAME,
-                "messages": [
-                    {"role": "system", "content": system_instruction},
-                    {"role": "user", "content": conv_formatted},
-                ],
-                "max_tokens": 500,
-                "temperature": 0,
-            }
-            try:
-                resp = httpx.post(
-                    f"{OPENAI_API_BASE}/chat/completions",
-                    headers={"Authorization": f"Bearer {OPENAI_API_KEY}"},
-                    json=chat_payload,
-                    timeout=GRAPHITI_LLM_TIMEOUT,
-                )
-            except Exception as e:
-                logger.error(f"LLM request failed for uid={uid}: {e}")
-                return uid
-            resp.raise_for_status()
-            logger.debug(f"LLM response status: {resp.status_code}")
-            content = resp.json()["choices"][0]["message"]["content"]
-            logger.debug(f"LLM response content: {content}")
-            # Extract JSON array from LLM output
-            start = content.find('[')
-            end = content.rfind(']')
-            if start != -1 and end != -1 and end > start:
-                json_str = content[start:end+1]
-                logger.debug(f"Extracted JSON string for parsing: {json_str}")
-                try:
-                    rels = json.loads(json_str)
-                except Exception as e:
-                    logger.error(f"JSON parse error: {e}; json_str: {json_str}")
-                    rels = []
-            else:
-                logger.error(f"No JSON array found in LLM output: {content}")
-                rels = []
-            logger.debug(f"Extracted relationships: {rels}")
-            # Create nodes and relationships based on LLM output
-            rel_count = 0
-            for rel in rels:
-                # Sanitize relationship type: replace non-alphanumeric with underscore
-                raw_rel = rel.get("relation", "REL")
-                rel_type = re.sub(r"\W+", "_", raw_rel).upper()
-                # Sanitize object label (capitalize, no spaces)
-                raw_obj_type = rel.get("object_type", "Preference")
-                obj_type = raw_obj_type.strip().replace(' ', '_').capitalize()
-                obj = rel.get("object", "")
-                logger.info(f"Creating relationship {uid}-[:{rel_type}]->{obj_type}({obj})")
-                # Merge object node
-                session.run(f"MERGE (o:{obj_type} {{name:$obj}})", obj=obj)
-                # Link user to object with sanitized rel_type
-                session.run(
-                    f"MATCH (u:User {{uid:$uid}}), (o:{obj_type} {{name:$obj}}) MERGE (u)-[:{rel_type}]->(o)",
-                    uid=uid, obj=obj,
-                )
-                rel_count += 1
-            logger.info(f"Total relationships created for uid={uid}: {rel_count}")
-            # Store conversation for summarization fallback
-            conversation_store.setdefault(uid, []).append(conv)
-            # Store raw conversation as backup in Neo4j
-            episode_id = str(uuid.uuid4())
-            conv_json = json.dumps(conv)
-            session.run(
-                "MERGE (e:Episode {id: $episode_id}) "
-                "SET e.conversation = $conv_json, e.created_at = datetime()",
-                episode_id=episode_id, conv_json=conv_json
-            )
-            session.run(
-                "MATCH (u:User {uid: $uid}), (e:Episode {id: $episode_id}) "
-                "MERGE (u)-[:CREATED]->(e)",
-                uid=uid, episode_id=episode_id
-            )
-            return episode_id
+        plan = await plan_episode(uid, conv, conversation_id, created_at, updated_at)
+        if plan.skip:
+            return plan.episode_id
+        # Extract (and summarize) first so the Episode, user and relationships land in one write transaction
+        groups, summary = await extract_episode(uid, conv, plan)
+        conv_json = json.dumps(conv)
+        rel_count = await _write_episode(uid, plan.episode_id, conv_json, groups, summary, plan.meta())
+        logger.info(f"Total relationships created for uid={uid}: {rel_count}")
+        schedule_episode_summary(uid, plan.episode_id, conv, plan)
+        # Keep a copy for reads while Neo4j is unavailable
+        await conversation_cache.put_async(uid, plan.episode_id, conv)
+        return plan.episode_id
     # Use Graphiti to ingest conversation and extract relationships into Neo4j
     logger.info(f"Using Graphiti ingestion for uid={uid}")
     try:
-        episode = graphiti.add_episode(uid=uid, conversation=conv)
+        episode = services.graphiti.add_episode(uid=uid, conversation=conv)
+        if inspect.isawaitable(episode):
+            episode = await episode
     except Exception as e:
         logger.error(f"Graphiti.add_episode failed for uid={uid}: {e}")
         raise
@@ -184,107 +685,364 @@ SYSTEM_PROMPT = "You are a helpful assistant that generates the next follow-up q
 
 async def generate_next_question(preferences: list[str]) -> str:
     """
-    Generate the next dynamic question given existing preferences using LLM,
-    trying chat/completions first, then falling back to completions endpoint.
+    Generate the next dynamic question given existing preferences using the shared LLM client
+    (chat/completions, or the legacy completions endpoint when that is all the server offers).
     """
     pref_text = ", ".join(preferences) if preferences else ""
     if pref_text:
         user_prompt = f"User preferences so far: {pref_text}. Ask the next question to learn another preference."
     else:
         user_prompt = "Ask a question to learn about the user's preferences."
-    async with httpx.AsyncClient(timeout=GRAPHITI_LLM_TIMEOUT) as client:
-        # First, try chat/completions
-        chat_payload = {
-            "model": MODEL_NAME,
-            "messages": [
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": user_prompt},
-            ],
-        }
-        try:
-            resp = await client.post(
-                f"{OPENAI_API_BASE}/chat/completions",
-                headers={"Authorization": f"Bearer {OPENAI_API_KEY}"},
-                json=chat_payload,
-            )
-            resp.raise_for_status()
-            chat_data = resp.json()
-            return chat_data["choices"][0]["message"]["content"].strip()
-        except httpx.HTTPStatusError as chat_err:
-            if chat_err.response.status_code != 404:
-                raise
-        # Fallback to legacy completions
-        comp_payload = {
-            "model": MODEL_NAME,
-            "prompt": f"{SYSTEM_PROMPT}\n\n{user_prompt}",
-            "max_tokens": 64,
-        }
-        resp2 = await client.post(
-            f"{OPENAI_API_BASE}/completions",
-            headers={"Authorization": f"Bearer {OPENAI_API_KEY}"},
-            json=comp_payload,
-        )
-        resp2.raise_for_status()
-        comp_data = resp2.json()
-        return comp_data.get("choices", [{}])[0].get("text", "").strip()
+    return await llm.complete([
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt},
+    ])
+
+@timed_query("profile")
+async def _profile_tx(tx, uid: str):
+    result = await tx.run(profiles.PROFILE_QUERY, uid=uid)
+    return await result.single()
+
+@timed_query("rebuild_profile")
+async def _rebuild_profile_tx(tx, uid: str):
+    # Takes the user's write lock like an ingest, then builds and stores the document
+    result = await tx.run(
+        "MATCH (u:User {uid:$uid}) SET u.profile_version = coalesce(u.profile_version, 0) + 1 "
+        "RETURN u.uid AS uid, null AS profile, u.profile_version AS version, false AS created, null AS episode_id",
+        uid=uid,
+    )
+    record = await result.single()
+    if record is None:
+        return None
+    states: dict[str, dict] = {}
+    profiles.collect_state(states, record)
+    await profile_builder.refresh(tx, states, {})
+    result = await tx.run(profiles.PROFILE_QUERY, uid=uid)
+    return await result.single()
+
+async def get_profile(uid: str) -> tuple[str, str] | None:
+    """
+    The user's profile document (JSON text) and its ETag; None for an unknown user.
+
+    A single-key lookup. A user ingested before profiles existed gets the document built
+    and stored on first read.
+    """
+    async with driver.session() as session:
+        record = await session.execute_read(_profile_tx, uid)
+        if record is not None and record["profile"] is None:
+            record = await session.execute_write(_rebuild_profile_tx, uid)
+    if record is None:
+        return None
+    return record["profile"], record["etag"]
 
-def get_preferences(uid: str, top_k: int = 5) -> list[str]:
+# Top-k over the user's preference edges, best decayed rank first. The user is found through
+# its uniqueness constraint and the ordering/limit runs in the database (a Top operator), so
+# only k rows come back however many edges the user has. Legacy edges without counters rank last.
+PREFERENCES_QUERY = (
+    "MATCH (u:User {uid:$uid})-[r]->(o) "
+    "WHERE type(r) IN $relations OR any(label IN labels(o) WHERE label IN $labels) "
+    "WITH coalesce(o.name, o.text) AS name, max(coalesce(r.rank, 0.0)) AS rank "
+    "WHERE name IS NOT NULL "
+    "RETURN name ORDER BY rank DESC LIMIT $k"
+)
+
+@timed_query("preferences")
+async def _preferences_tx(tx, uid: str, top_k: int) -> list[str]:
+    result = await tx.run(
+        PREFERENCES_QUERY, uid=uid, k=top_k, relations=PREFERENCE_RELATIONS, labels=PREFERENCE_LABELS,
+    )
+    return [record["name"] async for record in result]
+
+async def get_preferences(uid: str, top_k: int = 5) -> list[str]:
     """
-    Retrieve top_k preferences for a user using Graphiti hybrid search recipe.
+    Retrieve the user's top_k preferences, ranked by mention frequency with recency decay.
+
+    Served from the materialized profile when the user has one; the ranked edge query covers
+    users without one yet and a `top_k` beyond what the profile keeps.
     """
+    if profiles.PROFILE_ENABLED and top_k <= profile_builder.top_k:
+        async with driver.session() as session:
+            record = await session.execute_read(_profile_tx, uid)
+        if record is None:
+            return []
+        if record["profile"] is not None:
+            return profiles.top_preferences(json.loads(record["profile"]), top_k)
     # Fetch preferences from Neo4j
-    with driver.session() as session:
-        result = session.run(
-            "MATCH (u:User {uid:$uid})-[:LIKES]->(p:Preference) RETURN p.text AS text LIMIT $k",
-            uid=uid, k=top_k,
-        )
-        return [record["text"] for record in result]
+    async with driver.session() as session:
+        return await session.execute_read(_preferences_tx, uid, top_k)
 
-async def summarize_conversation(uid: str, conv: list[dict]) -> str:
+async def get_ranked_preferences(uid: str, limit: int) -> list[str]:
     """
-    Summarize the given conversation using LLM.
+    The user's preference names from the graph itself, best decayed rank first (never the profile).
+    """
+    async with driver.session() as session:
+        return await session.execute_read(_preferences_tx, uid, limit)
+
+# PREFERENCES_QUERY for many users in one round trip: each user's names in rank order, first k kept
+BATCH_PREFERENCES_QUERY = (
+    "UNWIND $uids AS uid "
+    "MATCH (u:User {uid:uid})-[r]->(o) "
+    "WHERE type(r) IN $relations OR any(label IN labels(o) WHERE label IN $labels) "
+    "WITH uid, coalesce(o.name, o.text) AS name, max(coalesce(r.rank, 0.0)) AS rank "
+    "WHERE name IS NOT NULL "
+    "WITH uid, name, rank ORDER BY rank DESC "
+    "RETURN uid, collect(name)[..$k] AS names"
+)
+
+@timed_query("preferences_batch")
+async def _preferences_batch_tx(tx, uids: list[str], top_k: int) -> dict[str, list[str]]:
+    result = await tx.run(
+        BATCH_PREFERENCES_QUERY, uids=uids, k=top_k, relations=PREFERENCE_RELATIONS, labels=PREFERENCE_LABELS,
+    )
+    return {record["uid"]: list(record["names"]) async for record in result}
+
+@timed_query("profiles_batch")
+async def _profiles_batch_tx(tx, uids: list[str]) -> dict[str, str | None]:
+    result = await tx.run(profiles.BATCH_PROFILE_QUERY, uids=uids)
+    return {record["uid"]: record["profile"] async for record in result}
+
+async def get_preferences_many(uids: list[str], top_k: int = 5) -> dict[str, list[str]]:
+    """
+    Like `get_preferences` for every uid in one query; users without preferences map to [].
+    """
+    unique = list(dict.fromkeys(uids))
+    found: dict[str, list[str]] = {}
+    if profiles.PROFILE_ENABLED and top_k <= profile_builder.top_k:
+        async with driver.session() as session:
+            stored = await session.execute_read(_profiles_batch_tx, unique)
+        found = {uid: profiles.top_preferences(json.loads(doc), top_k) for uid, doc in stored.items() if doc is not None}
+        # Unknown users have no preferences; only users without a profile yet need the edge query
+        unique = [uid for uid in stored if uid not in found]
+    if unique:
+        async with driver.session() as session:
+            found.update(await session.execute_read(_preferences_batch_tx, unique, top_k))
+    return {uid: found.get(uid, []) for uid in uids}
+
+async def get_preferences_with_context(uid: str, previous_question: str, top_k: int = 5) -> list[str]:
+    """
+    Retrieve the user's top_k preferences most similar to the previous question (cosine over embeddings).
+
+    Remaining slots are filled from the ranked preferences, which are also the answer when
+    embeddings are not configured or the user has none yet.
+    """
+    if not embeddings.configured():
+        return await get_preferences(uid, top_k)
+    vector = await embeddings.embed_query(previous_question)
+    prefs = await embeddings.vector_index.search(uid, vector, top_k)
+    if len(prefs) < top_k:
+        prefs += [p for p in await get_preferences(uid, top_k) if p not in prefs][:top_k - len(prefs)]
+    return prefs
+
+@timed_query("recent_conversations")
+async def _recent_conversations_tx(tx, uid: str, n: int) -> list[str]:
+    result = await tx.run(
+        "MATCH (u:User {uid:$uid})-[:CREATED]->(e:Episode) "
+        f"RETURN {episode_store.STORED_CONVERSATION} AS conv_json ORDER BY e.created_at DESC LIMIT $n",
+        uid=uid, n=n,
+    )
+    return [record["conv_json"] async for record in result]
+
+async def get_recent_conversations(uid: str, n: int) -> list[str]:
+    """
+    Return the raw JSON of the user's last `n` Episodes, newest first.
+
+    Episodes whose archived transcript can no longer be read are left out.
+    Falls back to the conversations cached at ingest when Neo4j is unreachable.
     """
+    try:
+        async with driver.session() as session:
+            stored = await session.execute_read(_recent_conversations_tx, uid, n)
+        return [conv_json for conv_json in await episode_store.resolve(stored) if conv_json is not None]
+    except unavailable_errors() as e:
+        cached = await conversation_cache.recent_async(uid, n)
+        if not cached:
+            raise
+        logger.warning(f"Neo4j unavailable ({e}); serving {len(cached)} cached conversation(s) for uid={uid}")
+        return cached
+
+@timed_query("conversation_page")
+async def _conversation_page_tx(tx, uid: str, n: int, cursor: tuple[str, str] | None) -> list[dict]:
+    cursor_at, cursor_id = cursor or (None, None)
+    result = await tx.run(
+        "MATCH (u:User {uid:$uid})-[:CREATED]->(e:Episode) "
+        "WHERE $cursor_at IS NULL OR e.created_at < datetime($cursor_at) "
+        "OR (e.created_at = datetime($cursor_at) AND e.id < $cursor_id) "
+        "RETURN e.id AS id, e.created_at AS created_at, e.updated_at AS updated_at, "
+        "e.turn_count AS turn_count, e.conversation_bytes AS bytes, "
+        f"{episode_store.STORED_CONVERSATION} AS stored "
+        "ORDER BY e.created_at DESC, e.id DESC LIMIT $n",
+        uid=uid, n=n, cursor_at=cursor_at, cursor_id=cursor_id,
+    )
+    return [dict(record) async for record in result]
+
+def _iso(value) -> str | None:
+    if value is None:
+        return None
+    return value.iso_format() if hasattr(value, "iso_format") else value.isoformat()
+
+async def get_conversation_page(uid: str, n: int, cursor: str | None = None) -> tuple[list[dict], str | None]:
+    """
+    One page of the user's Episodes, newest first, keyed on (created_at, id).
+
+    Each row has 'id', 'created_at', 'updated_at', 'turn_count', 'bytes', 'conversation'
+    (the stored transcript JSON text, decompressed but not parsed; None when its archive
+    segment is gone) and 'cursor' (resumes after this row). Returns (rows, next_cursor), where next_cursor is None on the last page.
+    Raises ValueError for a malformed cursor.
+    """
+    position = episode_store.decode_cursor(cursor) if cursor else None
+    try:
+        async with driver.session() as session:
+            records = await session.execute_read(_conversation_page_tx, uid, n, position)
+    except unavailable_errors() as e:
+        cached = await conversation_cache.recent_async(uid, n) if position is None else []
+        if not cached:
+            raise
+        logger.warning(f"Neo4j unavailable ({e}); serving {len(cached)} cached conversation(s) for uid={uid}")
+        return [{"id": None, "created_at": None, "updated_at": None, "turn_count": None, "bytes": len(conv_json.encode()),
+                 "conversation": conv_json, "cursor": None} for conv_json in cached], None
+    rows = []
+    transcripts = await episode_store.resolve([record["stored"] for record in records])
+    for record, conv_json in zip(records, transcripts):
+        created_at = _iso(record["created_at"])
+        rows.append({
+            "id": record["id"],
+            "created_at": created_at,
+            "updated_at": _iso(record["updated_at"]),
+            "turn_count": record["turn_count"],
+            "bytes": record["bytes"] if record["bytes"] is not None else len((conv_json or "").encode()),
+            "conversation": conv_json,
+            "cursor": episode_store.encode_cursor(created_at, record["id"]) if created_at else None,
+        })
+    next_cursor = rows[-1]["cursor"] if len(rows) == n else None
+    return rows, next_cursor
+
+@timed_query("recent_episode_ids")
+async def _recent_episode_ids_tx(tx, uid: str, n: int) -> list[dict]:
+    result = await tx.run(
+        "MATCH (u:User {uid:$uid})-[:CREATED]->(e:Episode) "
+        "RETURN e.id AS id, e.revision AS revision ORDER BY e.created_at DESC LIMIT $n",
+        uid=uid, n=n,
+    )
+    return [dict(record) async for record in result]
+
+async def get_recent_episode_ids(uid: str, n: int) -> list[dict]:
+    """
+    Return the ids and revisions of the user's last `n` Episodes, newest first, without loading transcripts.
+    """
+    async with driver.session() as session:
+        return await session.execute_read(_recent_episode_ids_tx, uid, n)
+
+async def get_recent_episodes(uid: str, n: int) -> list[dict]:
+    """
+    The user's last `n` Episodes, newest first, as {"id", "revision", "summary"}.
+
+    Served from the profile document when it keeps that many; otherwise the ids are queried
+    and "summary" is None (see `get_episode_summaries`). The revision changes with every
+    transcript write, so summary cache keys built from it miss after another worker's ingest.
+    """
+    if profiles.PROFILE_ENABLED and n <= profile_builder.episodes:
+        async with driver.session() as session:
+            record = await session.execute_read(_profile_tx, uid)
+        if record is None:
+            return []
+        recent = profiles.recent_episodes(json.loads(record["profile"]), n) if record["profile"] is not None else None
+        if recent is not None:
+            return [{"id": episode["id"], "revision": episode.get("revision"), "summary": episode["summary"]}
+                    for episode in recent]
+    return [{**episode, "summary": None} for episode in await get_recent_episode_ids(uid, n)]
+
+@timed_query("episode_conversations")
+async def _episode_conversations_tx(tx, episode_ids: list[str]) -> dict[str, str]:
+    result = await tx.run(
+        f"MATCH (e:Episode) WHERE e.id IN $ids RETURN e.id AS id, {episode_store.STORED_CONVERSATION} AS conv_json",
+        ids=episode_ids,
+    )
+    return {record["id"]: record["conv_json"] async for record in result}
+
+async def get_episode_conversations(episode_ids: list[str]) -> list[str]:
+    """
+    Return the raw JSON of the given Episodes, in the order of `episode_ids`.
+    """
+    async with driver.session() as session:
+        stored = await session.execute_read(_episode_conversations_tx, episode_ids)
+    by_id = dict(zip(stored, await episode_store.resolve(list(stored.values()))))
+    return [by_id[episode_id] for episode_id in episode_ids if by_id.get(episode_id) is not None]
+
+@timed_query("episode_summaries")
+async def _episode_summaries_tx(tx, episode_ids: list[str]) -> dict[str, tuple[str | None, str | None]]:
+    # Transcripts are only returned for episodes that have no stored summary yet
+    result = await tx.run(
+        "MATCH (u:User)-[:CREATED]->(e:Episode) WHERE e.id IN $ids "
+        "RETURN e.id AS id, u.uid AS uid, e.summary AS summary, "
+        f"CASE WHEN e.summary IS NULL THEN {episode_store.STORED_CONVERSATION} END AS conv_json",
+        ids=episode_ids,
+    )
+    return {
+        record["id"]: (record["uid"], record["summary"], record["conv_json"])
+        async for record in result
+    }
+
+async def get_episode_summaries(episode_ids: list[str], known: dict[str, str] | None = None) -> list[str]:
+    """
+    Return the stored per-episode summaries in the order of `episode_ids`.
+
+    `known` holds summaries already read (from the profile); when it covers every id, no
+    query is made. Episodes ingested before summaries existed (or whose summary failed) are
+    summarized now, in parallel, and the result is written back so this happens only once.
+    """
+    if known and all(known.get(episode_id) for episode_id in episode_ids):
+        return [known[episode_id] for episode_id in episode_ids]
+    async with driver.session() as session:
+        rows = await session.execute_read(_episode_summaries_tx, episode_ids)
+    transcripts = await episode_store.resolve([row[2] for row in rows.values()])
+    rows = {episode_id: (uid, summary, conv_json) for (episode_id, (uid, summary, _)), conv_json in zip(rows.items(), transcripts)}
+    missing = [(episode_id, row) for episode_id, row in rows.items() if row[1] is None and row[2]]
+    if missing:
+        logger.info(f"Backfilling {len(missing)} episode summaries")
+        filled = await asyncio.gather(*(
+            summarize_conversation(uid, json.loads(conv_json)) for _, (uid, _, conv_json) in missing
+        ))
+        for (episode_id, (uid, _, conv_json)), summary in zip(missing, filled):
+            await _write_episode(uid, episode_id, None, {}, summary)
+            rows[episode_id] = (uid, summary, conv_json)
+    return [rows[episode_id][1] for episode_id in episode_ids if episode_id in rows and rows[episode_id][1]]
+
+async def summarize_episodes(episode_ids: list[str], kind: str, known: dict[str, str] | None = None) -> str:
+    """
+    Build a `kind` summary ("summary" or "content") of the given episodes from their stored summaries.
+    """
+    return await summaries.compose(await get_episode_summaries(episode_ids, known), kind)
+
+def _summary_messages(conv: list[dict]) -> list[dict]:
     # Format conversation turns
     conv_formatted = "\n".join([f"{turn.get('speaker')}: {turn.get('text','')}" for turn in conv])
     system_prompt = (
         "You are a helpful assistant that summarizes the following conversation between AI and User concisely. "
         "Only output the summary."
     )
-    async with httpx.AsyncClient(timeout=GRAPHITI_LLM_TIMEOUT) as client:
-        chat_payload = {
-            "model": MODEL_NAME,
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": conv_formatted},
-            ],
-            "max_tokens": 256,
-        }
-        try:
-            resp = await client.post(
-                f"{OPENAI_API_BASE}/chat/completions",
-                headers={"Authorization": f"Bearer {OPENAI_API_KEY}"},
-                json=chat_payload,
-            )
-            resp.raise_for_status()
-            data = resp.json()
-            return data["choices"][0]["message"]["content"].strip()
-        except httpx.HTTPStatusError as err:
-            if err.response.status_code != 404:
-                raise
-        # Fallback to legacy completions endpoint
-        comp_payload = {
-            "model": MODEL_NAME,
-            "prompt": f"{system_prompt}\n\n{conv_formatted}",
-            "max_tokens": 256,
-        }
-        resp2 = await client.post(
-            f"{OPENAI_API_BASE}/completions",
-            headers={"Authorization": f"Bearer {OPENAI_API_KEY}"},
-            json=comp_payload,
-        )
-        resp2.raise_for_status()
-        comp_data = resp2.json()
-        return comp_data.get("choices", [{}])[0].get("text", "").strip() 
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": conv_formatted},
+    ]
+
+async def summarize_conversation(uid: str, conv: list[dict]) -> str:
+    """
+    Summarize the given conversation using LLM.
+    """
+    return await llm.complete(_summary_messages(conv), max_tokens=256)
+
+def summarize_conversation_stream(uid: str, conv: list[dict]) -> AsyncIterator[str]:
+    """
+    Like `summarize_conversation`, yielding the summary text as the LLM streams it.
+    """
+    return llm.stream(_summary_messages(conv), max_tokens=256)
+
+async def summarize_episodes_stream(episode_ids: list[str], kind: str, known: dict[str, str] | None = None) -> AsyncIterator[str]:
+    """
+    Like `summarize_episodes`, yielding the final summary text as the LLM streams it.
+    """
+    async for text in summaries.compose_stream(await get_episode_summaries(episode_ids, known), kind):
+        yield text
 
 # --------------- Additional commented-out preference retrieval strategies ---------------
 # def get_preferences_by_recent_conversations(uid: str, num_conversations: int = 2) -> list[str]:
@@ -302,13 +1060,4 @@ async def summarize_conversation(uid: str, conv: list[dict]) -> str:
 #             """,
 #             uid=uid, n=num_conversations
 #         )
-#         return [record["text"] for record in result]
-#
-# def get_preferences_with_context(uid: str, previous_question: str, top_k: int = 5) -> list[str]:
-#     """
-#     Retrieve top_k preferences using vector search based on previous question context.
-#     """
-#     # Example using Graphiti hybrid search recipe:
-#     # prefs = graphiti.search_preferences(uid=uid, context=previous_question, top_k=top_k)
-#     # return prefs
-#     pass 
\ No newline at end of file
+#         return [record["text"] for record in result] 
\ No newline at end of file
@@ -0,0 +1,255 @@
+"""
+In-process ingestion job queue drained by a bounded pool of async workers.
+
+The ingest route persists the raw Episode and hands the slow part (LLM extraction
+and relationship writes) to this queue, so request latency no longer tracks LLM latency.
+A job submitted with `retries` is re-queued after a failure, with exponential backoff
+(INGEST_RETRY_BACKOFF doubling per attempt, plus jitter); its status is "retrying" meanwhile.
+
+Best-effort follow-up work (question refills, preference embeddings, background episode
+summaries) goes to `background_queue` instead: a separate, smaller pool with its own bound
+and stats, so it never takes a worker or a queue slot from an ingest.
+"""
+import asyncio
+import inspect
+import os
+import random
+import time
+import uuid
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, Callable
+from loguru import logger
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "4"))
+INGEST_QUEUE_MAXSIZE = int(os.getenv("INGEST_QUEUE_MAXSIZE", "1000"))
+INGEST_JOB_RETENTION = int(os.getenv("INGEST_JOB_RETENTION", "10000"))
+# Number of recent jobs kept for latency percentiles
+INGEST_LATENCY_WINDOW = int(os.getenv("INGEST_LATENCY_WINDOW", "1000"))
+# Re-runs of a failed extraction job, and the delay before the first one (seconds)
+INGEST_JOB_RETRIES = int(os.getenv("INGEST_JOB_RETRIES", "3"))
+INGEST_RETRY_BACKOFF = float(os.getenv("INGEST_RETRY_BACKOFF", "2"))
+BACKGROUND_WORKERS = int(os.getenv("BACKGROUND_WORKERS", "2"))
+BACKGROUND_QUEUE_MAXSIZE = int(os.getenv("BACKGROUND_QUEUE_MAXSIZE", "1000"))
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+
+@dataclass
+class IngestJob:
+    id: str
+    uid: str
+    func: Callable[..., Any] = field(repr=False)
+    args: tuple = field(default=(), repr=False)
+    kwargs: dict = field(default_factory=dict, repr=False)
+    episode_id: str | None = None
+    retries: int = 0
+    attempts: int = 0
+    status: str = "queued"
+    error: str | None = None
+    result: Any = None
+    submitted_at: float = field(default_factory=time.time)
+    started_at: float | None = None
+    finished_at: float | None = None
+
+    def to_dict(self) -> dict:
+        wait_ms = run_ms = None
+        if self.started_at is not None:
+            wait_ms = round((self.started_at - self.submitted_at) * 1000, 2)
+        if self.started_at is not None and self.finished_at is not None:
+            run_ms = round((self.finished_at - self.started_at) * 1000, 2)
+        return {
+            "job_id": self.id,
+            "uid": self.uid,
+            "status": self.status,
+            "episode_id": self.episode_id,
+            "error": self.error,
+            "attempts": self.attempts,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "wait_ms": wait_ms,
+            "run_ms": run_ms,
+        }
+
+
+def _percentile(samples: list[float], pct: float) -> float | None:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    idx = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return round(ordered[idx], 2)
+
+
+class IngestQueue:
+    """
+    Bounded asyncio queue plus a fixed pool of worker tasks.
+
+    Sync job functions run in the default thread pool so blocking I/O never stalls the event loop.
+    """
+
+    def __init__(self, num_workers: int = INGEST_WORKERS, maxsize: int = INGEST_QUEUE_MAXSIZE, name: str = "ingest"):
+        self.name = name
+        self.num_workers = num_workers
+        self.maxsize = maxsize
+        self._queue: asyncio.Queue | None = None
+        self._workers: list[asyncio.Task] = []
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._jobs: OrderedDict[str, IngestJob] = OrderedDict()
+        self._wait_ms: deque[float] = deque(maxlen=INGEST_LATENCY_WINDOW)
+        self._run_ms: deque[float] = deque(maxlen=INGEST_LATENCY_WINDOW)
+        self._in_flight = 0
+        self._retry_timers: dict[str, asyncio.TimerHandle] = {}
+        # Retries waiting for room in a full queue; referenced here so they are not garbage-collected
+        self._requeues: dict[asyncio.Task, IngestJob] = {}
+        self._counters = {"submitted": 0, "succeeded": 0, "failed": 0, "retried": 0, "rejected": 0}
+
+    def start(self) -> None:
+        """
+        Start the worker pool on the running event loop (no-op if already running there).
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._workers:
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._workers = [
+            loop.create_task(self._worker(), name=f"{self.name}-worker-{i}") for i in range(self.num_workers)
+        ]
+        logger.info(f"Started {self.num_workers} {self.name} workers (queue maxsize={self.maxsize})")
+
+    async def stop(self) -> None:
+        """
+        Cancel the workers; queued jobs that never started are marked failed.
+        """
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        for job_id, timer in self._retry_timers.items():
+            timer.cancel()
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.status = "failed"
+                job.finished_at = time.time()
+        self._retry_timers = {}
+        for task, job in list(self._requeues.items()):
+            task.cancel()
+            job.status = "failed"
+            job.finished_at = time.time()
+        await asyncio.gather(*self._requeues, return_exceptions=True)
+        self._requeues = {}
+        if self._queue is not None:
+            while not self._queue.empty():
+                job = self._queue.get_nowait()
+                job.status = "failed"
+                job.error = "shutdown before job started"
+                job.finished_at = time.time()
+        logger.info(f"Stopped {self.name} workers")
+
+    def submit(self, uid: str, func: Callable[..., Any], *args, episode_id: str | None = None, retries: int = 0,
+               **kwargs) -> IngestJob:
+        """
+        Enqueue `func(*args, **kwargs)` and return its job; raises QueueFullError at capacity.
+
+        A failing job is run again up to `retries` more times, with backoff.
+        """
+        self.start()
+        job = IngestJob(id=str(uuid.uuid4()), uid=uid, func=func, args=args, kwargs=kwargs, episode_id=episode_id,
+                        retries=retries)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self._counters["rejected"] += 1
+            raise QueueFullError(f"{self.name} queue is full ({self.maxsize} jobs)")
+        self._counters["submitted"] += 1
+        self._remember(job)
+        logger.debug(f"Queued {self.name} job {job.id} for uid={uid}, depth={self._queue.qsize()}")
+        return job
+
+    def get(self, job_id: str) -> IngestJob | None:
+        return self._jobs.get(job_id)
+
+    def stats(self) -> dict:
+        wait = list(self._wait_ms)
+        run = list(self._run_ms)
+        return {
+            "workers": len(self._workers),
+            "depth": self._queue.qsize() if self._queue is not None else 0,
+            "maxsize": self.maxsize,
+            "in_flight": self._in_flight,
+            **self._counters,
+            "wait_ms": {"p50": _percentile(wait, 50), "p95": _percentile(wait, 95), "p99": _percentile(wait, 99)},
+            "run_ms": {"p50": _percentile(run, 50), "p95": _percentile(run, 95), "p99": _percentile(run, 99)},
+        }
+
+    def _remember(self, job: IngestJob) -> None:
+        self._jobs[job.id] = job
+        # Forget the oldest finished jobs once over the retention bound
+        while len(self._jobs) > INGEST_JOB_RETENTION:
+            oldest_id, oldest = next(iter(self._jobs.items()))
+            if oldest.status in ("queued", "running", "retrying"):
+                break
+            del self._jobs[oldest_id]
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            job.status = "running"
+            job.attempts += 1
+            job.started_at = time.time()
+            self._in_flight += 1
+            try:
+                if inspect.iscoroutinefunction(job.func):
+                    job.result = await job.func(*job.args, **job.kwargs)
+                else:
+                    job.result = await asyncio.to_thread(job.func, *job.args, **job.kwargs)
+                if job.episode_id is None and isinstance(job.result, str):
+                    job.episode_id = job.result
+                job.status = "succeeded"
+                self._counters["succeeded"] += 1
+            except asyncio.CancelledError:
+                job.status = "failed"
+                job.error = "cancelled"
+                raise
+            except Exception as e:
+                job.error = str(e)
+                if job.attempts <= job.retries:
+                    self._schedule_retry(job)
+                else:
+                    logger.error(f"{self.name.capitalize()} job {job.id} for uid={job.uid} failed: {e}")
+                    job.status = "failed"
+                    self._counters["failed"] += 1
+            finally:
+                job.finished_at = time.time()
+                self._in_flight -= 1
+                self._wait_ms.append((job.started_at - job.submitted_at) * 1000)
+                self._run_ms.append((job.finished_at - job.started_at) * 1000)
+                self._queue.task_done()
+
+    def _schedule_retry(self, job: IngestJob) -> None:
+        delay = INGEST_RETRY_BACKOFF * 2 ** (job.attempts - 1) * random.uniform(0.8, 1.2)
+        logger.warning(f"{self.name.capitalize()} job {job.id} for uid={job.uid} failed (attempt {job.attempts}): {job.error}; "
+                       f"retrying in {delay:.1f}s")
+        job.status = "retrying"
+        self._counters["retried"] += 1
+        self._retry_timers[job.id] = self._loop.call_later(delay, self._requeue, job)
+
+    def _requeue(self, job: IngestJob) -> None:
+        self._retry_timers.pop(job.id, None)
+        job.status = "queued"
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            # Admitted jobs are never dropped: wait for room instead of failing
+            task = self._loop.create_task(self._queue.put(job))
+            self._requeues[task] = job
+            task.add_done_callback(self._requeues.pop)
+
+
+# Process-wide queue shared by the ingest routes
+ingest_queue = IngestQueue()
+# Lower-priority follow-up jobs that must not compete with ingests
+background_queue = IngestQueue(BACKGROUND_WORKERS, BACKGROUND_QUEUE_MAXSIZE, name="background")
@@ -0,0 +1,293 @@
+"""
+Shared, pooled async client for the OpenAI-compatible LLM endpoint.
+
+One long-lived httpx.AsyncClient (keep-alive, optional HTTP/2, bounded pool) is owned by
+the app lifespan. The first call detects whether the server speaks /chat/completions or
+only the legacy /completions endpoint and caches the answer, so later calls never pay
+for a 404 round trip.
+
+Calls go through the client's `UpstreamGuard` (see app.resilience): a 429/5xx or a transport
+error is retried with backoff honouring Retry-After, and a provider that keeps failing, or
+more load than it takes, raises `UpstreamUnavailableError` instead of piling up requests.
+"""
+import asyncio
+import importlib.util
+import json
+import os
+import time
+from collections.abc import AsyncIterator
+import httpx
+from loguru import logger
+from app.metrics import LLM_REQUEST_SECONDS, LLM_TOKENS, LLM_IN_FLIGHT, registry
+from app.resilience import UpstreamGuard, UpstreamUnavailableError, RetryableError
+from app.utils import parse_retry_after
+
+OPENAI_API_BASE = os.getenv("OPENAI_API_BASE")
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+MODEL_NAME = os.getenv("NEBIUS_MODEL_NAME")
+GRAPHITI_LLM_TIMEOUT = int(os.getenv("GRAPHITI_LLM_TIMEOUT", "25"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "30"))
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "false").lower() in ("true", "1", "yes")
+# max_tokens used on the legacy completions endpoint when the caller sets no limit
+# (the endpoint's own default is far too small for a question or a summary)
+LLM_COMPLETIONS_MAX_TOKENS = int(os.getenv("LLM_COMPLETIONS_MAX_TOKENS", "256"))
+# Initial adaptive concurrency limit; it grows up to LLM_MAX_CONNECTIONS while the provider keeps up
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "32"))
+# Upstream statuses worth retrying; 429 and 503 also mean the provider wants less load
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+OVERLOAD_STATUSES = {429, 503}
+
+CHAT = "chat"
+COMPLETIONS = "completions"
+
+
+class LLMClient:
+    """
+    Pooled OpenAI-compatible client exposing `complete()`, `stream()` and `embed()`.
+    """
+
+    def __init__(
+        self,
+        base_url: str | None = OPENAI_API_BASE,
+        api_key: str | None = OPENAI_API_KEY,
+        model: str | None = MODEL_NAME,
+        timeout: float = GRAPHITI_LLM_TIMEOUT,
+        http2: bool = LLM_HTTP2,
+        limits: httpx.Limits | None = None,
+        transport: httpx.AsyncBaseTransport | None = None,
+        guard: UpstreamGuard | None = None,
+    ):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.model = model
+        self.timeout = timeout
+        if http2 and importlib.util.find_spec("h2") is None:
+            logger.warning("LLM_HTTP2 requested but the 'h2' package is not installed; using HTTP/1.1")
+            http2 = False
+        self.http2 = http2
+        self.limits = limits or httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+        )
+        self._transport = transport
+        self.guard = guard or UpstreamGuard.from_env(
+            "LLM", concurrency=LLM_CONCURRENCY, max_concurrency=self.limits.max_connections or LLM_MAX_CONNECTIONS,
+            failures=(httpx.TransportError,), overloads=(httpx.TimeoutException,),
+        )
+        self._client: httpx.AsyncClient | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._endpoint: str | None = None
+        self._probe_lock: asyncio.Lock | None = None
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.base_url and self.api_key)
+
+    @property
+    def endpoint(self) -> str | None:
+        """
+        The detected endpoint kind ("chat" or "completions"), or None before the first call.
+        """
+        return self._endpoint
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # Pooled connections belong to the loop that opened them; rebuild if the loop changed
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url or "",
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                timeout=self.timeout,
+                limits=self.limits,
+                http2=self.http2,
+                transport=self._transport,
+            )
+            self._loop = loop
+            self._probe_lock = asyncio.Lock()
+        return self._client
+
+    async def start(self) -> None:
+        self._get_client()
+        logger.info(f"LLM client ready for {self.base_url} (http2={self.http2}, max_connections={self.limits.max_connections})")
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._loop = None
+
+    def _payload(self, endpoint: str, messages: list[dict], max_tokens: int | None, temperature: float | None, model: str) -> dict:
+        if endpoint == CHAT:
+            payload = {"model": model, "messages": messages}
+            if max_tokens is not None:
+                payload["max_tokens"] = max_tokens
+        else:
+            payload = {
+                "model": model,
+                "prompt": "\n\n".join(m["content"] for m in messages),
+                "max_tokens": max_tokens if max_tokens is not None else LLM_COMPLETIONS_MAX_TOKENS,
+            }
+        if temperature is not None:
+            payload["temperature"] = temperature
+        return payload
+
+    @staticmethod
+    def _check_status(path: str, resp: httpx.Response) -> None:
+        if resp.status_code in RETRY_STATUSES:
+            raise RetryableError(
+                f"{path} returned {resp.status_code}", parse_retry_after(resp.headers.get("Retry-After")),
+                overload=resp.status_code in OVERLOAD_STATUSES,
+            )
+
+    async def _post(self, endpoint: str, path: str, payload: dict) -> httpx.Response:
+        return await self.guard.call(self._send, endpoint, path, payload, retry_on=(httpx.TransportError,))
+
+    async def _send(self, endpoint: str, path: str, payload: dict) -> httpx.Response:
+        model = payload.get("model")
+        start = time.perf_counter()
+        status = "error"
+        with LLM_IN_FLIGHT.track(endpoint=endpoint):
+            try:
+                resp = await self._get_client().post(path, json=payload)
+                status = resp.status_code
+            finally:
+                LLM_REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint, model=model, status=status)
+        self._check_status(path, resp)
+        return resp
+
+    def _count_usage(self, endpoint: str, data: dict) -> None:
+        usage = data.get("usage") or {}
+        for kind in ("prompt_tokens", "completion_tokens"):
+            if usage.get(kind):
+                LLM_TOKENS.inc(usage[kind], endpoint=endpoint, model=data.get("model") or self.model, kind=kind.split("_")[0])
+
+    async def _post_chat(self, messages: list[dict], max_tokens: int | None, temperature: float | None, model: str) -> httpx.Response:
+        return await self._post(CHAT, "/chat/completions", self._payload(CHAT, messages, max_tokens, temperature, model))
+
+    async def _post_completions(self, messages: list[dict], max_tokens: int | None, temperature: float | None, model: str) -> httpx.Response:
+        return await self._post(COMPLETIONS, "/completions", self._payload(COMPLETIONS, messages, max_tokens, temperature, model))
+
+    def _text(self, endpoint: str, resp: httpx.Response) -> str:
+        data = resp.json()
+        self._count_usage(endpoint, data)
+        choice = (data.get("choices") or [{}])[0]
+        if endpoint == CHAT:
+            return (choice.get("message", {}).get("content") or "").strip()
+        return (choice.get("text") or "").strip()
+
+    async def _detect_and_complete(self, messages, max_tokens, temperature, model) -> str | None:
+        async with self._probe_lock:
+            if self._endpoint is not None:
+                return None
+            resp = await self._post_chat(messages, max_tokens, temperature, model)
+            if resp.status_code == 404:
+                logger.info(f"{self.base_url}/chat/completions returned 404; using legacy completions endpoint")
+                self._endpoint = COMPLETIONS
+                resp = await self._post_completions(messages, max_tokens, temperature, model)
+                resp.raise_for_status()
+                return self._text(COMPLETIONS, resp)
+            resp.raise_for_status()
+            self._endpoint = CHAT
+            return self._text(CHAT, resp)
+
+    async def complete(
+        self,
+        messages: list[dict],
+        max_tokens: int | None = None,
+        temperature: float | None = None,
+        model: str | None = None,
+    ) -> str:
+        """
+        Run one completion and return the stripped text of the first choice.
+
+        `messages` uses the chat format; for completions-only servers they are joined into a prompt.
+        """
+        model = model or self.model
+        self._get_client()
+        if self._endpoint is None:
+            text = await self._detect_and_complete(messages, max_tokens, temperature, model)
+            if text is not None:
+                return text
+        if self._endpoint == CHAT:
+            resp = await self._post_chat(messages, max_tokens, temperature, model)
+        else:
+            resp = await self._post_completions(messages, max_tokens, temperature, model)
+        resp.raise_for_status()
+        return self._text(self._endpoint, resp)
+
+    @staticmethod
+    def _delta(endpoint: str, chunk: dict) -> str:
+        choice = (chunk.get("choices") or [{}])[0]
+        if endpoint == CHAT:
+            return choice.get("delta", {}).get("content") or ""
+        return choice.get("text") or ""
+
+    async def stream(
+        self,
+        messages: list[dict],
+        max_tokens: int | None = None,
+        temperature: float | None = None,
+        model: str | None = None,
+    ) -> AsyncIterator[str]:
+        """
+        Run one completion with `stream: true` and yield text deltas as they arrive.
+
+        Closing the iterator (or cancelling its consumer) closes the upstream connection, so
+        the server stops generating. Streams are admitted by the guard but not retried; a
+        429/5xx when the stream opens raises `UpstreamUnavailableError`.
+        """
+        model = model or self.model
+        client = self._get_client()
+        endpoint = self._endpoint or CHAT
+        path = "/chat/completions" if endpoint == CHAT else "/completions"
+        start = time.perf_counter()
+        status = "error"
+        with LLM_IN_FLIGHT.track(endpoint=f"{endpoint}_stream"):
+            try:
+                async with self.guard.admit() as attempt, client.stream(
+                        "POST", path, json={**self._payload(endpoint, messages, max_tokens, temperature, model), "stream": True}) as resp:
+                    status = resp.status_code
+                    if resp.status_code in RETRY_STATUSES:
+                        attempt.fail(overload=resp.status_code in OVERLOAD_STATUSES)
+                        retry_after = parse_retry_after(resp.headers.get("Retry-After")) or self.guard.backoff_base
+                        raise UpstreamUnavailableError(f"{path} returned {resp.status_code}", self.guard.name, retry_after)
+                    if resp.status_code == 404 and endpoint == CHAT and self._endpoint is None:
+                        logger.info(f"{self.base_url}/chat/completions returned 404; using legacy completions endpoint")
+                        self._endpoint = COMPLETIONS
+                        resp = None
+                    else:
+                        resp.raise_for_status()
+                        self._endpoint = endpoint
+                        async for line in resp.aiter_lines():
+                            if not line.startswith("data:"):
+                                continue
+                            data = line[5:].strip()
+                            if data == "[DONE]":
+                                break
+                            text = self._delta(endpoint, json.loads(data))
+                            if text:
+                                yield text
+            finally:
+                LLM_REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=f"{endpoint}_stream", model=model, status=status)
+        if resp is None:
+            async for text in self.stream(messages, max_tokens, temperature, model):
+                yield text
+
+    async def embed(self, texts: list[str], model: str | None = None) -> list[list[float]]:
+        """
+        Embed a batch of texts with the /embeddings endpoint; vectors come back in input order.
+        """
+        resp = await self._post("embeddings", "/embeddings", {"model": model or self.model, "input": texts})
+        resp.raise_for_status()
+        body = resp.json()
+        self._count_usage("embeddings", body)
+        data = sorted(body["data"], key=lambda item: item.get("index", 0))
+        return [item["embedding"] for item in data]
+
+
+# Process-wide client shared by every call site
+llm = LLMClient()
+registry.register_collector(llm.guard.collect)
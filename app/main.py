@@ -1,22 +1,54 @@
 import os
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from fastapi import FastAPI
 from loguru import logger
 
 load_dotenv()
 
+from app.ingest_queue import ingest_queue, background_queue
+from app import schema
+from app.services import services
+from app.retention import retention, ARCHIVE_ENABLED
+import app.graphiti_client as graphiti_client
 from app.routes.ingest import router as ingest_router
 from app.routes.questions import router as questions_router
-from app.routes.summary import router as summary_router
 from app.routes.content import router as content_router
 # from app.routes.preferences import router as preferences_router
 from app.routes.conversation_summary import router as conversation_summary_router
-from app.routes.get_conversation import router as get_conversation_router
+from app.routes.metrics import router as metrics_router
+from app.routes.profiles import router as profiles_router
+from app.metrics import MetricsMiddleware
 
-app = FastAPI(title="Preference Backend")
+# Create/verify Neo4j constraints and indexes on startup
+SCHEMA_BOOTSTRAP = os.getenv("SCHEMA_BOOTSTRAP", "true").lower() in ("true", "1", "yes")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open the pooled clients (Neo4j warm-up included) and start the ingestion workers on the server's event loop
+    await services.start(graphiti_client.driver)
+    if SCHEMA_BOOTSTRAP:
+        try:
+            await schema.ensure_schema(graphiti_client.driver)
+        except Exception as e:
+            logger.warning(f"Schema bootstrap skipped: {e}")
+    ingest_queue.start()
+    background_queue.start()
+    if ARCHIVE_ENABLED:
+        retention.start(graphiti_client.driver)
+    yield
+    await retention.stop()
+    await ingest_queue.stop()
+    await background_queue.stop()
+    await services.aclose()
+
+app = FastAPI(title="Preference Backend", lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(ingest_router)
 app.include_router(questions_router) 
 # app.include_router(preferences_router) 
 app.include_router(content_router) 
-app.include_router(conversation_summary_router) 
\ No newline at end of file
+app.include_router(conversation_summary_router)
+app.include_router(profiles_router)
+app.include_router(metrics_router) 
\ No newline at end of file
@@ -0,0 +1,332 @@
+"""
+In-process metrics in the Prometheus text format, served at /metrics.
+
+Histograms cover the hot path: LLM requests (by endpoint kind and model, with token
+counts from the response `usage`), every Neo4j transaction function (by query id),
+parsing/sanitizing of LLM output and per-route latency. Counters and in-flight gauges
+come along. Collectors registered with `register_collector` are read at scrape time,
+which is how the ingest queue depth is exposed.
+
+`SamplingProfiler` is a low-overhead stack sampler that can be started and stopped at
+runtime (see the /debug/profiler routes). It is off unless PROFILER_ENABLED is set.
+"""
+import bisect
+import functools
+import os
+import sys
+import threading
+import time
+from collections import Counter as _Tally
+from collections.abc import Callable
+from contextlib import contextmanager
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("true", "1", "yes")
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "false").lower() in ("true", "1", "yes")
+PROFILER_INTERVAL = float(os.getenv("PROFILER_INTERVAL", "0.01"))
+
+# Latency buckets in seconds, from a fast Neo4j lookup to a slow LLM completion
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> list[str]:
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(v)}" for key, v in sorted(self._values.items())]
+
+    def clear(self) -> None:
+        self._values.clear()
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    @contextmanager
+    def track(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (non-cumulative, last is +Inf), sum, count]
+        self._series: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        series = self._series.get(self._key(labels))
+        return series[2] if series else 0
+
+    def _samples(self) -> list[str]:
+        lines = []
+        for key, (counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+    def clear(self) -> None:
+        self._series.clear()
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+        self._collectors: list[Callable[[], None]] = []
+
+    def add(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def register_collector(self, collect: Callable[[], None]) -> None:
+        """
+        Register a callback run before each scrape, typically setting gauges from live state.
+        """
+        self._collectors.append(collect)
+
+    def render(self) -> str:
+        for collect in self._collectors:
+            collect()
+        return "\n".join(line for metric in self._metrics.values() for line in metric.render()) + "\n"
+
+    def clear(self) -> None:
+        for metric in self._metrics.values():
+            metric.clear()
+
+
+registry = Registry()
+
+LLM_REQUEST_SECONDS = registry.add(Histogram(
+    "llm_request_seconds", "LLM request latency", ("endpoint", "model", "status")))
+LLM_TOKENS = registry.add(Counter(
+    "llm_tokens_total", "Tokens reported in LLM response usage", ("endpoint", "model", "kind")))
+LLM_IN_FLIGHT = registry.add(Gauge(
+    "llm_requests_in_flight", "LLM requests awaiting a response", ("endpoint",)))
+NEO4J_QUERY_SECONDS = registry.add(Histogram(
+    "neo4j_query_seconds", "Neo4j transaction function latency", ("query",)))
+NEO4J_QUERY_ERRORS = registry.add(Counter(
+    "neo4j_query_errors_total", "Neo4j transaction functions that raised", ("query",)))
+PARSE_SECONDS = registry.add(Histogram(
+    "parse_seconds", "Time spent parsing and sanitizing LLM output", ("stage",)))
+HTTP_REQUEST_SECONDS = registry.add(Histogram(
+    "http_request_seconds", "Request latency by route", ("method", "route", "status")))
+HTTP_IN_FLIGHT = registry.add(Gauge("http_requests_in_flight", "Requests being handled"))
+INGEST_RELATIONS = registry.add(Histogram(
+    "ingest_relations_written", "Relationships written per ingest", (), COUNT_BUCKETS))
+INGEST_QUEUE_DEPTH = registry.add(Gauge("ingest_queue_depth", "Jobs waiting in the ingest queue"))
+INGEST_IN_FLIGHT = registry.add(Gauge("ingest_jobs_in_flight", "Ingest jobs being run by a worker"))
+BACKGROUND_QUEUE_DEPTH = registry.add(Gauge("background_queue_depth", "Follow-up jobs waiting in the background queue"))
+BACKGROUND_IN_FLIGHT = registry.add(Gauge("background_jobs_in_flight", "Follow-up jobs being run by a background worker"))
+
+
+def timed_query(query_id: str):
+    """
+    Decorator for Neo4j transaction functions: observe each call under `query_id`.
+    """
+    def wrap(fn):
+        @functools.wraps(fn)
+        async def run(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            except Exception:
+                NEO4J_QUERY_ERRORS.inc(query=query_id)
+                raise
+            finally:
+                NEO4J_QUERY_SECONDS.observe(time.perf_counter() - start, query=query_id)
+        return run
+    return wrap
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording per-route latency and in-flight requests.
+
+    Routes are labelled by their path template (e.g. /ingest_jobs/{job_id}), so ids do not
+    explode the label set; unmatched paths are labelled "unmatched".
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, method=scope["method"], route=route, status=status["code"])
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of all threads every `interval` seconds from a daemon thread.
+
+    Results are collapsed stacks ("outer;inner count"), the input format of flame graph tools.
+    Coroutines show up through the event loop thread's frames.
+    """
+
+    def __init__(self):
+        self._thread: threading.Thread | None = None
+        self._stop = threading.Event()
+        self._samples: _Tally = _Tally()
+        # Guards `_samples` between the sampler thread and `report` on the event loop
+        self._lock = threading.Lock()
+        self.interval = PROFILER_INTERVAL
+        self.started_at: float | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval: float | None = None) -> None:
+        if self.running:
+            return
+        self.interval = interval or PROFILER_INTERVAL
+        with self._lock:
+            self._samples = _Tally()
+        self._stop.clear()
+        self.started_at = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> dict:
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        return self.report()
+
+    def report(self, limit: int = 200) -> dict:
+        with self._lock:
+            samples = self._samples.most_common(limit)
+            total = sum(self._samples.values())
+        return {
+            "running": self.running,
+            "interval": self.interval,
+            "seconds": round(time.monotonic() - self.started_at, 3) if self.started_at else 0,
+            "samples": total,
+            "stacks": [f"{stack} {count}" for stack, count in samples],
+        }
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            stacks = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+                    frame = frame.f_back
+                stacks.append(";".join(reversed(stack)))
+            with self._lock:
+                for stack in stacks:
+                    self._samples[stack] += 1
+
+
+profiler = SamplingProfiler()
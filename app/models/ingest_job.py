@@ -0,0 +1,19 @@
+from pydantic import BaseModel, Field
+
+class IngestAccepted(BaseModel):
+    status: str = Field("accepted", example="accepted")
+    job_id: str = Field(..., example="0b6f5c1e-2b1f-4d8e-9a57-3f0c2f1d9a10")
+    episode_id: str | None = Field(None, example="5e0d7c3a-51a4-4c1b-8f5e-0a6f8a0c2b11")
+
+class IngestJobOut(BaseModel):
+    job_id: str
+    uid: str
+    status: str = Field(..., example="succeeded")
+    episode_id: str | None = None
+    error: str | None = None
+    attempts: int = 0
+    submitted_at: float
+    started_at: float | None = None
+    finished_at: float | None = None
+    wait_ms: float | None = None
+    run_ms: float | None = None
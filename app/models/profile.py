@@ -0,0 +1,24 @@
+from pydantic import BaseModel, Field
+
+class ProfileEntry(BaseModel):
+    name: str = Field(..., example="hiking")
+    count: int = Field(..., example=3)
+    rank: float = Field(..., description="Log of the decayed mention count; higher ranks first")
+    last_seen: str | None = None
+
+class ProfileEpisode(BaseModel):
+    id: str
+    created_at: str | None = None
+    summary: str | None = None
+
+class UserProfile(BaseModel):
+    uid: str = Field(..., example="1234567890")
+    preferences: dict[str, list[ProfileEntry]] = Field(default_factory=dict, description="Top preferences per category")
+    emotions: list[ProfileEntry] = []
+    problems: list[ProfileEntry] = []
+    coping_strategies: list[ProfileEntry] = []
+    recent_episodes: list[ProfileEpisode] = []
+    episode_count: int = 0
+    last_active: str | None = None
+    version: int = 0
+    updated_at: str | None = None
@@ -0,0 +1,6 @@
+from pydantic import BaseModel, Field
+
+class NextQuestionWithContextIn(BaseModel):
+    uid: str = Field(..., example="1234567890")
+    previous_question: str = Field(..., example="What calms you?")
+    num_preferences: int = Field(5, example=5)
@@ -0,0 +1,247 @@
+"""
+Write-time normalization of LLM-extracted relations.
+
+The LLM invents object types, relation names and spellings freely. Writing them as they come
+would mean a new label or relationship type (and name index) per variant, and a separate node
+for each spelling of the same thing. Before anything is MERGEd:
+- object types are mapped onto a small canonical label vocabulary. Unknown types become
+  FALLBACK_LABEL, and the extracted type is kept on the node as `extracted_type`;
+- relation names are mapped onto canonical relationship types. Unknown names become
+  FALLBACK_RELATION, and the extracted name is kept on the edge as `extracted_relation`;
+- object names are folded into a `key`: Unicode NFKC, case, whitespace, surrounding punctuation,
+  and the regular plural of the head (last) word. Words the suffix rules would corrupt
+  ("glasses", "dallas", "movies") are listed as invariant or as "-ie" nouns. An optional
+  alias table maps names onto a canonical spelling. Object nodes are MERGEd on the key;
+  `name` keeps the spelling the node was first written with, only whitespace-trimmed.
+
+The built-in tables can be extended with GRAPH_VOCABULARY_PATH, a JSON file shaped as
+{"labels": {"Canonical": [aliases]}, "relations": {"CANONICAL": [aliases]}, "names": {alias: name},
+"invariant": [words]}.
+Set GRAPH_NORMALIZATION=false to write types and names as extracted (the old behaviour).
+`python -m app.compaction` applies the same rules to an existing graph.
+"""
+import json
+import os
+import re
+import unicodedata
+from loguru import logger
+
+GRAPH_NORMALIZATION = os.getenv("GRAPH_NORMALIZATION", "true").lower() in ("true", "1", "yes")
+GRAPH_VOCABULARY_PATH = os.getenv("GRAPH_VOCABULARY_PATH")
+FALLBACK_LABEL = "Entity"
+FALLBACK_RELATION = "RELATES_TO"
+
+# Canonical label -> aliases (matched after `_key` folding, so "Coping strategies" finds "coping strategy")
+LABELS = {
+    "Preference": ["preference", "favorite", "favourite", "taste", "like"],
+    "Interest": ["interest", "topic", "subject", "music", "genre", "art", "book", "movie", "film", "show", "game"],
+    "Hobby": ["hobby", "pastime", "leisure", "leisure activity"],
+    "Activity": ["activity", "sport", "exercise", "workout", "physical activity"],
+    "Food": ["food", "dish", "cuisine", "meal", "drink", "beverage", "snack"],
+    "Emotion": ["emotion", "feeling", "mood", "sentiment", "emotional state"],
+    "Problem": ["problem", "issue", "challenge", "struggle", "difficulty", "concern", "stressor", "worry"],
+    "Action": ["action", "behavior", "behaviour", "habit", "practice", "routine"],
+    "CopingStrategy": ["coping strategy", "coping mechanism", "coping", "coping skill", "strategy", "technique"],
+    "Goal": ["goal", "aspiration", "wish", "desire", "plan"],
+    "Value": ["value", "belief", "principle"],
+    "Person": ["person", "people", "family", "family member", "friend"],
+    "Place": ["place", "location", "city", "country"],
+    FALLBACK_LABEL: ["entity", "thing", "object", "other"],
+}
+
+# Canonical relationship type -> aliases (verbs are matched in their base form)
+RELATIONS = {
+    "LIKES": ["like", "be fond of", "fond of", "appreciate"],
+    "LOVES": ["love", "adore"],
+    "ENJOYS": ["enjoy"],
+    "PREFERS": ["prefer", "favor", "favour"],
+    "WANTS": ["want", "wish", "wish for", "desire", "hope for", "would like"],
+    "VALUES": ["value", "care about"],
+    "INTERESTED_IN": ["interested in", "curious about"],
+    "DISLIKES": ["dislike", "hate", "not like"],
+    "AVOIDS": ["avoid"],
+    "FEELS": ["feel", "feeling", "experience", "experiencing"],
+    "STRUGGLES_WITH": ["struggle with", "struggling with", "suffer from", "has problem", "has problem with",
+                       "has issue with", "worried about", "worry about", "stressed about", "anxious about"],
+    "USES": ["use", "rely on", "cope with", "cope by", "copes using"],
+    "DOES": ["do", "practice", "practise", "perform", "play", "engage in"],
+    "NEEDS": ["need", "require"],
+    FALLBACK_RELATION: ["relate to", "related to", "rel", "mention"],
+}
+
+# Words dropped from the front of a relation ("the user is interested in" -> "interested in")
+_RELATION_PREFIXES = {"the", "user", "seeker", "i", "he", "she", "they", "is", "are", "am", "be", "being"}
+# Words the plural rules must not touch: plural-only nouns, -s singulars and proper names
+_INVARIANT = {
+    "news", "series", "species", "yoga", "chess", "physics", "mathematics", "athletics", "gymnastics",
+    "politics", "economics", "ethics", "aerobics", "electronics", "olympics", "diabetes", "measles",
+    "glasses", "sunglasses", "clothes", "jeans", "pants", "trousers", "shorts", "scissors", "binoculars",
+    "christmas", "atlas", "canvas", "alias", "bias", "pancreas", "dallas", "texas", "kansas", "arkansas",
+    "vegas", "angeles", "athens", "wales", "netherlands", "philippines", "bahamas", "maldives", "beatles",
+}
+# Singulars ending in "ie", so "movies" folds to "movie" rather than "movy"
+_IE_NOUNS = {
+    "movie", "cookie", "zombie", "rookie", "selfie", "hippie", "brownie", "smoothie", "pie", "tie", "lie",
+    "calorie", "goalie", "boogie", "genie", "indie", "veggie", "sweetie", "auntie", "bootie", "hoodie",
+}
+
+
+def _lemma(word: str, invariant: set[str] = _INVARIANT) -> str:
+    """
+    Singular (or base verb form) of one lower-case word, by suffix rules.
+    """
+    if len(word) <= 3 or word in invariant or word.endswith(("ss", "us", "is", "ous")):
+        return word
+    if word.endswith("ies") and word[:-1] in _IE_NOUNS:
+        return word[:-1]
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith(("ches", "shes", "xes", "sses", "zes")):
+        return word[:-2]
+    if word.endswith("s"):
+        return word[:-1]
+    return word
+
+
+def _key(text: str) -> str:
+    words = re.sub(r"[\W_]+", " ", unicodedata.normalize("NFKC", text).casefold()).split()
+    return " ".join(_lemma(word) for word in words)
+
+
+def display_name(name: str) -> str:
+    """
+    An object name as it is shown: NFKC, single-spaced, trimmed; case and plurals are kept.
+    """
+    return " ".join(unicodedata.normalize("NFKC", name).split()).strip(" \t.,;:!?\"'`()[]{}")
+
+
+def fold_name(name: str, invariant: set[str] = _INVARIANT) -> str:
+    """
+    Object key of a name: NFKC, case-folded, single-spaced, trimmed, head word singular.
+    """
+    text = display_name(name).casefold()
+    if not text:
+        return ""
+    head, _, last = text.rpartition(" ")
+    last = _lemma(last, invariant) if last.isalpha() else last
+    return f"{head} {last}" if head else last
+
+
+def sanitize_label(raw: str) -> str:
+    # Pre-normalization label rule: capitalize, non-word runs become underscores
+    return re.sub(r"\W+", "_", raw.strip()).strip("_").capitalize() or "Preference"
+
+
+def sanitize_relation(raw: str) -> str:
+    # Pre-normalization relationship type rule: upper case, non-word runs become underscores
+    return re.sub(r"\W+", "_", raw).strip("_").upper() or "REL"
+
+
+class ObjectName(str):
+    """
+    An object name as extracted that also carries its folded `key`, and the type or relation it
+    was extracted with when that fell back to FALLBACK_LABEL or FALLBACK_RELATION.
+    Compares and hashes as the name.
+    """
+    key: str
+    extracted_type: str | None
+    extracted_relation: str | None
+
+    def __new__(cls, name: str, key: str | None = None, extracted_type: str | None = None,
+                extracted_relation: str | None = None):
+        value = super().__new__(cls, name)
+        value.key = name if key is None else key
+        value.extracted_type = extracted_type
+        value.extracted_relation = extracted_relation
+        return value
+
+
+# Appended to a relation MERGE: keep the extracted type and relation ({source}.type/.relation, or null)
+EXTRACTED_SET = (
+    " SET o.extracted_type = coalesce({source}.type, o.extracted_type), "
+    "r.extracted_relation = coalesce({source}.relation, r.extracted_relation)"
+)
+
+
+def object_key(name: str) -> str:
+    """
+    The key an object node with this name is MERGEd on.
+    """
+    return name.key if isinstance(name, ObjectName) else vocabulary.key(name)
+
+
+def extracted(name: str) -> dict | None:
+    """
+    {"type", "relation"} an object name was extracted with before falling back, or None.
+    """
+    if isinstance(name, ObjectName) and (name.extracted_type or name.extracted_relation):
+        return {"type": name.extracted_type, "relation": name.extracted_relation}
+    return None
+
+
+class Vocabulary:
+    def __init__(self, labels: dict[str, list[str]] = LABELS, relations: dict[str, list[str]] = RELATIONS,
+                 names: dict[str, str] | None = None, enabled: bool = GRAPH_NORMALIZATION):
+        self.enabled = enabled
+        self.labels = set(labels)
+        self.relations = set(relations)
+        self.invariant = set(_INVARIANT)
+        self._label_aliases: dict[str, str] = {}
+        self._relation_aliases: dict[str, str] = {}
+        self._names: dict[str, str] = {}
+        self.extend(labels, relations, names or {})
+
+    def extend(self, labels: dict[str, list[str]] | None = None, relations: dict[str, list[str]] | None = None,
+               names: dict[str, str] | None = None, invariant: list[str] | None = None) -> None:
+        self.invariant.update(word.casefold() for word in invariant or [])
+        for canonical, aliases in (labels or {}).items():
+            self.labels.add(canonical)
+            for alias in [canonical, *aliases]:
+                self._label_aliases[_key(alias)] = canonical
+        for canonical, aliases in (relations or {}).items():
+            self.relations.add(canonical)
+            for alias in [canonical, *aliases]:
+                self._relation_aliases[self._relation_key(alias)] = canonical
+        for alias, canonical in (names or {}).items():
+            self._names[fold_name(alias, self.invariant)] = display_name(canonical)
+
+    @staticmethod
+    def _relation_key(text: str) -> str:
+        words = _key(text).split()
+        while len(words) > 1 and words[0] in _RELATION_PREFIXES:
+            words.pop(0)
+        return " ".join(words)
+
+    def label(self, raw: str | None) -> str:
+        if not self.enabled:
+            return sanitize_label(str(raw or "Preference"))
+        return self._label_aliases.get(_key(str(raw or "")), FALLBACK_LABEL)
+
+    def relation(self, raw: str | None) -> str:
+        if not self.enabled:
+            return sanitize_relation(str(raw or "REL"))
+        return self._relation_aliases.get(self._relation_key(str(raw or "")), FALLBACK_RELATION)
+
+    def name(self, raw: str | None) -> ObjectName:
+        if not self.enabled:
+            return ObjectName(str(raw or ""))
+        name = display_name(str(raw or ""))
+        name = self._names.get(fold_name(name, self.invariant), name)
+        return ObjectName(name, fold_name(name, self.invariant))
+
+    def key(self, raw: str | None) -> str:
+        return self.name(raw).key
+
+
+def load_vocabulary(path: str | None = GRAPH_VOCABULARY_PATH) -> Vocabulary:
+    vocabulary = Vocabulary()
+    if path:
+        with open(path) as fh:
+            extra = json.load(fh)
+        vocabulary.extend(extra.get("labels"), extra.get("relations"), extra.get("names"), extra.get("invariant"))
+        logger.info(f"Graph vocabulary extended from {path}")
+    return vocabulary
+
+
+# Shared by the ingest writers and the compaction job
+vocabulary = load_vocabulary()
@@ -0,0 +1,256 @@
+"""
+Materialized per-user profile, kept as one JSON document on the User node (`u.profile`).
+
+The document holds:
+- top preferences per category (object label);
+- the most recent emotions and problems;
+- the strongest coping strategies;
+- the newest Episodes with their summaries;
+- the episode count and the last-active time.
+
+It is maintained incrementally inside the ingest write transaction. The first statement
+bumps `u.profile_version` (taking the user's write lock, so concurrent ingests for one user
+apply in turn) and returns the stored document. The relation UNWINDs return the counters of
+the edges they touched. The new mentions are folded in here, and the document is written
+back with its ETag (`u.profile_etag`).
+
+A user without a document yet (new, or ingested before profiles existed) gets it built from
+the graph once, in the same transaction. Reads are a single-key lookup on the user. Lists
+are capped, so the document stays the same size however large the user's graph grows.
+"""
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+from app import schema
+
+PROFILE_ENABLED = os.getenv("PROFILE_ENABLED", "true").lower() in ("true", "1", "yes")
+# Entries kept per preference category and for coping strategies (by decayed rank)
+PROFILE_TOP_K = int(os.getenv("PROFILE_TOP_K", "10"))
+# Emotions and problems kept (most recent first)
+PROFILE_RECENT = int(os.getenv("PROFILE_RECENT", "10"))
+# Newest Episodes (id, created_at, revision, summary) kept for the summary routes
+PROFILE_EPISODES = int(os.getenv("PROFILE_EPISODES", "10"))
+
+# Appended to the first statement of an ingest transaction, after `u`, `e` and `created` are bound
+LOCK_AND_READ = (
+    "SET u.profile_version = coalesce(u.profile_version, 0) + 1 "
+    "RETURN u.uid AS uid, u.profile AS profile, u.profile_version AS version, created, "
+    "e.id AS episode_id, e.created_at AS created_at, e.updated_at AS updated_at, e.revision AS revision, "
+    "e.summary AS summary"
+)
+# Appended to a relation UNWIND so it returns the counters of the edges it touched
+EDGE_RETURN = "RETURN o.name AS name, r.count AS count, r.rank AS rank, r.last_seen AS last_seen"
+
+PROFILE_QUERY = "MATCH (u:User {uid:$uid}) RETURN u.profile AS profile, u.profile_etag AS etag"
+BATCH_PROFILE_QUERY = "UNWIND $uids AS uid MATCH (u:User {uid:uid}) RETURN uid, u.profile AS profile"
+REBUILD_QUERY = (
+    "UNWIND $uids AS uid "
+    "MATCH (u:User {uid:uid}) "
+    "CALL { WITH u OPTIONAL MATCH (u)-[:CREATED]->(e:Episode) "
+    "WITH e ORDER BY e.created_at DESC, e.id DESC "
+    "RETURN count(e) AS episode_count, "
+    "collect({id: e.id, created_at: e.created_at, updated_at: e.updated_at, revision: e.revision, "
+    "summary: e.summary})[..$episodes] AS episodes } "
+    "CALL { WITH u OPTIONAL MATCH (u)-[r]->(o) WHERE NOT o:Episode "
+    "RETURN collect({labels: labels(o), type: type(r), name: coalesce(o.name, o.text), count: r.count, "
+    "rank: r.rank, last_seen: r.last_seen}) AS edges } "
+    "RETURN uid, u.profile_version AS version, episode_count, episodes, edges"
+)
+WRITE_QUERY = (
+    "UNWIND $profiles AS p "
+    "MATCH (u:User {uid: p.uid}) "
+    "SET u.profile = p.doc, u.profile_etag = p.etag"
+)
+
+def _timestamp(value) -> str | None:
+    """
+    UTC ISO string of a neo4j DateTime, datetime or ISO string, so values compare as text.
+    """
+    if value is None:
+        return None
+    if hasattr(value, "to_native"):
+        value = value.to_native()
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).isoformat()
+
+
+def _latest(*values: str | None) -> str | None:
+    present = [v for v in values if v is not None]
+    return max(present) if present else None
+
+
+def dumps(doc: dict) -> str:
+    return json.dumps(doc, ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+
+
+def etag(text: str) -> str:
+    return '"' + hashlib.sha256(text.encode()).hexdigest()[:20] + '"'
+
+
+def etag_matches(if_none_match: str | None, current: str) -> bool:
+    """
+    Whether an If-None-Match header names the current ETag (weak comparison, "*" included).
+    """
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or current in tags
+
+
+class ProfileBuilder:
+    """
+    Folds edge counters and Episodes into profile documents.
+
+    An edge counts as a preference when its type is one of `preference_relations` or its
+    object label one of `preference_labels`, the same rule as the ranked preference query.
+    It can also land in one of the emotion, problem and coping strategy sections by label or type.
+    """
+
+    def __init__(self, preference_relations: list[str], preference_labels: list[str], top_k: int = PROFILE_TOP_K,
+                 recent: int = PROFILE_RECENT, episodes: int = PROFILE_EPISODES):
+        self.preference_relations = set(preference_relations)
+        self.preference_labels = set(preference_labels)
+        self.top_k = top_k
+        self.recent = recent
+        self.episodes = episodes
+
+    def empty(self, uid: str) -> dict:
+        return {"uid": uid, "preferences": {}, "emotions": [], "problems": [], "coping_strategies": [],
+                "recent_episodes": [], "episode_count": 0, "last_active": None, "version": 0, "updated_at": None}
+
+    def _targets(self, doc: dict, label: str, rel_type: str) -> list[tuple[list, str]]:
+        targets = []
+        if rel_type in self.preference_relations or label in self.preference_labels:
+            targets.append((doc["preferences"].setdefault(label, []), "rank"))
+        if label == "Emotion" or rel_type == "FEELS":
+            targets.append((doc["emotions"], "last_seen"))
+        elif label == "Problem" or rel_type == "STRUGGLES_WITH":
+            targets.append((doc["problems"], "last_seen"))
+        elif label == "CopingStrategy" or rel_type == "USES":
+            targets.append((doc["coping_strategies"], "rank"))
+        return targets
+
+    def apply_edges(self, doc: dict, edges: list[dict]) -> None:
+        """
+        Fold edge counters ({"label", "type", "name", "count", "rank", "last_seen"}) into `doc`.
+
+        A name reached through several edges keeps the strongest edge's count and rank and the latest mention.
+        """
+        touched: dict[int, tuple[list, str]] = {}
+        for edge in edges:
+            if not edge.get("name"):
+                continue
+            last_seen = _timestamp(edge.get("last_seen"))
+            for entries, order in self._targets(doc, edge["label"], edge["type"]):
+                touched[id(entries)] = (entries, order)
+                current = next((e for e in entries if e["name"] == edge["name"]), None)
+                if current is None:
+                    entries.append({"name": edge["name"], "count": edge.get("count") or 1,
+                                    "rank": edge.get("rank") or 0.0, "last_seen": last_seen})
+                    continue
+                current["count"] = max(current["count"], edge.get("count") or 1)
+                current["rank"] = max(current["rank"], edge.get("rank") or 0.0)
+                current["last_seen"] = _latest(current["last_seen"], last_seen)
+            doc["last_active"] = _latest(doc["last_active"], last_seen)
+        for entries, order in touched.values():
+            limit = self.top_k if order == "rank" else self.recent
+            entries.sort(key=lambda e: (e[order] is not None, e[order] or 0, e["name"]), reverse=True)
+            del entries[limit:]
+
+    def apply_episode(self, doc: dict, episode: dict, created: bool) -> None:
+        """
+        Record a written Episode ({"episode_id", "created_at", "updated_at", "revision", "summary"}).
+        """
+        if episode.get("episode_id") is None:
+            return
+        if created:
+            doc["episode_count"] += 1
+        entry = {"id": episode["episode_id"], "created_at": _timestamp(episode.get("created_at")),
+                 "revision": episode.get("revision"), "summary": episode.get("summary")}
+        recent = [e for e in doc["recent_episodes"] if e["id"] != entry["id"]] + [entry]
+        recent.sort(key=lambda e: (e["created_at"] or "", e["id"]), reverse=True)
+        doc["recent_episodes"] = recent[:self.episodes]
+        doc["last_active"] = _latest(doc["last_active"], _timestamp(episode.get("updated_at")))
+
+    def build(self, uid: str, episode_count: int, episodes: list[dict], edges: list[dict]) -> dict:
+        """
+        A full document from the rebuild query's rows (used once per user).
+        """
+        doc = self.empty(uid)
+        for episode in reversed(episodes):
+            if episode.get("id") is not None:
+                self.apply_episode(doc, {**episode, "episode_id": episode["id"]}, created=False)
+        doc["episode_count"] = episode_count
+        self.apply_edges(doc, [
+            {**edge, "label": next((l for l in edge["labels"] if l not in schema.CORE_LABELS), None) or "Entity"}
+            for edge in edges if edge.get("name") is not None
+        ])
+        return doc
+
+    async def refresh(self, tx, states: dict[str, dict], edges: dict[str, list[dict]]) -> None:
+        """
+        Fold this transaction's writes into each user's document and store it.
+
+        `states` maps uid to {"profile", "version", "episodes": [(row, created)]} as read by
+        LOCK_AND_READ; `edges` maps uid to the edge rows returned by the relation UNWINDs.
+        """
+        missing = [uid for uid, state in states.items() if state["profile"] is None]
+        rebuilt = {}
+        if missing:
+            result = await tx.run(REBUILD_QUERY, uids=missing, episodes=self.episodes)
+            async for record in result:
+                rebuilt[record["uid"]] = self.build(record["uid"], record["episode_count"],
+                                                    list(record["episodes"]), list(record["edges"]))
+        now = datetime.now(timezone.utc).isoformat()
+        rows = []
+        for uid, state in states.items():
+            doc = rebuilt.get(uid)
+            if doc is None:
+                if state["profile"] is None:
+                    continue
+                doc = json.loads(state["profile"])
+                for episode, created in state["episodes"]:
+                    self.apply_episode(doc, episode, created)
+                self.apply_edges(doc, edges.get(uid, []))
+            doc["version"] = state["version"]
+            doc["updated_at"] = now
+            text = dumps(doc)
+            rows.append({"uid": uid, "doc": text, "etag": etag(text)})
+        if rows:
+            result = await tx.run(WRITE_QUERY, profiles=rows)
+            await result.consume()
+
+
+def collect_state(states: dict[str, dict], record) -> None:
+    """
+    Add one LOCK_AND_READ record to `states` (several rows per user in a batch write).
+    """
+    state = states.setdefault(record["uid"], {"profile": record["profile"], "version": 0, "episodes": []})
+    state["version"] = max(state["version"], record["version"] or 0)
+    if record["episode_id"] is not None:
+        state["episodes"].append((dict(record), bool(record["created"])))
+
+
+def top_preferences(doc: dict, k: int) -> list[str]:
+    """
+    The k highest-ranked preference names across categories (exact for k <= PROFILE_TOP_K).
+    """
+    best: dict[str, float] = {}
+    for entries in doc.get("preferences", {}).values():
+        for entry in entries:
+            best[entry["name"]] = max(best.get(entry["name"], float("-inf")), entry.get("rank") or 0.0)
+    return [name for name, _ in sorted(best.items(), key=lambda kv: -kv[1])[:k]]
+
+
+def recent_episodes(doc: dict, n: int) -> list[dict] | None:
+    """
+    The newest `n` Episodes ({"id", "created_at", "revision", "summary"}), or None when the document keeps fewer than asked.
+    """
+    recent = doc.get("recent_episodes", [])
+    if n > len(recent) and len(recent) < doc.get("episode_count", 0):
+        return None
+    return recent[:n]
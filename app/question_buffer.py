@@ -0,0 +1,156 @@
+"""
+Per-user buffer of pre-generated next questions.
+
+`/next_question` pops a buffered question in O(1) and only generates live on a miss. After
+each serve, and after an ingest changes a buffered user's preferences, the buffer is
+refilled by a job on the background queue (at most one pending per user and top_k). An ingest also bumps the user's version,
+which drops every question generated from the old preferences, including ones still being
+generated. Questions older than QUESTION_BUFFER_TTL are dropped as well.
+"""
+import os
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from loguru import logger
+from app.ingest_queue import background_queue, QueueFullError, _percentile
+
+QUESTION_BUFFER_DEPTH = int(os.getenv("QUESTION_BUFFER_DEPTH", "3"))
+QUESTION_BUFFER_TTL = float(os.getenv("QUESTION_BUFFER_TTL", "3600"))
+QUESTION_BUFFER_MAX_USERS = int(os.getenv("QUESTION_BUFFER_MAX_USERS", "10000"))
+# Number of refills kept for lag percentiles
+QUESTION_BUFFER_LAG_WINDOW = int(os.getenv("QUESTION_BUFFER_LAG_WINDOW", "1000"))
+
+
+@dataclass
+class _UserBuffer:
+    version: int = 0
+    # num_preferences -> deque of (question, version, generated_at)
+    queues: dict[int, deque] = field(default_factory=dict)
+
+
+async def _generate(uid: str, top_k: int) -> str:
+    import app.graphiti_client as graphiti_client
+    prefs = await graphiti_client.get_preferences(uid=uid, top_k=top_k)
+    return await graphiti_client.generate_next_question(preferences=prefs)
+
+
+class QuestionBuffer:
+    def __init__(self, depth: int = QUESTION_BUFFER_DEPTH, ttl: float = QUESTION_BUFFER_TTL,
+                 max_users: int = QUESTION_BUFFER_MAX_USERS):
+        self.depth = depth
+        self.ttl = ttl
+        self.max_users = max_users
+        self._users: OrderedDict[str, _UserBuffer] = OrderedDict()
+        self._pending: set[tuple[str, int]] = set()
+        self._lag_ms: deque[float] = deque(maxlen=QUESTION_BUFFER_LAG_WINDOW)
+        self._counters = {"hits": 0, "misses": 0, "stale": 0, "invalidations": 0,
+                          "generated": 0, "refill_failures": 0, "refills_skipped": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.depth > 0
+
+    def pop(self, uid: str, top_k: int) -> str | None:
+        """
+        Take the oldest fresh buffered question for (uid, top_k), or None on a miss.
+        """
+        if not self.enabled:
+            return None
+        buffer = self._users.get(uid)
+        queue = buffer.queues.get(top_k) if buffer is not None else None
+        now = time.monotonic()
+        while queue:
+            question, version, generated_at = queue.popleft()
+            if version == buffer.version and now - generated_at <= self.ttl:
+                self._users.move_to_end(uid)
+                self._counters["hits"] += 1
+                return question
+            self._counters["stale"] += 1
+        self._counters["misses"] += 1
+        return None
+
+    def refill(self, uid: str, top_k: int) -> None:
+        """
+        Schedule a background job that tops the (uid, top_k) buffer up to `depth`.
+        """
+        if not self.enabled or (uid, top_k) in self._pending:
+            return
+        buffer = self._user(uid)
+        buffer.queues.setdefault(top_k, deque())
+        self._pending.add((uid, top_k))
+        try:
+            background_queue.submit(uid, self._fill, uid, top_k, time.monotonic())
+        except QueueFullError:
+            self._pending.discard((uid, top_k))
+            self._counters["refills_skipped"] += 1
+            logger.debug(f"Background queue full; skipped question refill for uid={uid}")
+
+    def invalidate(self, uid: str) -> None:
+        """
+        The user's preferences changed: drop buffered questions and regenerate them.
+        """
+        buffer = self._users.get(uid)
+        if buffer is None:
+            return
+        buffer.version += 1
+        self._counters["invalidations"] += 1
+        for top_k, queue in buffer.queues.items():
+            queue.clear()
+            self.refill(uid, top_k)
+
+    def clear(self) -> None:
+        self._users.clear()
+        self._pending.clear()
+        self._lag_ms.clear()
+
+    def stats(self) -> dict:
+        lookups = self._counters["hits"] + self._counters["misses"]
+        lag = list(self._lag_ms)
+        return {
+            "depth": self.depth,
+            "users": len(self._users),
+            "buffered": sum(len(q) for buffer in self._users.values() for q in buffer.queues.values()),
+            "pending_refills": len(self._pending),
+            **self._counters,
+            "hit_rate": round(self._counters["hits"] / lookups, 4) if lookups else None,
+            "refill_lag_ms": {"p50": _percentile(lag, 50), "p95": _percentile(lag, 95), "p99": _percentile(lag, 99)},
+        }
+
+    def _user(self, uid: str) -> _UserBuffer:
+        buffer = self._users.get(uid)
+        if buffer is None:
+            buffer = self._users[uid] = _UserBuffer()
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        self._users.move_to_end(uid)
+        return buffer
+
+    async def _fill(self, uid: str, top_k: int, requested_at: float) -> int:
+        added = 0
+        try:
+            while True:
+                buffer = self._users.get(uid)
+                queue = buffer.queues.get(top_k) if buffer is not None else None
+                if queue is None or len(queue) >= self.depth:
+                    return added
+                version = buffer.version
+                question = await _generate(uid, top_k)
+                if self._users.get(uid) is not buffer:
+                    return added
+                if buffer.version != version:
+                    # Preferences changed while generating: regenerate from the new ones
+                    continue
+                queue.append((question, version, time.monotonic()))
+                self._lag_ms.append((time.monotonic() - requested_at) * 1000)
+                self._counters["generated"] += 1
+                added += 1
+        except Exception as e:
+            self._counters["refill_failures"] += 1
+            logger.warning(f"Question refill failed for uid={uid}: {e}")
+            return added
+        finally:
+            self._pending.discard((uid, top_k))
+
+
+# Process-wide buffer used by /next_question
+question_buffer = QuestionBuffer()
@@ -0,0 +1,361 @@
+"""
+Admission control for the upstreams (the LLM provider and Neo4j).
+
+Every call to an upstream goes through its `UpstreamGuard`:
+- the circuit breaker fails fast while the upstream is down. It opens after
+  `breaker_threshold` consecutive failures and lets one probe through after `breaker_reset`
+  seconds;
+- a token bucket caps the request rate. A rate of 0 means unlimited;
+- an adaptive concurrency limit (AIMD) caps calls in flight. It grows by one per window of
+  successful calls and halves on an overload signal (a 429, a timeout, an unavailable
+  database);
+- retryable failures are retried with jittered exponential backoff that honours Retry-After
+  (`app.utils.backoff_retry`).
+
+Waiting for a token or a slot is bounded by `queue_deadline`. A call that cannot be admitted
+in time is shed with `OverloadedError`, which the routes turn into a 503 with Retry-After
+instead of letting the queue grow and tail latency with it.
+"""
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+from contextlib import asynccontextmanager
+from typing import Any
+from fastapi import HTTPException, status
+from loguru import logger
+from app.metrics import registry, Counter, Gauge
+from app.utils import backoff_retry
+
+UPSTREAM_SHED = registry.add(Counter(
+    "upstream_shed_total", "Upstream calls rejected before being sent", ("upstream", "reason")))
+UPSTREAM_RETRIES = registry.add(Counter(
+    "upstream_retryable_failures_total", "Upstream attempts that failed with a retryable error", ("upstream",)))
+UPSTREAM_LIMIT = registry.add(Gauge(
+    "upstream_concurrency_limit", "Current adaptive concurrency limit", ("upstream",)))
+UPSTREAM_IN_FLIGHT = registry.add(Gauge(
+    "upstream_in_flight", "Admitted upstream calls in flight", ("upstream",)))
+UPSTREAM_CIRCUIT_OPEN = registry.add(Gauge(
+    "upstream_circuit_open", "1 while the upstream's circuit breaker is open", ("upstream",)))
+
+
+class UpstreamUnavailableError(RuntimeError):
+    """Raised when an upstream cannot take the call now; `retry_after` is a hint in seconds."""
+
+    def __init__(self, message: str, upstream: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(UpstreamUnavailableError):
+    """Raised without calling the upstream while its circuit breaker is open."""
+
+
+class OverloadedError(UpstreamUnavailableError):
+    """Raised when a call waited longer than the queue deadline for admission (load shedding)."""
+
+
+def service_unavailable(error: UpstreamUnavailableError) -> HTTPException:
+    """
+    The 503 a route returns for `error`, with its Retry-After hint rounded up to whole seconds.
+    """
+    return HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(error),
+                         headers={"Retry-After": str(max(1, math.ceil(error.retry_after)))})
+
+
+class RetryableError(Exception):
+    """A failed upstream call worth retrying; `overload` marks throttling (429, timeouts)."""
+
+    def __init__(self, message: str, retry_after: float | None = None, overload: bool = False):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.overload = overload
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+
+    async def acquire(self, deadline: float) -> bool:
+        """
+        Take one token, waiting for it until `deadline` (monotonic); False if it would come too late.
+        """
+        if self.rate <= 0:
+            return True
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            wait = (1 - self._tokens) / self.rate
+            if now + wait > deadline:
+                return False
+            await asyncio.sleep(wait)
+
+
+class AdaptiveLimit:
+    """
+    AIMD concurrency limit: +1 per `limit` successes, times `decrease` on overload.
+    """
+
+    def __init__(self, initial: int, minimum: int = 1, maximum: int = 1000, decrease: float = 0.5):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(self.maximum, max(self.minimum, initial)))
+        self.decrease = decrease
+        self.in_flight = 0
+        self._waiters: deque[asyncio.Future] = deque()
+
+    def _wake(self) -> None:
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done() and not waiter.get_loop().is_closed():
+                waiter.set_result(None)
+                return
+
+    async def acquire(self, deadline: float) -> bool:
+        """
+        Take a slot, waiting for one until `deadline` (monotonic); False if none freed up in time.
+        """
+        while self.in_flight >= int(self.limit):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter, remaining)
+            except asyncio.TimeoutError:
+                return False
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        self.in_flight += 1
+        return True
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._wake()
+
+    def on_success(self) -> None:
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        self._wake()
+
+    def on_overload(self) -> None:
+        self.limit = max(self.minimum, self.limit * self.decrease)
+
+
+class CircuitBreaker:
+    def __init__(self, threshold: int = 5, reset_timeout: float = 30.0):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.reset_timeout else "open"
+
+    def allow(self) -> float | None:
+        """
+        None if a call may go ahead, else the seconds until the breaker lets a probe through.
+        """
+        if self.opened_at is None:
+            return None
+        remaining = self.opened_at + self.reset_timeout - time.monotonic()
+        if remaining > 0:
+            return remaining
+        if self._probing:
+            # One probe at a time while half open
+            return self.reset_timeout
+        self._probing = True
+        return None
+
+    def cancel_probe(self) -> None:
+        self._probing = False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self) -> bool:
+        """
+        Count a failure; True if it (re)opened the breaker.
+        """
+        self.failures += 1
+        if self.opened_at is not None or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+            self._probing = False
+            return True
+        return False
+
+
+class Attempt:
+    """
+    Outcome of one admitted call; unmarked calls that return normally count as successes.
+
+    `outcome` is None (success), "failure", "overload" or "aborted" (neither).
+    """
+
+    def __init__(self):
+        self.outcome: str | None = None
+
+    def fail(self, overload: bool = False) -> None:
+        self.outcome = "overload" if overload else "failure"
+
+
+class UpstreamGuard:
+    def __init__(
+        self,
+        name: str,
+        rate: float = 0.0,
+        burst: float = 1.0,
+        concurrency: int = 32,
+        max_concurrency: int = 100,
+        queue_deadline: float = 10.0,
+        retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_cap: float = 10.0,
+        breaker_threshold: int = 5,
+        breaker_reset: float = 30.0,
+        failures: tuple[type[BaseException], ...] = (),
+        overloads: tuple[type[BaseException], ...] = (asyncio.TimeoutError,),
+    ):
+        self.name = name
+        self.queue_deadline = queue_deadline
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.bucket = TokenBucket(rate, burst)
+        self.limit = AdaptiveLimit(concurrency, maximum=max_concurrency)
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset)
+        # Exceptions that count against the breaker; `overloads` also shrink the limit
+        self.failures = failures
+        self.overloads = overloads
+
+    @classmethod
+    def from_env(cls, prefix: str, **defaults) -> "UpstreamGuard":
+        """
+        Guard configured from {PREFIX}_RATE_LIMIT, _RATE_BURST, _CONCURRENCY, _MAX_CONCURRENCY,
+        _QUEUE_DEADLINE, _RETRIES, _BACKOFF_BASE, _BACKOFF_CAP, _BREAKER_THRESHOLD and _BREAKER_RESET.
+        """
+        settings = {
+            "rate": ("RATE_LIMIT", float), "burst": ("RATE_BURST", float),
+            "concurrency": ("CONCURRENCY", int), "max_concurrency": ("MAX_CONCURRENCY", int),
+            "queue_deadline": ("QUEUE_DEADLINE", float), "retries": ("RETRIES", int),
+            "backoff_base": ("BACKOFF_BASE", float), "backoff_cap": ("BACKOFF_CAP", float),
+            "breaker_threshold": ("BREAKER_THRESHOLD", int), "breaker_reset": ("BREAKER_RESET", float),
+        }
+        for arg, (suffix, cast) in settings.items():
+            value = os.getenv(f"{prefix}_{suffix}")
+            if value is not None:
+                defaults[arg] = cast(value)
+        return cls(prefix.lower(), **defaults)
+
+    def _shed(self, reason: str, retry_after: float, error: type[UpstreamUnavailableError]):
+        UPSTREAM_SHED.inc(upstream=self.name, reason=reason)
+        return error(f"{self.name} {reason.replace('_', ' ')}; retry in {retry_after:.1f}s", self.name, retry_after)
+
+    @asynccontextmanager
+    async def admit(self):
+        """
+        Admit one call (breaker, rate, concurrency) and record how it went when the block exits.
+        """
+        wait = self.breaker.allow()
+        if wait is not None:
+            raise self._shed("circuit_open", wait, CircuitOpenError)
+        deadline = time.monotonic() + self.queue_deadline
+        try:
+            if not await self.bucket.acquire(deadline):
+                raise self._shed("rate_limited", 1 / self.bucket.rate, OverloadedError)
+            if not await self.limit.acquire(deadline):
+                raise self._shed("overloaded", self.queue_deadline, OverloadedError)
+        except BaseException:
+            # Never admitted: a half-open breaker's probe is still to be sent
+            self.breaker.cancel_probe()
+            raise
+        attempt = Attempt()
+        try:
+            yield attempt
+        except BaseException as e:
+            if attempt.outcome is None:
+                attempt.outcome = self.classify(e)
+            raise
+        finally:
+            self.limit.release()
+            self._record(attempt)
+
+    def classify(self, error: BaseException) -> str:
+        """
+        Outcome of a call that raised `error`: "overload", "failure" or "aborted".
+        """
+        if isinstance(error, RetryableError):
+            return "overload" if error.overload else "failure"
+        if isinstance(error, self.overloads):
+            return "overload"
+        if isinstance(error, self.failures):
+            return "failure"
+        # Cancelled, or an error that says nothing about the upstream's health
+        return "aborted"
+
+    def _record(self, attempt: Attempt) -> None:
+        if attempt.outcome == "aborted":
+            self.breaker.cancel_probe()
+            return
+        if attempt.outcome is None:
+            self.breaker.record_success()
+            self.limit.on_success()
+            return
+        if attempt.outcome == "overload":
+            self.limit.on_overload()
+        if self.breaker.record_failure():
+            logger.warning(f"{self.name} circuit opened after {self.breaker.failures} failure(s)")
+
+    async def call(self, fn: Callable[..., Awaitable[Any]], *args,
+                   retry_on: tuple[type[BaseException], ...] = (), **kwargs) -> Any:
+        """
+        Await `fn(*args, **kwargs)` under admission control, retrying `RetryableError` and `retry_on`.
+
+        A call still failing after the retries raises UpstreamUnavailableError.
+        """
+        retryable = (RetryableError,) + retry_on
+
+        @backoff_retry(self.retries, self.backoff_base, self.backoff_cap, retryable)
+        async def attempt():
+            try:
+                async with self.admit():
+                    return await fn(*args, **kwargs)
+            except retryable:
+                UPSTREAM_RETRIES.inc(upstream=self.name)
+                raise
+
+        try:
+            return await attempt()
+        except retryable as e:
+            retry_after = getattr(e, "retry_after", None) or self.backoff_base
+            raise UpstreamUnavailableError(f"{self.name} unavailable: {e}", self.name, retry_after) from e
+
+    def stats(self) -> dict:
+        return {
+            "limit": int(self.limit.limit),
+            "in_flight": self.limit.in_flight,
+            "circuit": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+        }
+
+    def collect(self) -> None:
+        UPSTREAM_LIMIT.set(int(self.limit.limit), upstream=self.name)
+        UPSTREAM_IN_FLIGHT.set(self.limit.in_flight, upstream=self.name)
+        UPSTREAM_CIRCUIT_OPEN.set(int(self.breaker.state == "open"), upstream=self.name)
@@ -0,0 +1,292 @@
+"""
+Tiered retention: move old Episode transcripts out of Neo4j into the segment store of app.archive.
+
+    python -m app.retention run        # archive eligible transcripts, then compact segments
+    python -m app.retention archive    # archive only
+    python -m app.retention compact    # compact sparse segments and purge retired ones
+    python -m app.retention stats      # archive segment/record/byte counts
+
+An Episode is eligible once it is older than ARCHIVE_AFTER_DAYS and is not among its user's
+ARCHIVE_KEEP_RECENT newest Episodes. A zero turns either rule off. An Episode must also
+already carry its summary. Its transcript is appended to the archive first (fsynced), and
+then, in a short write transaction, the node's transcript properties are swapped for
+`e.archive_ref`. The swap is guarded by `e.revision`, which every transcript write bumps, so
+an Episode re-ingested in the meantime keeps its new transcript. (The content hash is no guard:
+a deferred re-ingest stores the transcript before extraction records its hash.) Its archived copy is left behind as a dead record.
+Reads resolve `e.archive_ref` through `episode_store.resolve`, so every read path
+rehydrates transparently.
+
+Compaction copies the live records of sealed segments that are mostly dead (live ratio
+below ARCHIVE_COMPACT_LIVE_RATIO) into the active segment. It repoints their Episodes and
+then retires the old file. Retired files are purged after ARCHIVE_RETIRE_GRACE seconds.
+Each batch is its own transaction and file work runs in a thread, so with ARCHIVE_ENABLED
+the loop runs alongside ingestion in the API process.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from loguru import logger
+from app import episode_store
+from app.archive import archive_store, ArchiveLockedError, SegmentStore
+from app.metrics import registry, Counter
+
+ARCHIVE_ENABLED = os.getenv("ARCHIVE_ENABLED", "false").lower() in ("true", "1", "yes")
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+# Newest Episodes per user that always stay in Neo4j
+ARCHIVE_KEEP_RECENT = int(os.getenv("ARCHIVE_KEEP_RECENT", "10"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "200"))
+# Seconds between background passes
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", "3600"))
+ARCHIVE_COMPACT_LIVE_RATIO = float(os.getenv("ARCHIVE_COMPACT_LIVE_RATIO", "0.5"))
+ARCHIVE_RETIRE_GRACE = float(os.getenv("ARCHIVE_RETIRE_GRACE", "3600"))
+
+ARCHIVED_EPISODES = registry.add(Counter(
+    "archived_episodes_total", "Episode transcripts moved to the archive", ()))
+ARCHIVE_COMPACTED_SEGMENTS = registry.add(Counter(
+    "archive_compacted_segments_total", "Archive segments rewritten and retired by compaction", ()))
+
+_ELIGIBLE = (
+    "e.archive_ref IS NULL AND e.summary IS NOT NULL "
+    "AND (e.conversation_z IS NOT NULL OR e.conversation IS NOT NULL) "
+    "AND ($cutoff IS NULL OR e.created_at < datetime($cutoff))"
+)
+# Age only: served by the episode_created_at range index
+AGED_CANDIDATES_QUERY = (
+    f"MATCH (u:User)-[:CREATED]->(e:Episode) WHERE {_ELIGIBLE} "
+    f"RETURN e.id AS id, u.uid AS uid, coalesce(e.revision, 0) AS revision, {episode_store.STORED_CONVERSATION} AS stored "
+    "LIMIT $limit"
+)
+# Per user, the created_at of their `keep`-th newest Episode; read once per pass
+KEEP_BOUNDARIES_QUERY = (
+    "MATCH (u:User) "
+    "CALL { WITH u MATCH (u)-[:CREATED]->(e:Episode) WITH e ORDER BY e.created_at DESC "
+    "RETURN collect(e.created_at)[$keep - 1] AS boundary } "
+    "WITH u, boundary WHERE boundary IS NOT NULL "
+    "RETURN u.uid AS uid, boundary ORDER BY uid"
+)
+# Rank (optionally with age): a group of users' Episodes older than their boundary.
+# Ties with the boundary are kept, so nothing among the `keep` newest is ever archived.
+RANKED_CANDIDATES_QUERY = (
+    "UNWIND $boundaries AS b "
+    "MATCH (u:User {uid: b.uid})-[:CREATED]->(e:Episode) "
+    f"WHERE e.created_at < b.boundary AND {_ELIGIBLE} "
+    f"RETURN e.id AS id, u.uid AS uid, coalesce(e.revision, 0) AS revision, {episode_store.STORED_CONVERSATION} AS stored "
+    "LIMIT $limit"
+)
+
+
+async def _boundaries_tx(tx, keep: int) -> list[dict]:
+    result = await tx.run(KEEP_BOUNDARIES_QUERY, keep=keep)
+    return [dict(record) async for record in result]
+
+
+async def _candidates_tx(tx, boundaries: list[dict] | None, cutoff: str | None, limit: int) -> list[dict]:
+    if boundaries is None:
+        result = await tx.run(AGED_CANDIDATES_QUERY, cutoff=cutoff, limit=limit)
+    else:
+        result = await tx.run(RANKED_CANDIDATES_QUERY, boundaries=boundaries, cutoff=cutoff, limit=limit)
+    return [dict(record) async for record in result]
+
+
+async def _swap_tx(tx, rows: list[dict]) -> int:
+    result = await tx.run(
+        "UNWIND $rows AS row "
+        "MATCH (e:Episode {id: row.id}) "
+        "WHERE e.archive_ref IS NULL AND coalesce(e.revision, 0) = row.revision "
+        "SET e.archive_ref = row.ref, e.archived_at = datetime(), e.conversation_z = null, e.conversation = null "
+        "RETURN count(e) AS archived",
+        rows=rows,
+    )
+    record = await result.single()
+    return record["archived"] if record else 0
+
+
+async def _live_tx(tx, entries: list[dict]) -> list[str]:
+    result = await tx.run(
+        "UNWIND $entries AS entry "
+        "MATCH (e:Episode {id: entry.id}) WHERE e.archive_ref = entry.ref "
+        "RETURN entry.ref AS ref",
+        entries=[{"id": entry["id"], "ref": entry["ref"]} for entry in entries],
+    )
+    return [record["ref"] async for record in result]
+
+
+async def _repoint_tx(tx, rows: list[dict]) -> int:
+    result = await tx.run(
+        "UNWIND $rows AS row "
+        "MATCH (e:Episode {id: row.id}) WHERE e.archive_ref = row.old "
+        "SET e.archive_ref = row.new "
+        "RETURN count(e) AS moved",
+        rows=rows,
+    )
+    record = await result.single()
+    return record["moved"] if record else 0
+
+
+class Retention:
+    def __init__(self, store: SegmentStore = archive_store, after_days: float = ARCHIVE_AFTER_DAYS,
+                 keep_recent: int = ARCHIVE_KEEP_RECENT, batch_size: int = ARCHIVE_BATCH_SIZE,
+                 live_ratio: float = ARCHIVE_COMPACT_LIVE_RATIO, retire_grace: float = ARCHIVE_RETIRE_GRACE):
+        self.store = store
+        self.after_days = after_days
+        self.keep_recent = keep_recent
+        self.batch_size = batch_size
+        self.live_ratio = live_ratio
+        self.retire_grace = retire_grace
+        self._task: asyncio.Task | None = None
+
+    def _cutoff(self) -> str | None:
+        if self.after_days <= 0:
+            return None
+        return (datetime.now(timezone.utc) - timedelta(days=self.after_days)).isoformat()
+
+    async def archive(self, driver, max_batches: int | None = None) -> dict:
+        """
+        Archive eligible transcripts a batch at a time until none are left.
+
+        With `keep_recent`, each user's keep boundary is read once per pass, and users are then
+        worked through `batch_size` at a time. A batch only reads the Episodes of its users,
+        so a pass stays linear in the number of Episodes.
+        """
+        report = {"candidates": 0, "archived": 0, "batches": 0}
+        if self.after_days <= 0 and self.keep_recent <= 0:
+            return report
+        cutoff = self._cutoff()
+        groups: list[list[dict] | None] = [None]
+        if self.keep_recent > 0:
+            async with driver.session() as session:
+                boundaries = await session.execute_read(_boundaries_tx, self.keep_recent)
+            groups = [boundaries[start:start + self.batch_size] for start in range(0, len(boundaries), self.batch_size)]
+        for group in groups:
+            while max_batches is None or report["batches"] < max_batches:
+                async with driver.session() as session:
+                    rows = await session.execute_read(_candidates_tx, group, cutoff, self.batch_size)
+                if not rows:
+                    break
+                records = [{"id": row["id"], "uid": row["uid"], "conversation": episode_store.unpack(row["stored"])}
+                           for row in rows]
+                refs = await asyncio.to_thread(self.store.append, records)
+                swaps = [{"id": row["id"], "revision": row["revision"], "ref": ref} for row, ref in zip(rows, refs)]
+                async with driver.session() as session:
+                    archived = await session.execute_write(_swap_tx, swaps)
+                ARCHIVED_EPISODES.inc(archived)
+                report["candidates"] += len(rows)
+                report["archived"] += archived
+                report["batches"] += 1
+                logger.info(f"Archived {archived}/{len(rows)} Episode transcript(s)")
+                if archived == 0:
+                    # Every candidate changed under us; leave them to the next pass
+                    break
+        return report
+
+    async def live_refs(self, driver, entries: list[dict]) -> set[str]:
+        """
+        The refs among a segment's index entries that an Episode still points at.
+        """
+        live: set[str] = set()
+        for start in range(0, len(entries), self.batch_size):
+            async with driver.session() as session:
+                live.update(await session.execute_read(_live_tx, entries[start:start + self.batch_size]))
+        return live
+
+    async def compact(self, driver) -> dict:
+        """
+        Rewrite sealed segments whose live ratio fell below `live_ratio`, then purge old retired files.
+        """
+        report = {"segments": 0, "compacted": 0, "records_moved": 0, "records_dropped": 0, "purged": 0}
+        # Compaction is a writer: no other process may append while segments are copied and retired
+        await asyncio.to_thread(self.store.acquire)
+        # The last segment is still being appended to
+        for segment in self.store.segments()[:-1]:
+            report["segments"] += 1
+            entries = await asyncio.to_thread(self.store.index, segment)
+            live = await self.live_refs(driver, entries)
+            if entries and len(live) / len(entries) >= self.live_ratio:
+                continue
+            keep = [entry for entry in entries if entry["ref"] in live]
+            for start in range(0, len(keep), self.batch_size):
+                chunk = keep[start:start + self.batch_size]
+                records = await asyncio.to_thread(lambda: [self.store.read_record(entry["ref"]) for entry in chunk])
+                refs = await asyncio.to_thread(self.store.append, records)
+                async with driver.session() as session:
+                    moved = await session.execute_write(
+                        _repoint_tx, [{"id": e["id"], "old": e["ref"], "new": ref} for e, ref in zip(chunk, refs)],
+                    )
+                report["records_moved"] += moved
+            if not await asyncio.to_thread(self.store.retire, segment):
+                continue
+            ARCHIVE_COMPACTED_SEGMENTS.inc()
+            report["compacted"] += 1
+            report["records_dropped"] += len(entries) - len(keep)
+        report["purged"] = await asyncio.to_thread(self.store.purge_retired, self.retire_grace)
+        return report
+
+    async def run_once(self, driver) -> dict:
+        return {"archive": await self.archive(driver), "compact": await self.compact(driver)}
+
+    async def _loop(self, driver, interval: float) -> None:
+        while True:
+            try:
+                report = await self.run_once(driver)
+                logger.info(f"Retention pass: {report}")
+            except ArchiveLockedError as e:
+                logger.info(f"Retention pass skipped: {e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Retention pass failed: {e}")
+            await asyncio.sleep(interval)
+
+    def start(self, driver, interval: float = ARCHIVE_INTERVAL) -> None:
+        """
+        Run a retention pass every `interval` seconds on the running event loop.
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._loop(driver, interval), name="retention")
+            logger.info(f"Started retention every {interval:g}s (after {self.after_days:g} days, keep {self.keep_recent})")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self.store.release()
+
+
+retention = Retention()
+
+
+async def main(argv: list[str] | None = None) -> int:
+    from dotenv import load_dotenv
+    load_dotenv()
+    import app.graphiti_client as graphiti_client
+
+    parser = argparse.ArgumentParser(description="Archive old Episode transcripts and compact the archive")
+    parser.add_argument("command", choices=["run", "archive", "compact", "stats"])
+    args = parser.parse_args(argv)
+    if args.command == "stats":
+        print(json.dumps(archive_store.stats(), indent=2))
+        return 0
+    driver = graphiti_client.driver
+    started = time.perf_counter()
+    try:
+        if args.command == "run":
+            report = await retention.run_once(driver)
+        elif args.command == "archive":
+            report = await retention.archive(driver)
+        else:
+            report = await retention.compact(driver)
+    finally:
+        archive_store.release()
+        await driver.close()
+    report["seconds"] = round(time.perf_counter() - started, 2)
+    print(json.dumps(report, indent=2, default=str))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
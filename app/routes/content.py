@@ -1,53 +1,60 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
 from app.models.summary import SummaryRequest, SummaryOut
 import app.graphiti_client as graphiti_client
-import httpx
-import json
+from app.llm import llm
+from app.cache import summary_cache, summary_key
+from app.singleflight import single_flight
+from app.resilience import UpstreamUnavailableError, service_unavailable
+from app.sse import sse_response
 from loguru import logger
 
 router = APIRouter()
 
+async def _single(text: str):
+    yield text
+
+async def _compose_content(key: tuple, episode_ids: list[str], known: dict[str, str]) -> str:
+    summary = await graphiti_client.summarize_episodes(episode_ids, "content", known)
+    summary_cache.set(key, summary)
+    return summary
+
 @router.post("/conversation_content", response_model=SummaryOut)
-async def conversation_content(payload: SummaryRequest):
+async def conversation_content(payload: SummaryRequest, stream: bool = Query(False, description="Stream the summary as Server-Sent Events")):
     """
     Produce a content‐style summary (using a different system prompt) for the last `num_conversations` for a given user.
+
+    With `?stream=true` the summary is relayed as Server-Sent Events while it is generated.
     """
     try:
-        # Pull raw conversations from Neo4j
-        with graphiti_client.driver.session() as session:
-            result = session.run(
-                "MATCH (u:User {uid:$uid})-[:CREATED]->(e:Episode) "
-                "RETURN e.conversation AS conv_json ORDER BY e.created_at DESC LIMIT $n",
-                uid=payload.uid, n=payload.num_conversations
-            )
-            convs = [json.loads(record["conv_json"]) for record in result]
-        if not convs:
+        generation = summary_cache.generation(payload.uid)
+        # Newest Episodes and their stored summaries, from the user's profile in one lookup
+        episodes = await graphiti_client.get_recent_episodes(payload.uid, payload.num_conversations)
+        episode_ids = [episode["id"] for episode in episodes]
+        known = {episode["id"]: episode["summary"] for episode in episodes if episode["summary"]}
+        if not episode_ids:
             summary = f"No conversations found for user {payload.uid}."
         else:
-            # Flatten to text
-            text_blocks = []
-            for conv in convs:
-                lines = [f"{turn.get('speaker')}: {turn.get('text','')}" for turn in conv]
-                text_blocks.append("\n".join(lines))
-            convo_text = "\n\n".join(text_blocks)
-            # Build LLM prompt with a different system message
-            prompt = f"Create a rich, detailed content summary of these user–AI interactions:\n\n{convo_text}"
-            async with httpx.AsyncClient(timeout=graphiti_client.GRAPHITI_LLM_TIMEOUT) as client:
-                resp = await client.post(
-                    f"{graphiti_client.OPENAI_API_BASE}/chat/completions",
-                    headers={"Authorization": f"Bearer {graphiti_client.OPENAI_API_KEY}"},
-                    json={
-                        "model": graphiti_client.MODEL_NAME,
-                        "messages": [
-                            {"role": "system", "content": "You are a content creation assistant. Produce an in-depth summary for content publication."},
-                            {"role": "user", "content": prompt},
-                        ],
-                    },
-                )
-                resp.raise_for_status()
-                data = resp.json()
-                summary = data.get("choices", [{}])[0].get("message", {}).get("content", "").strip()
+            revisions = [episode.get("revision") for episode in episodes]
+            key = summary_key(payload.uid, episode_ids, "content", llm.model, generation, revisions)
+            summary = summary_cache.get(key)
+            if summary is None and stream:
+                tokens = graphiti_client.summarize_episodes_stream(episode_ids, "content", known)
+                return sse_response(tokens, lambda text: summary_cache.set(key, text), label=f"conversation_content uid={payload.uid}")
+            if summary is None:
+                # Compose the summaries stored on each Episode at ingest instead of re-reading transcripts
+                summary = await single_flight.do("conversation_content", key, _compose_content, key, episode_ids, known)
+        if stream:
+            return sse_response(_single(summary), label=f"conversation_content uid={payload.uid}")
         return SummaryOut(summary=summary)
+    except UpstreamUnavailableError as e:
+        raise service_unavailable(e)
     except Exception as e:
         logger.error(f"Error in conversation_content for uid={payload.uid}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/summary_cache/stats")
+async def summary_cache_stats():
+    """
+    Hit/miss/eviction counters of the summary cache shared by /conversation_content and /conversation_summary.
+    """
+    return summary_cache.stats()
@@ -1,48 +1,159 @@
-from fastapi import APIRouter, HTTPException, Query
+import json
+from typing import Annotated, Literal
+from fastapi import APIRouter, Body, HTTPException, Query
+from pydantic import Discriminator, Tag
+from fastapi.responses import Response, StreamingResponse
 from app.models.conversation import ConversationIn
+from app.models.summary import SummaryRequest
 import app.graphiti_client as graphiti_client
+from app.llm import llm
+from app.services import services
+from app.cache import summary_cache, summary_key
+from app.conversation_cache import conversation_cache
+from app import episode_store
+from app.singleflight import single_flight
+from app.resilience import UpstreamUnavailableError, service_unavailable
+from app.sse import sse_response
 
 router = APIRouter()
 
+def _summary_body_kind(body) -> str:
+    # Explicit, so a posted conversation that fails validation is a 422 and never a summary of recent Episodes
+    if isinstance(body, dict):
+        return "conversation" if "conversation" in body else "recent"
+    return "conversation" if isinstance(body, ConversationIn) else "recent"
+
+SummaryBody = Annotated[
+    Annotated[ConversationIn, Tag("conversation")] | Annotated[SummaryRequest, Tag("recent")],
+    Discriminator(_summary_body_kind),
+]
+
+async def _single(text: str):
+    yield text
+
+async def _compose_summary(key: tuple, episode_ids: list[str], known: dict[str, str]) -> str:
+    summary = await graphiti_client.summarize_episodes(episode_ids, "summary", known)
+    summary_cache.set(key, summary)
+    return summary
+
+async def _summarize_recent(payload: SummaryRequest, stream: bool):
+    graphiti = services.graphiti if graphiti_client._USE_GRAPHITI else None
+    if graphiti is not None:
+        # Use Graphiti core summarization if available
+        summary = await graphiti.summarize_episodes(uid=payload.uid, num_conversations=payload.num_conversations)
+    else:
+        generation = summary_cache.generation(payload.uid)
+        # Newest Episodes and their stored summaries, from the user's profile in one lookup
+        episodes = await graphiti_client.get_recent_episodes(payload.uid, payload.num_conversations)
+        episode_ids = [episode["id"] for episode in episodes]
+        known = {episode["id"]: episode["summary"] for episode in episodes if episode["summary"]}
+        if not episode_ids:
+            summary = f"No conversations found for user {payload.uid}."
+        else:
+            revisions = [episode.get("revision") for episode in episodes]
+            key = summary_key(payload.uid, episode_ids, "summary", llm.model, generation, revisions)
+            summary = summary_cache.get(key)
+            if summary is None and stream:
+                tokens = graphiti_client.summarize_episodes_stream(episode_ids, "summary", known)
+                return sse_response(tokens, lambda text: summary_cache.set(key, text), label=f"conversation_summary uid={payload.uid}")
+            if summary is None:
+                # Compose the summaries stored on each Episode at ingest instead of re-reading transcripts
+                summary = await single_flight.do("conversation_summary", key, _compose_summary, key, episode_ids, known)
+    if stream:
+        return sse_response(_single(summary), label=f"conversation_summary uid={payload.uid}")
+    return {"summary": summary}
+
 @router.post("/conversation_summary")
-async def conversation_summary(payload: ConversationIn):
+async def conversation_summary(payload: Annotated[SummaryBody, Body()], stream: bool = Query(False, description="Stream the summary as Server-Sent Events")):
     """
-    Generates a concise summary of the given conversation using the LLM.
+    Generates a concise summary of the posted conversation, or of the user's last
+    `num_conversations` Episodes when the body has no `conversation` key.
+
+    With `?stream=true` the summary is relayed as Server-Sent Events while it is generated.
     """
     try:
+        if isinstance(payload, SummaryRequest):
+            return await _summarize_recent(payload, stream)
         # Convert conversation turns to list of dicts
         conv_list = [turn.dict() for turn in payload.conversation]
-        summary = await graphiti_client.summarize_conversation(uid=payload.uid, conv=conv_list)
+        if stream:
+            tokens = graphiti_client.summarize_conversation_stream(uid=payload.uid, conv=conv_list)
+            return sse_response(tokens, label=f"conversation_summary uid={payload.uid}")
+        key = (payload.uid, graphiti_client.conversation_hash(conv_list))
+        summary = await single_flight.do("conversation_summary", key, graphiti_client.summarize_conversation, uid=payload.uid, conv=conv_list)
         return {"summary": summary}
+    except UpstreamUnavailableError as e:
+        raise service_unavailable(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+CONVERSATION_FIELDS = ("id", "created_at", "updated_at", "turn_count", "bytes", "conversation")
+# Episodes fetched per Neo4j round trip while streaming NDJSON
+NDJSON_PAGE_SIZE = 100
+
+def _render(row: dict, fields: list[str], turns) -> str:
+    # The transcript is stored JSON text and is spliced in as-is, not decoded and re-encoded
+    parts = []
+    for name in fields:
+        if name == "conversation":
+            value = episode_store.project_turns(row["conversation"], turns) if row["conversation"] is not None else "null"
+        else:
+            value = json.dumps(row[name])
+        parts.append(f'"{name}":{value}')
+    return "{" + ",".join(parts) + "}"
+
 # New endpoint: get last n full conversations for a user
 @router.get("/get_conversations")
-def get_conversations(
+async def get_conversations(
     uid: str = Query(..., description="User ID"),
-    n: int = Query(1, description="Number of most recent conversations to return")
+    n: int = Query(1, ge=1, le=10000, description="Number of most recent conversations to return"),
+    cursor: str | None = Query(None, description="next_cursor of the previous page"),
+    fields: str | None = Query(None, description="Comma-separated subset of " + ",".join(CONVERSATION_FIELDS)),
+    turns: str | None = Query(None, description="Turn range start:stop applied to each conversation"),
+    format: Literal["json", "ndjson"] = Query("json", description="json page or ndjson stream"),
 ):
     """
-    Return the last n full conversations (as lists of turns) for a user.
+    Return the last n full conversations (as lists of turns) for a user, newest first.
+
+    Without `fields` only the conversations are returned, as before. Pages continue with
+    `cursor`; `format=ndjson` streams one Episode per line, each with its own cursor.
+    """
+    selected = fields.split(",") if fields else ["conversation"]
+    unknown = [name for name in selected if name not in CONVERSATION_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown fields: {', '.join(unknown)}")
+    try:
+        turn_range = episode_store.parse_turns(turns)
+        if cursor:
+            episode_store.decode_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if format == "ndjson":
+        async def lines():
+            remaining, position = n, cursor
+            while remaining > 0:
+                rows, position = await graphiti_client.get_conversation_page(uid, min(remaining, NDJSON_PAGE_SIZE), position)
+                for row in rows:
+                    yield _render(row, selected + ["cursor"], turn_range) + "\n"
+                remaining -= len(rows)
+                if position is None:
+                    break
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    rows, next_cursor = await graphiti_client.get_conversation_page(uid, n, cursor)
+    if not rows and cursor is None:
+        raise HTTPException(status_code=404, detail="No conversations found for user")
+    if fields:
+        items = [_render(row, selected, turn_range) for row in rows]
+    else:
+        items = [episode_store.project_turns(row["conversation"], turn_range) for row in rows if row["conversation"] is not None]
+    body = '{"conversations":[' + ",".join(items) + '],"next_cursor":' + json.dumps(next_cursor) + "}"
+    return Response(content=body, media_type="application/json")
+
+@router.get("/conversation_cache/stats")
+async def conversation_cache_stats():
+    """
+    Resident size, user/entry counts and eviction counters of the recent-conversation cache.
     """
-    with graphiti_client.driver.session() as session:
-        result = session.run(
-            """
-            MATCH (u:User {uid:$uid})-[:CREATED]->(e:Episode)
-            RETURN e.conversation AS conv_json, e.created_at AS created
-            ORDER BY e.created_at DESC LIMIT $n
-            """,
-            uid=uid, n=n
-        )
-        conversations = []
-        for record in result:
-            conv_json = record["conv_json"]
-            try:
-                conv = graphiti_client.json.loads(conv_json)
-            except Exception:
-                conv = conv_json  # fallback: raw string
-            conversations.append(conv)
-        if not conversations:
-            raise HTTPException(status_code=404, detail="No conversations found for user")
-        return {"conversations": conversations} 
\ No newline at end of file
+    return conversation_cache.stats()
@@ -1,18 +1,116 @@
-from fastapi import APIRouter, HTTPException, status
+import asyncio
+import os
+from fastapi import APIRouter, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
 from app.models.conversation import ConversationIn
+from app.models.ingest_job import IngestAccepted, IngestJobOut
+from app.ingest_queue import ingest_queue, background_queue, QueueFullError, INGEST_JOB_RETRIES
+from app import bulk_ingest
+from app.resilience import UpstreamUnavailableError, service_unavailable
 import app.graphiti_client as graphiti_client
-from fastapi import APIRouter, HTTPException, Query
+
+# Default ingestion mode: "sync" extracts before responding, "async" defers extraction to the job queue
+INGEST_MODE = os.getenv("INGEST_MODE", "sync").lower()
 
 router = APIRouter()
 
 @router.post("/ingest_conversation", status_code=status.HTTP_201_CREATED)
-async def ingest_conversation(payload: ConversationIn):
+async def ingest_conversation(
+    payload: ConversationIn,
+    response: Response,
+    mode: str = Query(INGEST_MODE, pattern="^(sync|async)$", description="sync: extract before responding; async: return 202 with a job id"),
+):
     """
     Ingest a seeker-AI conversation and store as a Graphiti episode.
     """
+    conv_list = [{"speaker": turn.speaker, "text": turn.text} for turn in payload.conversation]
+    ids = {"conversation_id": payload.conversation_id, "created_at": payload.created_at, "updated_at": payload.updated_at}
+    if mode == "async":
+        try:
+            plan = await graphiti_client.persist_episode(payload.uid, conv_list, **ids)
+            episode_id = plan.episode_id if plan is not None else None
+            if plan is not None and plan.skip:
+                # Re-post of an unchanged (or older) conversation: nothing to extract
+                response.status_code = status.HTTP_200_OK
+                return {"status": plan.mode, "episode_id": episode_id}
+            # Failed extractions are retried; the Episode stays unmarked until one commits, so a
+            # later post of the conversation re-extracts it even if every retry fails
+            job = ingest_queue.submit(payload.uid, graphiti_client.process_episode, payload.uid, conv_list, plan,
+                                      episode_id=episode_id, retries=INGEST_JOB_RETRIES)
+        except graphiti_client.EpisodeConflictError as e:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+        except QueueFullError as e:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+        except UpstreamUnavailableError as e:
+            raise service_unavailable(e)
+        except Exception as e:
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+        response.status_code = status.HTTP_202_ACCEPTED
+        return IngestAccepted(job_id=job.id, episode_id=episode_id)
     try:
-        conv_list = [{"speaker": turn.speaker, "text": turn.text} for turn in payload.conversation]
-        episode_id = graphiti_client.add_episode(uid=payload.uid, conv=conv_list)
+        episode_id = await graphiti_client.add_episode(uid=payload.uid, conv=conv_list, **ids)
         return {"status": "ok", "episode_id": episode_id}
+    except graphiti_client.EpisodeConflictError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    except UpstreamUnavailableError as e:
+        raise service_unavailable(e)
     except Exception as e:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e)) 
\ No newline at end of file
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+@router.get("/ingest_jobs/{job_id}", response_model=IngestJobOut)
+async def ingest_job_status(job_id: str):
+    """
+    Report the status of an asynchronous ingestion job.
+    """
+    job = ingest_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Unknown ingest job")
+    return IngestJobOut(**job.to_dict())
+
+@router.get("/ingest_stats")
+async def ingest_stats():
+    """
+    Queue depth, worker counts and wait/run latency percentiles for the ingestion queue.
+
+    Follow-up jobs (question refills, embeddings, background summaries) are reported
+    separately under "background".
+    """
+    return {**ingest_queue.stats(), "background": background_queue.stats()}
+
+
+class _BulkResultsResponse(StreamingResponse):
+    """
+    StreamingResponse that only starts listening for client disconnects once the request
+    body has been fully read, so the listener never swallows body chunks still being streamed in.
+    """
+
+    def __init__(self, content, body_done: asyncio.Event, **kwargs):
+        super().__init__(content, **kwargs)
+        self._body_done = body_done
+
+    async def listen_for_disconnect(self, receive) -> None:
+        await self._body_done.wait()
+        await super().listen_for_disconnect(receive)
+
+@router.post("/ingest_conversations:bulk")
+async def ingest_conversations_bulk(
+    request: Request,
+    concurrency: int = Query(bulk_ingest.BULK_EXTRACT_CONCURRENCY, ge=1, le=256, description="Concurrent LLM extractions"),
+    batch_size: int = Query(bulk_ingest.BULK_WRITE_BATCH, ge=1, le=5000, description="Conversations per Neo4j transaction"),
+):
+    """
+    Ingest an NDJSON stream of conversations (one ConversationIn per line).
+
+    The body is processed as it arrives and per-item results are streamed back as NDJSON.
+    """
+    body_done = asyncio.Event()
+
+    async def body_lines():
+        try:
+            async for line in bulk_ingest.ndjson_lines(request.stream()):
+                yield line
+        finally:
+            body_done.set()
+
+    results = bulk_ingest.ingest_stream(body_lines(), concurrency=concurrency, batch_size=batch_size)
+    return _BulkResultsResponse(bulk_ingest.ndjson_results(results), body_done, media_type="application/x-ndjson")
@@ -0,0 +1,62 @@
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from app import metrics
+from app.ingest_queue import ingest_queue, background_queue
+from app.llm import llm
+from app.services import neo4j_guard
+
+router = APIRouter()
+
+def _collect_ingest_queue() -> None:
+    stats = ingest_queue.stats()
+    metrics.INGEST_QUEUE_DEPTH.set(stats["depth"])
+    metrics.INGEST_IN_FLIGHT.set(stats["in_flight"])
+    stats = background_queue.stats()
+    metrics.BACKGROUND_QUEUE_DEPTH.set(stats["depth"])
+    metrics.BACKGROUND_IN_FLIGHT.set(stats["in_flight"])
+
+metrics.registry.register_collector(_collect_ingest_queue)
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """
+    All metrics in the Prometheus text exposition format.
+    """
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+@router.get("/upstreams/stats")
+async def upstream_stats():
+    """
+    Adaptive concurrency limit, calls in flight and circuit breaker state of each upstream.
+    """
+    return {"llm": llm.guard.stats(), "neo4j": neo4j_guard.stats()}
+
+def _require_profiler() -> None:
+    if not metrics.PROFILER_ENABLED:
+        raise HTTPException(status_code=403, detail="Profiler disabled; set PROFILER_ENABLED=true")
+
+@router.post("/debug/profiler/start")
+async def start_profiler(interval: float | None = Query(None, gt=0, le=1, description="Seconds between samples")):
+    """
+    Start sampling every thread's stack in the background.
+    """
+    _require_profiler()
+    metrics.profiler.start(interval)
+    return metrics.profiler.report(limit=0)
+
+@router.post("/debug/profiler/stop")
+async def stop_profiler(limit: int = Query(200, ge=0)):
+    """
+    Stop sampling and return the hottest collapsed stacks (flame graph input).
+    """
+    _require_profiler()
+    metrics.profiler.stop()
+    return metrics.profiler.report(limit)
+
+@router.get("/debug/profiler")
+async def profiler_report(limit: int = Query(200, ge=0)):
+    """
+    Samples collected so far, without stopping the profiler.
+    """
+    _require_profiler()
+    return metrics.profiler.report(limit)
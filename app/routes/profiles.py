@@ -0,0 +1,30 @@
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import Response
+from app.models.profile import UserProfile
+from app import profiles
+from app.resilience import UpstreamUnavailableError, service_unavailable
+import app.graphiti_client as graphiti_client
+
+router = APIRouter()
+
+@router.get("/users/{uid}/profile", response_model=UserProfile, responses={304: {"description": "Not modified"}})
+async def user_profile(uid: str, if_none_match: str | None = Header(None)):
+    """
+    The user's materialized profile, read with a single-key lookup.
+
+    Carries an ETag; a request whose If-None-Match names the current one gets 304 without a body.
+    """
+    try:
+        found = await graphiti_client.get_profile(uid)
+    except UpstreamUnavailableError as e:
+        raise service_unavailable(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if found is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    doc, etag = found
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if profiles.etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    # The stored document is served as is, without decoding and re-encoding it
+    return Response(content=doc, media_type="application/json", headers=headers)
@@ -1,6 +1,13 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from app.models.question import QuestionOut
 from app.models.question_request import NextQuestionIn
+from app.models.question_request_with_context import NextQuestionWithContextIn
+from app.question_buffer import question_buffer
+from app.singleflight import single_flight
+from app import batch_questions
+from app.bulk_ingest import ndjson_results
+from app.resilience import UpstreamUnavailableError, service_unavailable
 import app.graphiti_client as graphiti_client
 
 router = APIRouter()
@@ -9,30 +16,72 @@ router = APIRouter()
 async def next_question(payload: NextQuestionIn):
     """
     Generates the next dynamic question based on user's long-term preferences.
+
+    Served from the user's pre-generated question buffer when possible; generated live on a miss.
     """
+    async def compute() -> str:
+        question_text = question_buffer.pop(payload.uid, payload.num_preferences)
+        if question_text is None:
+            prefs = await graphiti_client.get_preferences(uid=payload.uid, top_k=payload.num_preferences)
+            question_text = await graphiti_client.generate_next_question(preferences=prefs)
+        # Top the buffer back up in the background for the next request
+        question_buffer.refill(payload.uid, payload.num_preferences)
+        return question_text
+
     try:
-        prefs = graphiti_client.get_preferences(uid=payload.uid, top_k=payload.num_preferences)
-        question_text = await graphiti_client.generate_next_question(preferences=prefs)
+        # Identical concurrent requests share one computation
+        question_text = await single_flight.do("next_question", (payload.uid, payload.num_preferences), compute)
         return QuestionOut(question=question_text)
+    except UpstreamUnavailableError as e:
+        raise service_unavailable(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e)) 
 
-# --------------- Commented-out alternative route for context-aware question generation ---------------
-# from app.models.question_request_with_context import NextQuestionWithContextIn
-# 
-# @router.post("/next_question_with_context", response_model=QuestionOut)
-# async def next_question_with_context(payload: NextQuestionWithContextIn):
-#     """
-#     Generates the next dynamic question based on user's preferences and previous question context.
-#     """
-#     try:
-#         # Use vector-search-based preference retrieval with previous question context
-#         prefs = graphiti_client.get_preferences_with_context(
-#             uid=payload.uid,
-#             previous_question=payload.previous_question,
-#             top_k=payload.num_preferences
-#         )
-#         question_text = await graphiti_client.generate_next_question(preferences=prefs)
-#         return QuestionOut(question=question_text)
-#     except Exception as e:
-#         raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
+@router.post("/next_questions")
+async def next_questions(
+    payload: list[NextQuestionIn],
+    concurrency: int = Query(batch_questions.NEXT_QUESTIONS_CONCURRENCY, ge=1, le=256, description="Concurrent LLM generations"),
+):
+    """
+    Next question for each item, streamed back as NDJSON in completion order.
+
+    Each line carries the item's `index`, and either `question` or `error`; one failed item
+    does not fail the batch.
+    """
+    if len(payload) > batch_questions.NEXT_QUESTIONS_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {batch_questions.NEXT_QUESTIONS_MAX_ITEMS} items per batch")
+    results = batch_questions.next_questions_stream(payload, concurrency=concurrency)
+    return StreamingResponse(ndjson_results(results), media_type="application/x-ndjson")
+
+@router.get("/question_buffer/stats")
+async def question_buffer_stats():
+    """
+    Hit rate, staleness drops and refill lag percentiles of the next-question buffer.
+    """
+    return question_buffer.stats()
+
+@router.get("/singleflight/stats")
+async def singleflight_stats():
+    """
+    Requests coalesced onto an identical in-flight computation, per endpoint.
+    """
+    return single_flight.stats()
+
+@router.post("/next_question_with_context", response_model=QuestionOut)
+async def next_question_with_context(payload: NextQuestionWithContextIn):
+    """
+    Generates the next dynamic question based on user's preferences and previous question context.
+    """
+    try:
+        # Preferences closest to the previous question in embedding space
+        prefs = await graphiti_client.get_preferences_with_context(
+            uid=payload.uid,
+            previous_question=payload.previous_question,
+            top_k=payload.num_preferences
+        )
+        question_text = await graphiti_client.generate_next_question(preferences=prefs)
+        return QuestionOut(question=question_text)
+    except UpstreamUnavailableError as e:
+        raise service_unavailable(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,179 @@
+"""
+Neo4j schema bootstrap: uniqueness constraints and indexes for every hot lookup.
+
+Run at startup by the app lifespan, and as a migration/report command:
+
+    python -m app.schema apply     # create missing constraints and indexes
+    python -m app.schema report    # list missing schema and the plans of the service's queries
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import sys
+from loguru import logger
+
+# Labels owned by the service itself; every other label is an LLM-derived object label
+CORE_LABELS = {"User", "Episode", "Embedded"}
+
+# Object embeddings live in a Neo4j vector index only with VECTOR_BACKEND=neo4j
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "local").lower()
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "1024"))
+
+CONSTRAINTS = {
+    "user_uid_unique": "CREATE CONSTRAINT user_uid_unique IF NOT EXISTS FOR (u:User) REQUIRE u.uid IS UNIQUE",
+    "episode_id_unique": "CREATE CONSTRAINT episode_id_unique IF NOT EXISTS FOR (e:Episode) REQUIRE e.id IS UNIQUE",
+}
+
+INDEXES = {
+    "episode_created_at": "CREATE RANGE INDEX episode_created_at IF NOT EXISTS FOR (e:Episode) ON (e.created_at)",
+}
+if VECTOR_BACKEND == "neo4j":
+    INDEXES["object_embedding"] = (
+        "CREATE VECTOR INDEX object_embedding IF NOT EXISTS FOR (o:Embedded) ON (o.embedding) "
+        f"OPTIONS {{indexConfig: {{`vector.dimensions`: {EMBEDDING_DIMENSIONS}, `vector.similarity_function`: 'cosine'}}}}"
+    )
+
+# Representative instances of the queries the service runs, used for EXPLAIN reports
+SERVICE_QUERIES = {
+    "merge_user": ("MERGE (u:User {uid:$uid})", {"uid": "u"}),
+    "merge_episode": ("MERGE (e:Episode {id:$episode_id})", {"episode_id": "e"}),
+    "user_profile": ("MATCH (u:User {uid:$uid}) RETURN u.profile AS profile, u.profile_etag AS etag", {"uid": "u"}),
+    "recent_episodes": (
+        "MATCH (u:User {uid:$uid})-[:CREATED]->(e:Episode) "
+        "RETURN e.conversation AS conv_json ORDER BY e.created_at DESC LIMIT $n",
+        {"uid": "u", "n": 2},
+    ),
+    "ranked_preferences": (
+        "MATCH (u:User {uid:$uid})-[r]->(o) "
+        "WHERE type(r) IN $relations OR any(label IN labels(o) WHERE label IN $labels) "
+        "WITH coalesce(o.name, o.text) AS name, max(coalesce(r.rank, 0.0)) AS rank "
+        "RETURN name ORDER BY rank DESC LIMIT $k",
+        {"uid": "u", "relations": ["LIKES"], "labels": ["Preference"], "k": 5},
+    ),
+}
+
+# Plan operators that mean a lookup is not index-backed
+SCAN_OPERATORS = ("AllNodesScan", "NodeByLabelScan")
+
+# Object labels known to have a key index in this process
+_indexed_labels: set[str] = set()
+
+
+def label_index_name(label: str) -> str:
+    return f"{label.lower()}_key"
+
+
+def _label_index_statement(label: str) -> str:
+    return f"CREATE INDEX `{label_index_name(label)}` IF NOT EXISTS FOR (o:`{label}`) ON (o.key)"
+
+
+async def ensure_label_index(session, label: str) -> None:
+    """
+    Create the key index for an object label the first time this process sees it.
+
+    Schema changes cannot share a transaction with data writes, so callers run this
+    before opening the write transaction that MERGEs nodes with the label.
+    """
+    if label in _indexed_labels or label in CORE_LABELS:
+        return
+    result = await session.run(_label_index_statement(label))
+    await result.consume()
+    _indexed_labels.add(label)
+    logger.info(f"Registered key index for label {label}")
+
+
+async def object_labels(session) -> list[str]:
+    result = await session.run("CALL db.labels() YIELD label RETURN label")
+    return [record["label"] async for record in result if record["label"] not in CORE_LABELS]
+
+
+async def ensure_schema(driver) -> None:
+    """
+    Create all constraints and indexes (idempotent), including a key index per existing object label.
+    """
+    async with driver.session() as session:
+        for name, statement in {**CONSTRAINTS, **INDEXES}.items():
+            result = await session.run(statement)
+            await result.consume()
+            logger.debug(f"Ensured schema object {name}")
+        for label in await object_labels(session):
+            await ensure_label_index(session, label)
+    logger.info(f"Schema bootstrap complete ({len(_indexed_labels)} object label indexes)")
+
+
+async def _expected_names(session) -> set[str]:
+    return set(CONSTRAINTS) | set(INDEXES) | {label_index_name(label) for label in await object_labels(session)}
+
+
+async def verify_schema(driver) -> dict:
+    """
+    Compare expected schema objects with what the database reports.
+
+    Returns {"missing": [...], "not_online": [...]}.
+    """
+    async with driver.session() as session:
+        expected = await _expected_names(session)
+        result = await session.run("SHOW CONSTRAINTS YIELD name RETURN name")
+        constraints = {record["name"] async for record in result}
+        result = await session.run("SHOW INDEXES YIELD name, state RETURN name, state")
+        indexes = {record["name"]: record["state"] async for record in result}
+    present = constraints | set(indexes)
+    return {
+        "missing": sorted(expected - present),
+        "not_online": sorted(name for name, state in indexes.items() if name in expected and state != "ONLINE"),
+    }
+
+
+def _plan_operators(plan) -> list[str]:
+    if plan is None:
+        return []
+    operators = [re.sub(r"@.*$", "", plan.get("operatorType", ""))]
+    for child in plan.get("children", []):
+        operators.extend(_plan_operators(child))
+    return operators
+
+
+async def explain_queries(driver) -> dict:
+    """
+    EXPLAIN each service query and flag the ones whose plan still scans by label.
+    """
+    queries = dict(SERVICE_QUERIES)
+    async with driver.session() as session:
+        for label in await object_labels(session):
+            queries[f"merge_object:{label}"] = (f"MERGE (o:`{label}` {{key:$obj}})", {"obj": "o"})
+        report = {}
+        for name, (query, params) in queries.items():
+            result = await session.run(f"EXPLAIN {query}", **params)
+            summary = await result.consume()
+            operators = _plan_operators(summary.plan)
+            report[name] = {
+                "operators": operators,
+                "scans": [op for op in operators if op in SCAN_OPERATORS],
+            }
+    return report
+
+
+async def main(argv: list[str] | None = None) -> int:
+    from dotenv import load_dotenv
+    load_dotenv()
+    import app.graphiti_client as graphiti_client
+
+    parser = argparse.ArgumentParser(description="Neo4j schema bootstrap and index report")
+    parser.add_argument("command", choices=["apply", "report"])
+    args = parser.parse_args(argv)
+    driver = graphiti_client.driver
+    try:
+        if args.command == "apply":
+            await ensure_schema(driver)
+        report = {"schema": await verify_schema(driver), "plans": await explain_queries(driver)}
+    finally:
+        await driver.close()
+    print(json.dumps(report, indent=2))
+    unindexed = [name for name, plan in report["plans"].items() if plan["scans"]]
+    return 1 if report["schema"]["missing"] or unindexed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,214 @@
+"""
+Service container for the clients the app talks to, created lazily and owned by the lifespan.
+
+Importing the app creates nothing. The Neo4j driver is built from the environment on first
+use; `neo4j` itself is imported only at that point. The Graphiti core client is built the
+same way, and only when `graphiti_core` is installed and USE_GRAPHITI is not false. The
+lifespan calls `start()`, which warms the services up before the first request:
+- verifies Neo4j connectivity;
+- opens NEO4J_MIN_POOL_SIZE connections;
+- opens the pooled LLM client.
+
+It calls `aclose()` on shutdown. Because settings are read when a client is built, a closed
+container rebuilds from the current environment the next time it is used.
+
+Sessions opened through `LazyDriver` are admitted by `neo4j_guard` (see app.resilience). It
+applies a concurrency limit that shrinks when the database reports it is unavailable or busy,
+and a circuit breaker. Retrying transient errors is left to the driver's managed
+transactions.
+"""
+import asyncio
+import importlib.util
+import os
+import sys
+from contextlib import AsyncExitStack
+from loguru import logger
+from app.metrics import registry
+from app.resilience import UpstreamGuard, UpstreamUnavailableError
+
+# Connections opened during warm-up so the first requests do not pay for the Bolt handshake
+NEO4J_MIN_POOL_SIZE = int(os.getenv("NEO4J_MIN_POOL_SIZE", "2"))
+SERVICES_WARMUP = os.getenv("SERVICES_WARMUP", "true").lower() in ("true", "1", "yes")
+
+
+def graphiti_available() -> bool:
+    """
+    Whether Graphiti core ingestion is enabled, without importing `graphiti_core`.
+    """
+    if os.getenv("USE_GRAPHITI", "true").lower() not in ("true", "1", "yes"):
+        return False
+    return importlib.util.find_spec("graphiti_core") is not None
+
+
+def unavailable_errors() -> tuple[type[BaseException], ...]:
+    """
+    Errors meaning the database cannot be reached or is shedding load (for use in `except` clauses).
+    """
+    from neo4j.exceptions import ServiceUnavailable, SessionExpired
+    return ServiceUnavailable, SessionExpired, UpstreamUnavailableError
+
+
+def overload_errors() -> tuple[type[BaseException], ...]:
+    """
+    Neo4j errors that should shrink the concurrency limit and count against the circuit breaker.
+    """
+    from neo4j.exceptions import ServiceUnavailable, SessionExpired, TransientError
+    return ServiceUnavailable, SessionExpired, TransientError, asyncio.TimeoutError
+
+
+def neo4j_settings() -> dict:
+    return {
+        "uri": os.getenv("NEO4J_URI"),
+        "auth": (os.getenv("NEO4J_USER"), os.getenv("NEO4J_PASSWORD")),
+        # Connection pool: size, seconds to wait for a free connection, seconds before a connection is recycled
+        "max_connection_pool_size": int(os.getenv("NEO4J_MAX_POOL_SIZE", "100")),
+        "connection_acquisition_timeout": float(os.getenv("NEO4J_ACQUISITION_TIMEOUT", "30")),
+        "max_connection_lifetime": float(os.getenv("NEO4J_MAX_CONNECTION_LIFETIME", "3600")),
+    }
+
+
+class Services:
+    def __init__(self):
+        self._driver = None
+        self._graphiti = None
+
+    @property
+    def driver(self):
+        """
+        The Neo4j AsyncDriver, built on first access.
+        """
+        if self._driver is None:
+            from neo4j import AsyncGraphDatabase
+            settings = neo4j_settings()
+            if not settings["uri"]:
+                raise RuntimeError("NEO4J_URI is not set")
+            uri = settings.pop("uri")
+            self._driver = AsyncGraphDatabase.driver(uri, **settings)
+            logger.info(f"Neo4j driver created for {uri} (pool={settings['max_connection_pool_size']})")
+        return self._driver
+
+    @property
+    def driver_created(self) -> bool:
+        return self._driver is not None
+
+    @property
+    def graphiti(self):
+        """
+        The Graphiti core client, or None when it is not installed or disabled.
+        """
+        if self._graphiti is None and graphiti_available():
+            from graphiti_core import Graphiti
+            from graphiti_core.llm_client import OpenAIGenericClient
+            llm_client = OpenAIGenericClient(
+                base_url=os.getenv("OPENAI_API_BASE"),
+                api_key=os.getenv("OPENAI_API_KEY"),
+                model_name=os.getenv("NEBIUS_MODEL_NAME"),
+                timeout=int(os.getenv("GRAPHITI_LLM_TIMEOUT", "25")),
+            )
+            self._graphiti = Graphiti(driver=self.driver, llm_client=llm_client,
+                                      embedding_model_name=os.getenv("EMBEDDING_MODEL_NAME"))
+        return self._graphiti
+
+    async def warm_up(self, driver=None, min_pool: int = NEO4J_MIN_POOL_SIZE) -> None:
+        """
+        Verify Neo4j connectivity and open `min_pool` pooled connections.
+        """
+        driver = driver or self.driver
+        await driver.verify_connectivity()
+
+        async def ping():
+            async with driver.session() as session:
+                result = await session.run("RETURN 1")
+                await result.consume()
+
+        await asyncio.gather(*(ping() for _ in range(min_pool)))
+        logger.info(f"Neo4j reachable; {min_pool} pooled connection(s) opened")
+
+    async def start(self, driver=None) -> None:
+        """
+        Open the LLM client and warm up `driver` (default: the container's own Neo4j driver).
+        """
+        from app.llm import llm
+        await llm.start()
+        if SERVICES_WARMUP:
+            try:
+                await self.warm_up(driver)
+            except Exception as e:
+                logger.warning(f"Neo4j warm-up failed; connecting on first use instead: {e}")
+
+    async def aclose(self) -> None:
+        from app.llm import llm
+        await llm.aclose()
+        if self._driver is not None:
+            await self._driver.close()
+        self._driver = None
+        self._graphiti = None
+
+
+class GuardedSession:
+    """
+    Neo4j session holding an admission slot of `guard` from `async with` entry to exit.
+    """
+
+    def __init__(self, session, guard: UpstreamGuard):
+        self._session = session
+        self._guard = guard
+        self._stack: AsyncExitStack | None = None
+
+    async def __aenter__(self):
+        stack = AsyncExitStack()
+        await stack.enter_async_context(self._guard.admit())
+        try:
+            await stack.enter_async_context(self._session)
+        except BaseException:
+            await stack.__aexit__(*sys.exc_info())
+            raise
+        self._stack = stack
+        return self
+
+    async def __aexit__(self, *exc):
+        stack, self._stack = self._stack, None
+        return await stack.__aexit__(*exc)
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+
+class LazyDriver:
+    """
+    Stand-in for the Neo4j driver that forwards to `services.driver`, building it on first use.
+    """
+
+    def __init__(self, container: Services):
+        self._services = container
+
+    def __getattr__(self, name):
+        return getattr(self._services.driver, name)
+
+    def session(self, **kwargs) -> GuardedSession:
+        return GuardedSession(self._services.driver.session(**kwargs), neo4j_guard)
+
+    async def close(self) -> None:
+        if self._services.driver_created:
+            await self._services.driver.close()
+            self._services._driver = None
+
+
+# Process-wide container used by the app, the workers and the CLI tools
+services = Services()
+
+
+class _Neo4jGuard(UpstreamGuard):
+    def classify(self, error: BaseException) -> str:
+        # Driver exceptions are resolved here so that importing this module does not import neo4j
+        if isinstance(error, overload_errors()):
+            return "overload"
+        return super().classify(error)
+
+
+# Admission control for sessions: up to the pool size at once, shed after NEO4J_QUEUE_DEADLINE
+neo4j_guard = _Neo4jGuard.from_env(
+    "NEO4J", concurrency=int(os.getenv("NEO4J_MAX_POOL_SIZE", "100")),
+    max_concurrency=int(os.getenv("NEO4J_MAX_POOL_SIZE", "100")), queue_deadline=5.0, retries=0,
+)
+registry.register_collector(neo4j_guard.collect)
@@ -0,0 +1,67 @@
+"""
+Single-flight coalescing of identical concurrent requests.
+
+When an app refreshes it can fire several identical LLM-backed requests within
+milliseconds. The first request for a normalized key (the leader) runs the computation as
+a task. Duplicates that arrive while it is in flight await that task and share its result
+or its exception. Nothing is cached: once the task finishes, the next request starts a new
+one. Coalescing is enabled per endpoint with SINGLEFLIGHT_ENDPOINTS.
+"""
+import asyncio
+import os
+from collections.abc import Awaitable, Callable, Hashable
+from typing import Any
+
+SINGLEFLIGHT_ENDPOINTS = {
+    name.strip()
+    for name in os.getenv("SINGLEFLIGHT_ENDPOINTS", "conversation_summary,conversation_content,next_question").split(",")
+    if name.strip()
+}
+
+
+class SingleFlight:
+    def __init__(self, endpoints: set[str] = SINGLEFLIGHT_ENDPOINTS):
+        self.endpoints = set(endpoints)
+        self._inflight: dict[tuple[str, Hashable], asyncio.Task] = {}
+        self._counters: dict[str, dict[str, int]] = {}
+
+    def enabled(self, endpoint: str) -> bool:
+        return endpoint in self.endpoints
+
+    async def do(self, endpoint: str, key: Hashable, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """
+        Await `fn(*args, **kwargs)`, sharing one in-flight call between concurrent callers with the same key.
+        """
+        if not self.enabled(endpoint):
+            return await fn(*args, **kwargs)
+        counters = self._counters.setdefault(endpoint, {"calls": 0, "coalesced": 0})
+        counters["calls"] += 1
+        flight = (endpoint, key)
+        task = self._inflight.get(flight)
+        if task is not None:
+            counters["coalesced"] += 1
+        else:
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            self._inflight[flight] = task
+            task.add_done_callback(lambda done: self._finish(flight, done))
+        # Shielded so a caller that goes away does not cancel the call for the others
+        return await asyncio.shield(task)
+
+    def _finish(self, flight: tuple[str, Hashable], task: asyncio.Task) -> None:
+        if self._inflight.get(flight) is task:
+            del self._inflight[flight]
+        if not task.cancelled():
+            # Mark the exception retrieved; every waiter has already received it
+            task.exception()
+
+    def stats(self) -> dict:
+        return {
+            "endpoints": sorted(self.endpoints),
+            "in_flight": len(self._inflight),
+            "coalesced": sum(c["coalesced"] for c in self._counters.values()),
+            "by_endpoint": {name: dict(c) for name, c in self._counters.items()},
+        }
+
+
+# Process-wide coalescer shared by the LLM-backed routes
+single_flight = SingleFlight()
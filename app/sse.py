@@ -0,0 +1,47 @@
+"""
+Server-Sent Events relay for streamed LLM output.
+
+Text deltas are sent as `data: {"token": ...}` events, followed by one `done` event that
+carries the whole text (or an `error` event). When the client disconnects, Starlette
+cancels the response; the cancellation reaches the upstream stream, which closes its
+connection so the LLM stops generating tokens nobody will read.
+"""
+import asyncio
+import json
+from collections.abc import AsyncIterator, Callable
+from fastapi.responses import StreamingResponse
+from loguru import logger
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def sse_event(data: dict, event: str | None = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+
+async def relay(tokens: AsyncIterator[str], on_complete: Callable[[str], None] | None = None,
+                label: str = "stream") -> AsyncIterator[str]:
+    """
+    SSE-encode `tokens`; `on_complete` receives the full text only if the stream finished.
+    """
+    parts = []
+    try:
+        async for token in tokens:
+            parts.append(token)
+            yield sse_event({"token": token})
+        text = "".join(parts).strip()
+        if on_complete is not None:
+            on_complete(text)
+        yield sse_event({"summary": text}, event="done")
+    except asyncio.CancelledError:
+        logger.info(f"Client disconnected from {label} after {len(parts)} token(s); upstream stream closed")
+        raise
+    except Exception as e:
+        logger.error(f"Error while streaming {label}: {e}")
+        yield sse_event({"detail": str(e)}, event="error")
+
+
+def sse_response(tokens: AsyncIterator[str], on_complete: Callable[[str], None] | None = None,
+                 label: str = "stream") -> StreamingResponse:
+    return StreamingResponse(relay(tokens, on_complete, label), media_type="text/event-stream", headers=SSE_HEADERS)
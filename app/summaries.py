@@ -0,0 +1,123 @@
+"""
+Read-time composition of precomputed per-episode summaries.
+
+Each Episode carries a compact `summary` written at ingest, so the summary routes never
+send raw transcripts to the LLM. One summary is returned as is; several are merged with
+a small combine call, and when they exceed the token budget they are first reduced in
+parallel groups (hierarchical map-reduce) so the final prompt stays roughly constant.
+`compose_stream` does the same but streams the final combine call token by token.
+"""
+import asyncio
+import os
+from collections.abc import AsyncIterator
+from app.llm import llm
+
+SUMMARY_COMBINE_TOKEN_BUDGET = int(os.getenv("SUMMARY_COMBINE_TOKEN_BUDGET", "3000"))
+SUMMARY_MAP_CONCURRENCY = int(os.getenv("SUMMARY_MAP_CONCURRENCY", "4"))
+SUMMARY_COMBINE_MAX_TOKENS = int(os.getenv("SUMMARY_COMBINE_MAX_TOKENS", "512"))
+
+# Final combine prompts per summary kind: (system prompt, user prompt prefix)
+PROMPTS = {
+    "summary": (
+        "You are a helpful summarization assistant.",
+        "Summarize the following conversation summaries, newest first, into one concise summary:",
+    ),
+    "content": (
+        "You are a content creation assistant. Produce an in-depth summary for content publication.",
+        "Create a rich, detailed content summary of these user–AI interactions (given as per-conversation summaries, newest first):",
+    ),
+}
+# Kinds whose output style differs from the stored summaries, so even one episode is rewritten
+RESTYLE_KINDS = {"content"}
+
+MAP_PROMPT = (
+    "You are a helpful summarization assistant.",
+    "Merge these conversation summaries into one compact summary, keeping every distinct fact about the user:",
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate (~4 characters per token) used for budgeting prompts.
+    """
+    return len(text) // 4 + 1
+
+
+def pack_groups(summaries: list[str], budget: int) -> list[list[str]]:
+    """
+    Split summaries, in order, into consecutive groups whose estimated size fits `budget`.
+
+    Every group holds at least two summaries (when available) so each map round shrinks the input.
+    """
+    groups: list[list[str]] = []
+    current: list[str] = []
+    used = 0
+    for text in summaries:
+        cost = estimate_tokens(text)
+        if current and used + cost > budget and len(current) >= 2:
+            groups.append(current)
+            current, used = [], 0
+        current.append(text)
+        used += cost
+    if current:
+        if len(current) == 1 and groups:
+            groups[-1].append(current[0])
+        else:
+            groups.append(current)
+    return groups
+
+
+def _combine_messages(summaries: list[str], prompt: tuple[str, str]) -> list[dict]:
+    system_prompt, instruction = prompt
+    body = "\n\n".join(f"- {text}" for text in summaries)
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": f"{instruction}\n\n{body}"},
+    ]
+
+
+async def _combine(summaries: list[str], prompt: tuple[str, str]) -> str:
+    return await llm.complete(_combine_messages(summaries, prompt), max_tokens=SUMMARY_COMBINE_MAX_TOKENS)
+
+
+async def _reduce(summaries: list[str], budget: int) -> list[str]:
+    """
+    Map-reduce groups of summaries until they fit the budget of the final combine prompt.
+    """
+    semaphore = asyncio.Semaphore(SUMMARY_MAP_CONCURRENCY)
+
+    async def reduce_group(group: list[str]) -> str:
+        if len(group) == 1:
+            return group[0]
+        async with semaphore:
+            return await _combine(group, MAP_PROMPT)
+
+    while len(summaries) > 1 and sum(estimate_tokens(text) for text in summaries) > budget:
+        groups = pack_groups(summaries, budget)
+        summaries = list(await asyncio.gather(*(reduce_group(group) for group in groups)))
+    return summaries
+
+
+async def compose(summaries: list[str], kind: str, budget: int = SUMMARY_COMBINE_TOKEN_BUDGET) -> str:
+    """
+    Compose per-episode summaries (newest first) into one summary of the given kind.
+    """
+    if not summaries:
+        return ""
+    if len(summaries) == 1 and kind not in RESTYLE_KINDS:
+        return summaries[0]
+    return await _combine(await _reduce(summaries, budget), PROMPTS[kind])
+
+
+async def compose_stream(summaries: list[str], kind: str, budget: int = SUMMARY_COMBINE_TOKEN_BUDGET) -> AsyncIterator[str]:
+    """
+    Like `compose`, yielding the final combine call's text as it is generated.
+    """
+    if not summaries:
+        return
+    if len(summaries) == 1 and kind not in RESTYLE_KINDS:
+        yield summaries[0]
+        return
+    messages = _combine_messages(await _reduce(summaries, budget), PROMPTS[kind])
+    async for text in llm.stream(messages, max_tokens=SUMMARY_COMBINE_MAX_TOKENS):
+        yield text
@@ -1,7 +1,65 @@
 # Utility functions for preference-backend
+import asyncio
+import functools
+import random
+from collections.abc import Iterator
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from loguru import logger
 
-def backoff_retry():
+
+def parse_retry_after(value: str | None) -> float | None:
+    """
+    Seconds to wait from a Retry-After header (delta-seconds or HTTP-date); None if absent or invalid.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+def backoff_delays(retries: int, base: float, cap: float, rng: random.Random | None = None) -> Iterator[float]:
     """
-    Placeholder for backoff decorator on Neo4j connections.
+    Exponential backoff with full jitter: the nth delay is uniform in [0, min(cap, base * 2**n)].
+    """
+    rng = rng or random
+    for attempt in range(retries):
+        yield rng.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def backoff_retry(retries: int = 3, base: float = 0.5, cap: float = 10.0,
+                  retry_on: tuple[type[BaseException], ...] = (Exception,)):
+    """
+    Decorator retrying an async function on `retry_on` with jittered exponential backoff.
+
+    An exception carrying a `retry_after` attribute (seconds, e.g. from a Retry-After header)
+    waits at least that long, still capped at `cap`. The last exception is re-raised once the
+    retries are spent.
     """
-    pass 
\ No newline at end of file
+    def wrap(fn):
+        @functools.wraps(fn)
+        async def run(*args, **kwargs):
+            delays = backoff_delays(retries, base, cap)
+            while True:
+                try:
+                    return await fn(*args, **kwargs)
+                except retry_on as e:
+                    delay = next(delays, None)
+                    if delay is None:
+                        raise
+                    hint = getattr(e, "retry_after", None)
+                    if hint is not None:
+                        delay = min(cap, max(delay, hint))
+                    logger.warning(f"{fn.__qualname__} failed ({e!r}); retrying in {delay:.2f}s")
+                    await asyncio.sleep(delay)
+        return run
+    return wrap
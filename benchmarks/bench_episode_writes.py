@@ -0,0 +1,172 @@
+"""
+Benchmark: Bolt round trips and latency of the add_episode relationship writer.
+
+Compares the legacy writer (two auto-commit statements per relation plus two for the
+Episode) with the batched single-transaction UNWIND writer in app.graphiti_client.
+
+By default every round trip is simulated with a fixed delay (--rtt-ms) so the numbers
+are reproducible without a database. Pass --neo4j-uri to measure against a real server.
+
+    python -m benchmarks.bench_episode_writes --relations 30 --rtt-ms 1.5
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+import uuid
+
+os.environ.setdefault("NEO4J_URI", "bolt://localhost:7687")
+
+from app.graphiti_client import _sanitize_relations, _write_episode_tx
+
+LABELS = ["Emotion", "Problem", "Coping_strategy", "Activity", "Preference"]
+RELATIONS = ["FEELS", "STRUGGLES_WITH", "USES", "ENJOYS", "LIKES"]
+
+
+class _FakeResult:
+    async def consume(self):
+        return None
+
+
+class CountingSession:
+    """
+    Stand-in for a neo4j AsyncSession/AsyncTransaction that counts round trips and sleeps `rtt` per statement.
+    """
+
+    def __init__(self, rtt: float):
+        self.rtt = rtt
+        self.round_trips = 0
+
+    async def run(self, query, **params):
+        self.round_trips += 1
+        await asyncio.sleep(self.rtt)
+        return _FakeResult()
+
+    async def execute_write(self, fn, *args):
+        # BEGIN and COMMIT are each one more round trip
+        self.round_trips += 2
+        await asyncio.sleep(2 * self.rtt)
+        return await fn(self, *args)
+
+    async def close(self):
+        return None
+
+
+class Neo4jSession:
+    """
+    Thin wrapper over a real async session that counts statements (BEGIN/COMMIT included for transactions).
+    """
+
+    def __init__(self, session):
+        self._session = session
+        self.round_trips = 0
+
+    async def run(self, query, **params):
+        self.round_trips += 1
+        result = await self._session.run(query, **params)
+        await result.consume()
+        return _FakeResult()
+
+    async def execute_write(self, fn, *args):
+        self.round_trips += 2
+        outer = self
+
+        async def _work(tx):
+            class _Tx:
+                async def run(self, query, **params):
+                    outer.round_trips += 1
+                    return await tx.run(query, **params)
+            return await fn(_Tx(), *args)
+
+        return await self._session.execute_write(_work)
+
+    async def close(self):
+        await self._session.close()
+
+
+def synthetic_relations(n: int) -> list[dict]:
+    return [
+        {
+            "relation": RELATIONS[i % len(RELATIONS)].lower(),
+            "object": f"object {i}",
+            "object_type": LABELS[i % len(LABELS)].lower(),
+        }
+        for i in range(n)
+    ]
+
+
+async def legacy_write(session, uid: str, conv_json: str, rels: list[dict]) -> None:
+    """
+    The pre-batching writer: one MERGE and one MATCH/MERGE per relation, then the Episode.
+    """
+    await session.run("MERGE (u:User {uid:$uid})", uid=uid)
+    for (obj_type, rel_type), names in _sanitize_relations(rels).items():
+        for obj in names:
+            await session.run(f"MERGE (o:`{obj_type}` {{name:$obj}})", obj=obj)
+            await session.run(
+                f"MATCH (u:User {{uid:$uid}}), (o:`{obj_type}` {{name:$obj}}) MERGE (u)-[:`{rel_type}`]->(o)",
+                uid=uid, obj=obj,
+            )
+    episode_id = str(uuid.uuid4())
+    await session.run(
+        "MERGE (e:Episode {id: $episode_id}) SET e.conversation = $conv_json, e.created_at = datetime()",
+        episode_id=episode_id, conv_json=conv_json,
+    )
+    await session.run(
+        "MATCH (u:User {uid: $uid}), (e:Episode {id: $episode_id}) MERGE (u)-[:CREATED]->(e)",
+        uid=uid, episode_id=episode_id,
+    )
+
+
+async def batched_write(session, uid: str, conv_json: str, rels: list[dict]) -> None:
+    await session.execute_write(_write_episode_tx, uid, str(uuid.uuid4()), conv_json, _sanitize_relations(rels))
+
+
+async def run(writer, make_session, rels: list[dict], iterations: int) -> dict:
+    conv_json = json.dumps([{"speaker": "User", "text": "hello"}] * 10)
+    latencies, trips = [], []
+    for i in range(iterations):
+        session = make_session()
+        t0 = time.perf_counter()
+        await writer(session, f"bench-user-{i}", conv_json, rels)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        await session.close()
+        trips.append(session.round_trips)
+    return {
+        "round_trips": statistics.mean(trips),
+        "p50_ms": statistics.median(latencies),
+        "max_ms": max(latencies),
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--relations", type=int, default=30)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--rtt-ms", type=float, default=1.0, help="simulated round-trip time")
+    parser.add_argument("--neo4j-uri", default=None, help="measure against a real Neo4j instead")
+    args = parser.parse_args()
+
+    rels = synthetic_relations(args.relations)
+    if args.neo4j_uri:
+        from neo4j import AsyncGraphDatabase
+        driver = AsyncGraphDatabase.driver(
+            args.neo4j_uri, auth=(os.getenv("NEO4J_USER", "neo4j"), os.getenv("NEO4J_PASSWORD", "neo4j"))
+        )
+        make_session = lambda: Neo4jSession(driver.session())
+    else:
+        make_session = lambda: CountingSession(args.rtt_ms / 1000)
+
+    before = await run(legacy_write, make_session, rels, args.iterations)
+    after = await run(batched_write, make_session, rels, args.iterations)
+    groups = len(_sanitize_relations(rels))
+    print(f"relations={args.relations} groups={groups} iterations={args.iterations}")
+    print(f"{'writer':<10}{'round trips':>14}{'p50 ms':>10}{'max ms':>10}")
+    for name, res in (("legacy", before), ("batched", after)):
+        print(f"{name:<10}{res['round_trips']:>14.1f}{res['p50_ms']:>10.2f}{res['max_ms']:>10.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
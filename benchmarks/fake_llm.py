@@ -0,0 +1,202 @@
+"""
+Local OpenAI-compatible server for benchmarks: /v1/chat/completions (plain and `stream: true`),
+/v1/completions and /v1/embeddings.
+
+Answers are shaped by the prompt so the real code paths run end to end: relationship
+extraction gets a JSON array of relations, question generation a question, summaries a
+paragraph. Latency, token rate and failures are configurable:
+
+- `latency_ms`: time to the first byte.
+- `tokens_per_sec`: generation rate. 0 sends the whole text at once.
+- `error_rate`: fraction of requests answered with `error_status`.
+
+    python -m benchmarks.fake_llm --port 8089 --latency-ms 300 --tokens-per-sec 60
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+EMBEDDING_DIMENSIONS = 64
+TOPICS = ["hiking", "jazz", "cooking", "meditation", "running", "painting", "chess", "gardening", "sushi", "yoga"]
+
+
+@dataclass
+class FakeLLMConfig:
+    latency_ms: float = 0.0
+    tokens_per_sec: float = 0.0
+    error_rate: float = 0.0
+    error_status: int = 500
+    seed: int = 0
+
+
+@dataclass
+class FakeLLMStats:
+    requests: int = 0
+    errors: int = 0
+    by_path: dict = field(default_factory=dict)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def record(self, path: str, failed: bool) -> None:
+        with self.lock:
+            self.requests += 1
+            self.errors += failed
+            self.by_path[path] = self.by_path.get(path, 0) + 1
+
+
+def _prompt_text(body: dict) -> str:
+    if "messages" in body:
+        return "\n".join(m.get("content", "") for m in body["messages"])
+    return body.get("prompt", "")
+
+
+def answer(prompt: str) -> str:
+    """
+    Deterministic reply for a prompt, in the shape the calling code expects.
+    """
+    words = re.findall(r"[a-z]+", prompt.lower())
+    topics = [t for t in TOPICS if t in words] or [TOPICS[zlib.crc32(prompt.encode()) % len(TOPICS)]]
+    if "relationship extraction" in prompt:
+        rels = [{"relation": "likes", "object": topic, "object_type": "Activity"} for topic in topics]
+        rels.append({"relation": "feels", "object": "curious", "object_type": "Emotion"})
+        return json.dumps(rels)
+    if "follow-up question" in prompt:
+        return f"What else do you enjoy besides {topics[0]}?"
+    return " ".join(f"The user talked about {topic} and how it fits their week." for topic in topics)
+
+
+def embedding(text: str) -> list[float]:
+    vector = [0.0] * EMBEDDING_DIMENSIONS
+    for word in re.findall(r"\w+", text.lower()):
+        vector[zlib.crc32(word.encode()) % EMBEDDING_DIMENSIONS] += 1.0
+    return vector
+
+
+def _tokens(text: str) -> list[str]:
+    return re.findall(r"\S+\s*", text) or [text]
+
+
+def make_handler(config: FakeLLMConfig, stats: FakeLLMStats, rng: random.Random):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+            path = self.path.rsplit("/v1", 1)[-1]
+            failed = rng.random() < config.error_rate
+            stats.record(path, failed)
+            if config.latency_ms:
+                time.sleep(config.latency_ms / 1000)
+            if failed:
+                return self._json(config.error_status, {"error": {"message": "injected failure"}})
+            if path == "/embeddings":
+                inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+                data = [{"object": "embedding", "index": i, "embedding": embedding(t)} for i, t in enumerate(inputs)]
+                return self._json(200, {"object": "list", "data": data, "model": body.get("model"),
+                                        "usage": {"prompt_tokens": sum(len(t.split()) for t in inputs)}})
+            if path not in ("/chat/completions", "/completions"):
+                return self._json(404, {"error": {"message": f"unknown path {path}"}})
+            prompt = _prompt_text(body)
+            text = answer(prompt)
+            usage = {"prompt_tokens": len(prompt.split()), "completion_tokens": len(_tokens(text))}
+            if body.get("stream"):
+                return self._stream(path, body.get("model"), text)
+            if config.tokens_per_sec:
+                time.sleep(len(_tokens(text)) / config.tokens_per_sec)
+            choice = {"index": 0, "message": {"role": "assistant", "content": text}} if path == "/chat/completions" \
+                else {"index": 0, "text": text}
+            return self._json(200, {"choices": [choice], "model": body.get("model"), "usage": usage})
+
+        def _json(self, status: int, payload: dict) -> None:
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _chunk(self, data: bytes) -> None:
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        def _stream(self, path: str, model: str | None, text: str) -> None:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            try:
+                for token in _tokens(text):
+                    if config.tokens_per_sec:
+                        time.sleep(1 / config.tokens_per_sec)
+                    choice = {"index": 0, "delta": {"content": token}} if path == "/chat/completions" \
+                        else {"index": 0, "text": token}
+                    self._chunk(f"data: {json.dumps({'choices': [choice], 'model': model})}\n\n".encode())
+                self._chunk(b"data: [DONE]\n\n")
+                self._chunk(b"")
+            except (BrokenPipeError, ConnectionResetError):
+                # The client went away mid-stream; stop generating
+                self.close_connection = True
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+class FakeLLMServer:
+    """
+    The fake server on a background thread; use as a context manager or call start()/stop().
+    """
+
+    def __init__(self, config: FakeLLMConfig | None = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or FakeLLMConfig()
+        self.stats = FakeLLMStats()
+        handler = make_handler(self.config, self.stats, random.Random(self.config.seed))
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "FakeLLMServer":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeLLMServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--tokens-per-sec", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=500)
+    args = parser.parse_args()
+    config = FakeLLMConfig(args.latency_ms, args.tokens_per_sec, args.error_rate, args.error_status)
+    server = FakeLLMServer(config, port=args.port).start()
+    print(f"Fake LLM listening on {server.base_url}")
+    try:
+        server._thread.join()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+"""
+Load benchmark: throughput, tail latency and Bolt round trips of the service's real code paths.
+
+The app runs in-process behind httpx's ASGI transport. Its LLM client points at the local
+fake OpenAI-compatible server (benchmarks.fake_llm). Neo4j is one of:
+- the in-memory stand-in (the default);
+- a real server (--neo4j-uri);
+- a throwaway container (--neo4j-container, needs testcontainers and Docker).
+
+A synthetic corpus in the convo.json shape is ingested first. Then each scenario is driven
+at --concurrency:
+- ingest
+- next_question
+- summary
+- content
+- get_conversations
+- profile
+
+For every scenario the report has p50/p95/p99 latency (ms), throughput (req/s), errors
+and Bolt round trips per request.
+
+    python -m benchmarks.load --users 20 --conversations 5 --requests 200 --concurrency 16 \\
+        --llm-latency-ms 150 --llm-tokens-per-sec 80 --save-baseline benchmarks/baseline.json
+    python -m benchmarks.load ... --compare benchmarks/baseline.json --threshold 0.15
+
+With --compare the run exits with status 1 when any scenario's p95 latency, or its round
+trips per request, grew by more than --threshold (a fraction), or when throughput fell by
+more than that.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from contextlib import AsyncExitStack
+from dataclasses import dataclass, asdict
+
+os.environ.setdefault("NEO4J_URI", "bolt://localhost:7687")
+os.environ.setdefault("USE_GRAPHITI", "false")
+os.environ.setdefault("SCHEMA_BOOTSTRAP", "false")
+
+import httpx
+from loguru import logger
+from app.ingest_queue import _percentile
+from benchmarks.fake_llm import FakeLLMConfig, FakeLLMServer, TOPICS
+from benchmarks.neo4j_standin import StandInDriver
+
+SCENARIOS = ("ingest", "next_question", "summary", "content", "get_conversations", "profile")
+
+
+@dataclass
+class BenchConfig:
+    users: int = 10
+    conversations: int = 3
+    turns: int = 8
+    requests: int = 100
+    concurrency: int = 8
+    scenarios: tuple[str, ...] = SCENARIOS
+    llm_latency_ms: float = 0.0
+    llm_tokens_per_sec: float = 0.0
+    llm_error_rate: float = 0.0
+    neo4j_rtt_ms: float = 0.0
+    seed: int = 7
+
+
+def synthetic_conversation(rng: random.Random, turns: int) -> list[dict]:
+    """
+    AI/User turns in the convo.json shape, mentioning a few topics the fake LLM recognises.
+    """
+    topics = rng.sample(TOPICS, 2)
+    conv = []
+    for i in range(turns):
+        if i % 2 == 0:
+            conv.append({"speaker": "AI", "text": f"What would you like to talk about? Tell me more about {topics[0]}."})
+        else:
+            conv.append({"speaker": "User", "text": f"I really enjoy {topics[i // 2 % 2]} and it helps me relax after work."})
+    return conv
+
+
+def synthetic_corpus(config: BenchConfig) -> list[dict]:
+    rng = random.Random(config.seed)
+    corpus = []
+    for u in range(config.users):
+        for c in range(config.conversations):
+            created = f"2026-01-{1 + c % 28:02d}T{u % 24:02d}:00:00Z"
+            corpus.append({
+                "uid": f"bench-user-{u}", "conversation": synthetic_conversation(rng, config.turns),
+                "conversation_id": str(uuid.UUID(int=rng.getrandbits(128))),
+                "created_at": created, "updated_at": created,
+            })
+    return corpus
+
+
+def _requests(scenario: str, config: BenchConfig, corpus: list[dict], rng: random.Random) -> list[tuple[str, str, dict]]:
+    """
+    (method, path, kwargs) of every request in a scenario.
+    """
+    uids = sorted({item["uid"] for item in corpus})
+    out = []
+    for i in range(config.requests):
+        uid = rng.choice(uids)
+        if scenario == "ingest":
+            item = dict(corpus[i % len(corpus)], conversation_id=str(uuid.UUID(int=rng.getrandbits(128))))
+            out.append(("POST", "/ingest_conversation", {"json": item}))
+        elif scenario == "next_question":
+            out.append(("POST", "/next_question", {"json": {"uid": uid, "num_preferences": 3}}))
+        elif scenario == "summary":
+            item = rng.choice(corpus)
+            out.append(("POST", "/conversation_summary", {"json": item}))
+        elif scenario == "content":
+            out.append(("POST", "/conversation_content", {"json": {"uid": uid, "num_conversations": 2}}))
+        elif scenario == "get_conversations":
+            out.append(("GET", "/get_conversations", {"params": {"uid": uid, "n": config.conversations}}))
+        elif scenario == "profile":
+            out.append(("GET", f"/users/{uid}/profile", {}))
+    return out
+
+
+async def drive(client: httpx.AsyncClient, requests: list[tuple[str, str, dict]], concurrency: int,
+                round_trips=lambda: None) -> dict:
+    """
+    Send `requests` with at most `concurrency` in flight; return latency/throughput stats.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    for request in requests:
+        queue.put_nowait(request)
+    latencies: list[float] = []
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        while not queue.empty():
+            method, path, kwargs = queue.get_nowait()
+            start = time.perf_counter()
+            try:
+                resp = await client.request(method, path, **kwargs)
+                failed = resp.status_code >= 400
+            except httpx.HTTPError:
+                failed = True
+            latencies.append((time.perf_counter() - start) * 1000)
+            errors += failed
+
+    trips_before = round_trips()
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    trips_after = round_trips()
+    return {
+        "requests": len(requests),
+        "errors": errors,
+        "p50_ms": _percentile(latencies, 50),
+        "p95_ms": _percentile(latencies, 95),
+        "p99_ms": _percentile(latencies, 99),
+        "throughput_rps": round(len(requests) / elapsed, 2) if elapsed else None,
+        "round_trips_per_request": round((trips_after - trips_before) / len(requests), 2)
+        if trips_before is not None and requests else None,
+    }
+
+
+def _counting(driver):
+    """
+    Wrap a real neo4j driver so statements (plus BEGIN/COMMIT per managed transaction) are counted.
+    """
+    counter = {"round_trips": 0}
+
+    class Tx:
+        def __init__(self, tx):
+            self._tx = tx
+
+        async def run(self, query, **params):
+            counter["round_trips"] += 1
+            return await self._tx.run(query, **params)
+
+    class Session:
+        def __init__(self, session):
+            self._session = session
+
+        async def __aenter__(self):
+            await self._session.__aenter__()
+            return self
+
+        async def __aexit__(self, *exc):
+            return await self._session.__aexit__(*exc)
+
+        async def run(self, query, **params):
+            counter["round_trips"] += 1
+            return await self._session.run(query, **params)
+
+        async def _transaction(self, execute, fn, *args, **kwargs):
+            counter["round_trips"] += 2
+            return await execute(lambda tx: fn(Tx(tx), *args, **kwargs))
+
+        async def execute_read(self, fn, *args, **kwargs):
+            return await self._transaction(self._session.execute_read, fn, *args, **kwargs)
+
+        async def execute_write(self, fn, *args, **kwargs):
+            return await self._transaction(self._session.execute_write, fn, *args, **kwargs)
+
+    class Driver:
+        round_trips = property(lambda self: counter["round_trips"])
+
+        def session(self, **kwargs):
+            return Session(driver.session(**kwargs))
+
+        async def close(self):
+            await driver.close()
+
+    return Driver()
+
+
+async def run_benchmark(config: BenchConfig, neo4j_driver=None) -> dict:
+    """
+    Ingest the synthetic corpus, then drive each scenario; returns {scenario: stats}.
+    """
+    from app.main import app
+    from app.llm import llm
+    import app.graphiti_client as graphiti_client
+
+    llm_config = FakeLLMConfig(config.llm_latency_ms, config.llm_tokens_per_sec, config.llm_error_rate, seed=config.seed)
+    driver = neo4j_driver or StandInDriver(rtt=config.neo4j_rtt_ms / 1000)
+    saved = (graphiti_client.driver, llm.base_url, llm.api_key, llm.model)
+    async with AsyncExitStack() as stack:
+        server = stack.enter_context(FakeLLMServer(llm_config))
+        await llm.aclose()
+        graphiti_client.driver = driver
+        llm.base_url, llm.api_key, llm.model = server.base_url, "bench-key", "bench-model"
+        stack.callback(lambda: (setattr(graphiti_client, "driver", saved[0]),
+                                setattr(llm, "base_url", saved[1]), setattr(llm, "api_key", saved[2]),
+                                setattr(llm, "model", saved[3])))
+        await stack.enter_async_context(app.router.lifespan_context(app))
+        client = await stack.enter_async_context(
+            httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=120)
+        )
+        round_trips = lambda: getattr(driver, "round_trips", None)
+        corpus = synthetic_corpus(config)
+        seed = [("POST", "/ingest_conversation", {"json": item}) for item in corpus]
+        report = {"seed": await drive(client, seed, config.concurrency, round_trips)}
+        # Seeded apart from the corpus so new conversation ids never collide with ingested ones
+        rng = random.Random(config.seed + 1)
+        for scenario in config.scenarios:
+            report[scenario] = await drive(client, _requests(scenario, config, corpus, rng), config.concurrency, round_trips)
+        report["llm"] = {"requests": server.stats.requests, "errors": server.stats.errors, "by_path": server.stats.by_path}
+    return report
+
+
+def regressions(report: dict, baseline: dict, threshold: float) -> list[str]:
+    """
+    Scenarios whose p95 or round trips grew, or whose throughput fell, by more than `threshold`.
+    """
+    problems = []
+    for scenario, current in report.items():
+        before = baseline.get("results", baseline).get(scenario)
+        if not before or "p95_ms" not in current:
+            continue
+        for key, worse in (("p95_ms", 1), ("round_trips_per_request", 1), ("throughput_rps", -1)):
+            old, new = before.get(key), current.get(key)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * worse
+            if change > threshold:
+                problems.append(f"{scenario}: {key} {old} -> {new} ({change:+.0%})")
+    return problems
+
+
+def print_report(report: dict) -> None:
+    print(f"{'scenario':<20}{'req':>6}{'err':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}{'bolt/req':>10}")
+    for scenario, stats in report.items():
+        if "p95_ms" not in stats:
+            continue
+        cells = [stats[k] if stats[k] is not None else "-" for k in
+                 ("p50_ms", "p95_ms", "p99_ms", "throughput_rps", "round_trips_per_request")]
+        print(f"{scenario:<20}{stats['requests']:>6}{stats['errors']:>6}" + "".join(f"{c:>10}" for c in cells))
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    defaults = BenchConfig()
+    for name in ("users", "conversations", "turns", "requests", "concurrency", "seed"):
+        parser.add_argument(f"--{name}", type=int, default=getattr(defaults, name))
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0)
+    parser.add_argument("--llm-tokens-per-sec", type=float, default=0.0)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--neo4j-rtt-ms", type=float, default=0.5, help="simulated round trip of the stand-in")
+    parser.add_argument("--neo4j-uri", default=None, help="benchmark against this Neo4j instead of the stand-in")
+    parser.add_argument("--neo4j-container", action="store_true", help="start a Neo4j testcontainer")
+    parser.add_argument("--save-baseline", default=None, metavar="PATH")
+    parser.add_argument("--compare", default=None, metavar="PATH", help="baseline to check against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed relative regression")
+    args = parser.parse_args()
+
+    config = BenchConfig(
+        users=args.users, conversations=args.conversations, turns=args.turns, requests=args.requests,
+        concurrency=args.concurrency, scenarios=tuple(s for s in args.scenarios.split(",") if s),
+        llm_latency_ms=args.llm_latency_ms, llm_tokens_per_sec=args.llm_tokens_per_sec,
+        llm_error_rate=args.llm_error_rate, neo4j_rtt_ms=args.neo4j_rtt_ms, seed=args.seed,
+    )
+    unknown = set(config.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    async with AsyncExitStack() as stack:
+        neo4j_driver = None
+        uri, auth = args.neo4j_uri, (os.getenv("NEO4J_USER", "neo4j"), os.getenv("NEO4J_PASSWORD", "neo4j"))
+        if args.neo4j_container:
+            from testcontainers.neo4j import Neo4jContainer
+            container = stack.enter_context(Neo4jContainer("neo4j:5"))
+            uri, auth = container.get_connection_url(), ("neo4j", container.password)
+        if uri:
+            from neo4j import AsyncGraphDatabase
+            from app import schema
+            real = AsyncGraphDatabase.driver(uri, auth=auth)
+            await schema.ensure_schema(real)
+            neo4j_driver = _counting(real)
+        report = await run_benchmark(config, neo4j_driver)
+
+    print_report(report)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump({"config": asdict(config), "results": report}, f, indent=2)
+        print(f"Baseline written to {args.save_baseline}")
+    if args.compare:
+        with open(args.compare) as f:
+            problems = regressions(report, json.load(f), args.threshold)
+        if problems:
+            print("Regressions over threshold:")
+            for problem in problems:
+                print(f"  {problem}")
+            return 1
+        print(f"No regressions over {args.threshold:.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,250 @@
+"""
+In-memory stand-in for the async Neo4j driver, used by the benchmarks when no database is given.
+
+It understands the statement shapes issued by app.graphiti_client: Episode, batch and
+relation writes, Episode state, ranked preferences (one user or a batch), recent ids/conversations/summaries,
+conversation pages and the profile document (read, rebuild and write). Anything else (schema statements) succeeds with no records. Every
+statement costs one round trip, and a managed transaction costs two more (BEGIN/COMMIT).
+Each round trip sleeps `rtt` seconds, so Bolt chatter shows up in latency as it would
+against a real server.
+"""
+import asyncio
+import math
+import re
+from datetime import datetime, timezone
+
+
+class StandInResult:
+    def __init__(self, records: list[dict] | None = None):
+        self._records = records or []
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for record in self._records:
+            yield record
+
+    async def single(self):
+        return self._records[0] if self._records else None
+
+    async def data(self):
+        return list(self._records)
+
+    async def consume(self):
+        return None
+
+
+class StandInGraph:
+    """
+    Users, Episodes and user->object edges, enough to answer the service's queries.
+    """
+
+    def __init__(self):
+        self.episodes: dict[str, dict] = {}
+        self.owner: dict[str, str] = {}
+        # (label, key) -> name the object node was created with
+        self.objects: dict[tuple[str, str], str] = {}
+        # uid -> (label, rel_type, key) -> edge counters
+        self.edges: dict[str, dict[tuple[str, str, str], dict]] = {}
+        # uid -> {"profile", "etag", "version"}
+        self.users: dict[str, dict] = {}
+
+    def user(self, uid: str) -> dict:
+        return self.users.setdefault(uid, {"profile": None, "etag": None, "version": 0})
+
+    def write_episode(self, uid: str, row: dict) -> bool:
+        created = row["episode_id"] not in self.episodes
+        episode = self.episodes.setdefault(row["episode_id"], {"id": row["episode_id"]})
+        episode.setdefault("created_at", row.get("created_at") or datetime.now(timezone.utc))
+        episode.update({
+            "conversation_z": row.get("conv_z"), "conversation": row.get("conv_legacy"),
+            "conversation_bytes": row.get("conv_bytes"), "summary": row.get("summary"),
+            "updated_at": row.get("updated_at") or datetime.now(timezone.utc),
+            "revision": episode.get("revision", 0) + 1,
+        })
+        for key in ("content_hash", "turn_count", "relations"):
+            if row.get(key) is not None:
+                episode[key] = row[key]
+        self.owner.setdefault(row["episode_id"], uid)
+        self.user(uid)
+        return created
+
+    def write_edge(self, uid: str, label: str, rel_type: str, obj: dict, rank: float, seen=None) -> dict:
+        name = self.objects.setdefault((label, obj["key"]), obj["name"])
+        edge = self.edges.setdefault(uid, {}).setdefault((label, rel_type, obj["key"]), {"count": 0, "rank": None, "last_seen": None})
+        edge["count"] += 1
+        # Same log-add-exp fold as the Cypher edge counters
+        high, low = max(edge["rank"] or rank, rank), min(edge["rank"] or rank, rank)
+        edge["rank"] = rank if edge["count"] == 1 else high + math.log1p(math.exp(low - high))
+        if seen is not None and (edge["last_seen"] is None or edge["last_seen"] < seen):
+            edge["last_seen"] = seen
+        return {"uid": uid, "name": name, "count": edge["count"], "rank": edge["rank"], "last_seen": edge["last_seen"]}
+
+    def lock_and_read(self, uid: str, episode: dict | None, created: bool) -> dict:
+        user = self.user(uid)
+        user["version"] += 1
+        return {"uid": uid, "profile": user["profile"], "version": user["version"], "created": created,
+                "episode_id": episode and episode["id"], "created_at": episode and episode["created_at"],
+                "updated_at": episode and episode["updated_at"], "revision": episode and episode.get("revision"),
+                "summary": episode and episode["summary"]}
+
+    def profile_source(self, uid: str, n: int) -> dict:
+        episodes = self.user_episodes(uid)
+        return {
+            "uid": uid, "version": self.user(uid)["version"], "episode_count": len(episodes),
+            "episodes": [{k: e.get(k) for k in ("id", "created_at", "updated_at", "revision", "summary")} for e in episodes[:n]],
+            "edges": [{"labels": [label], "type": rel_type, "name": self.objects[(label, key)], **edge}
+                      for (label, rel_type, key), edge in self.edges.get(uid, {}).items()],
+        }
+
+    def user_episodes(self, uid: str) -> list[dict]:
+        episodes = [e for episode_id, e in self.episodes.items() if self.owner.get(episode_id) == uid]
+        return sorted(episodes, key=lambda e: (e["created_at"], e["id"]), reverse=True)
+
+
+def _label_and_type(query: str) -> tuple[str, str]:
+    return re.search(r"\(o:`(\w+)`", query).group(1), re.search(r"\[r:`(\w+)`\]", query).group(1)
+
+
+class StandInTx:
+    def __init__(self, session: "StandInSession"):
+        self._session = session
+
+    async def run(self, query: str, **params) -> StandInResult:
+        await self._session.round_trip()
+        return StandInResult(self._session.driver.execute(query, params))
+
+
+class StandInSession:
+    def __init__(self, driver: "StandInDriver"):
+        self.driver = driver
+
+    async def round_trip(self) -> None:
+        self.driver.round_trips += 1
+        if self.driver.rtt:
+            await asyncio.sleep(self.driver.rtt)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def run(self, query: str, **params) -> StandInResult:
+        return await StandInTx(self).run(query, **params)
+
+    async def _transaction(self, fn, *args, **kwargs):
+        # BEGIN and COMMIT
+        await self.round_trip()
+        try:
+            return await fn(StandInTx(self), *args, **kwargs)
+        finally:
+            await self.round_trip()
+
+    execute_read = _transaction
+    execute_write = _transaction
+
+    async def close(self) -> None:
+        return None
+
+
+class StandInDriver:
+    def __init__(self, rtt: float = 0.0):
+        self.rtt = rtt
+        self.round_trips = 0
+        self.graph = StandInGraph()
+
+    def session(self, **kwargs) -> StandInSession:
+        return StandInSession(self)
+
+    async def verify_connectivity(self) -> None:
+        await StandInSession(self).round_trip()
+
+    async def close(self) -> None:
+        return None
+
+    def execute(self, query: str, params: dict) -> list[dict]:
+        graph = self.graph
+        profile = "u.profile_version" in query
+        if "UNWIND $episodes AS ep" in query:
+            rows = []
+            for ep in params["episodes"]:
+                created = graph.write_episode(ep["uid"], ep)
+                rows.append(graph.lock_and_read(ep["uid"], graph.episodes[ep["episode_id"]], created))
+            return rows if profile else []
+        if "MERGE (e:Episode {id: $episode_id})" in query:
+            created = graph.write_episode(params["uid"], params)
+            return [graph.lock_and_read(params["uid"], graph.episodes[params["episode_id"]], created)] if profile else []
+        if "SET e.summary = coalesce($summary, e.summary)" in query:
+            episode = graph.episodes.get(params["episode_id"])
+            if episode is None:
+                return []
+            for key in ("summary", "content_hash", "turn_count", "relations"):
+                if params.get(key) is not None:
+                    episode[key] = params[key]
+            return [graph.lock_and_read(params["uid"], episode, False)] if profile else []
+        if "UNWIND $objects AS obj" in query:
+            label, rel_type = _label_and_type(query)
+            return [graph.write_edge(params["uid"], label, rel_type, obj, params["rank"], params["seen"])
+                    for obj in params["objects"]]
+        if "UNWIND $rows AS row" in query and "row.uid" in query:
+            label, rel_type = _label_and_type(query)
+            return [graph.write_edge(row["uid"], label, rel_type, row, row["rank"], row["seen"])
+                    for row in params["rows"]]
+        if "UNWIND $profiles AS p" in query:
+            for row in params["profiles"]:
+                graph.user(row["uid"]).update(profile=row["doc"], etag=row["etag"])
+            return []
+        if "AS episode_count" in query:
+            return [graph.profile_source(uid, params["episodes"]) for uid in params["uids"] if uid in graph.users]
+        if profile:
+            uid = params["uid"]
+            if uid not in graph.users and "MERGE" not in query:
+                return []
+            return [graph.lock_and_read(uid, None, False)]
+        if "u.profile AS profile" in query:
+            uids = params["uids"] if "uids" in params else [params["uid"]]
+            return [{"uid": uid, "profile": graph.users[uid]["profile"], "etag": graph.users[uid]["etag"]}
+                    for uid in uids if uid in graph.users]
+        if "MATCH (e:Episode {id: $episode_id})" in query:
+            episode = graph.episodes.get(params["episode_id"])
+            if episode is None:
+                return []
+            return [{"uid": graph.owner.get(episode["id"]), **{k: episode.get(k) for k in
+                     ("content_hash", "turn_count", "updated_at", "summary", "relations")}}]
+        if "UNWIND $uids AS uid" in query:
+            return [{"uid": uid, "names": [row["name"] for row in self.execute(
+                "ORDER BY rank DESC", {**params, "uid": uid})]} for uid in params["uids"]]
+        if "ORDER BY rank DESC" in query:
+            ranked: dict[str, float] = {}
+            for (label, rel_type, key), edge in graph.edges.get(params["uid"], {}).items():
+                name = graph.objects[(label, key)]
+                if rel_type in params["relations"] or label in params["labels"]:
+                    ranked[name] = max(ranked.get(name, float("-inf")), edge["rank"] or 0.0)
+            return [{"name": name} for name, _ in sorted(ranked.items(), key=lambda kv: -kv[1])[:params["k"]]]
+        if "AS bytes" in query:
+            episodes = graph.user_episodes(params["uid"])
+            if params.get("cursor_at") is not None:
+                at = datetime.fromisoformat(params["cursor_at"].replace("Z", "+00:00"))
+                episodes = [e for e in episodes if (e["created_at"], e["id"]) < (at, params["cursor_id"])]
+            return [{"id": e["id"], "created_at": e["created_at"], "updated_at": e["updated_at"],
+                     "turn_count": e["turn_count"], "bytes": e["conversation_bytes"],
+                     "stored": e["conversation_z"] or e["conversation"]} for e in episodes[:params["n"]]]
+        if "RETURN e.id AS id, e.revision AS revision ORDER BY e.created_at DESC" in query:
+            return [{"id": e["id"], "revision": e.get("revision")} for e in graph.user_episodes(params["uid"])[:params["n"]]]
+        if "e.id IN $ids" in query:
+            rows = []
+            for episode_id in params["ids"]:
+                e = graph.episodes.get(episode_id)
+                if e is None:
+                    continue
+                stored = e["conversation_z"] or e["conversation"]
+                rows.append({"id": e["id"], "uid": graph.owner.get(e["id"]), "summary": e["summary"],
+                             "conv_json": stored if e["summary"] is None or "AS summary" not in query else None})
+            return rows
+        if "AS conv_json ORDER BY e.created_at DESC" in query:
+            return [{"conv_json": e["conversation_z"] or e["conversation"]}
+                    for e in graph.user_episodes(params["uid"])[:params["n"]]]
+        return []
+
@@ -1,6 +1,80 @@
+import json
+import re
 import sys
+import threading
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
+import pytest
 
 # Add project root to PYTHONPATH to ensure imports work during tests
 project_root = Path(__file__).parent.parent.resolve()
-sys.path.insert(0, str(project_root)) 
\ No newline at end of file
+sys.path.insert(0, str(project_root))
+
+STUB_EMBEDDING_DIMENSIONS = 64
+
+
+def stub_embedding(text: str) -> list[float]:
+    """
+    Deterministic bag-of-words vector: texts that share words have positive cosine similarity.
+    """
+    vector = [0.0] * STUB_EMBEDDING_DIMENSIONS
+    for word in re.findall(r"\w+", text.lower()):
+        vector[zlib.crc32(word.encode()) % STUB_EMBEDDING_DIMENSIONS] += 1.0
+    return vector
+
+
+@pytest.fixture
+def embedding_server():
+    """
+    Local OpenAI-compatible /v1/embeddings server; yields (base_url, list of received batches).
+    """
+    batches = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            if not self.path.endswith("/embeddings"):
+                self.send_response(404)
+                self.end_headers()
+                return
+            inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+            batches.append(inputs)
+            data = [{"object": "embedding", "index": i, "embedding": stub_embedding(text)} for i, text in enumerate(inputs)]
+            payload = json.dumps({"object": "list", "data": data, "model": body.get("model")}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}/v1", batches
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def stub_embeddings(monkeypatch, embedding_server):
+    """
+    Point app.embeddings at the stub server with a fresh cache and local vector index.
+    """
+    from app import embeddings
+    from app.llm import LLMClient
+    base_url, batches = embedding_server
+    monkeypatch.setattr(embeddings, "llm", LLMClient(base_url=base_url, api_key="sk-test", model="chat-model"))
+    monkeypatch.setattr(embeddings, "EMBEDDING_MODEL_NAME", "stub-embedding")
+    monkeypatch.setattr(embeddings, "embedding_cache", embeddings.EmbeddingCache())
+    monkeypatch.setattr(embeddings, "vector_index", embeddings.LocalVectorIndex())
+
+    async def no_graph_objects(uid, limit):
+        return []
+    monkeypatch.setattr("app.graphiti_client.get_ranked_preferences", no_graph_objects)
+    return embeddings, batches
@@ -0,0 +1,139 @@
+import asyncio
+import json
+import os
+import pytest
+from app import episode_store
+from app.archive import SegmentStore, ArchiveLockedError
+from app.retention import Retention
+
+
+def _records(n, start=0):
+    return [{"id": f"e{i}", "uid": "u1", "conversation": json.dumps([{"role": "user", "content": f"turn {i}"}])}
+            for i in range(start, start + n)]
+
+
+def test_archived_transcripts_rehydrate_through_resolve(tmp_path, monkeypatch):
+    store = SegmentStore(str(tmp_path))
+    monkeypatch.setattr("app.archive.archive_store", store)
+    refs = store.append(_records(3))
+    assert all(ref.startswith(episode_store.ARCHIVE_PREFIX) for ref in refs)
+    inline = episode_store.pack(json.dumps([{"role": "user", "content": "live"}]))["conv_z"]
+    texts = asyncio.run(episode_store.resolve([refs[1], inline, None]))
+    assert [json.loads(text) if text else text for text in texts] == [
+        [{"role": "user", "content": "turn 1"}], [{"role": "user", "content": "live"}], None]
+    # A purged segment degrades to a missing transcript for that Episode only
+    missing = refs[0].replace("segment-000001", "segment-000099")
+    assert asyncio.run(episode_store.resolve([missing, refs[2]]))[0] is None
+    assert [entry["id"] for entry in store.index(store.segments()[0])] == ["e0", "e1", "e2"]
+    # A second writer is refused while the first holds the lock
+    with pytest.raises(ArchiveLockedError):
+        SegmentStore(str(tmp_path)).append(_records(1))
+    store.release()
+
+
+def test_segments_rotate_and_sparse_ones_are_compacted(tmp_path):
+    store = SegmentStore(str(tmp_path), segment_bytes=200)
+    refs = store.append(_records(4)) + store.append(_records(4, start=4)) + store.append(_records(1, start=8))
+    assert len(store.segments()) == 3
+    first = store.segments()[0]
+    # Only e1 still points into the first segment; the others were re-ingested since
+    live = {refs[1]}
+    moved = []
+
+    class Session:
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            return False
+
+        async def execute_write(self, fn, rows):
+            moved.extend(rows)
+            return len(rows)
+
+    class Driver:
+        def session(self):
+            return Session()
+
+    class Job(Retention):
+        async def live_refs(self, driver, entries):
+            return {entry["ref"] for entry in entries if entry["ref"] in live or not entry["ref"].startswith(f"archive:{first}")}
+
+    report = asyncio.run(Job(store, retire_grace=3600).compact(Driver()))
+    assert report["compacted"] == 1 and report["records_moved"] == 1 and report["records_dropped"] == 3
+    assert first not in store.segments()
+    assert [row["id"] for row in moved] == ["e1"]
+    assert json.loads(store.read(moved[0]["new"]))[0]["content"] == "turn 1"
+    # The retired file still serves pointers read before the swap, until purged
+    assert json.loads(store.read(refs[1]))[0]["content"] == "turn 1"
+    assert store.purge_retired(0) == 1
+    assert not any(name.endswith(".retired") for name in os.listdir(tmp_path))
+    store.release()
+
+
+def test_archive_pass_reads_keep_boundaries_once_and_pages_users(tmp_path):
+    store = SegmentStore(str(tmp_path))
+    boundaries = [{"uid": f"u{i}", "boundary": "2025-01-01"} for i in range(5)]
+    pending = {f"u{i}": [f"e{i}a", f"e{i}b"] for i in range(5)}
+    calls = []
+
+    class Tx:
+        async def run(self, query, **params):
+            calls.append(query)
+
+            class Result:
+                def __init__(self, rows):
+                    self.rows = rows
+
+                def __aiter__(self):
+                    return self._iterate()
+
+                async def _iterate(self):
+                    for row in self.rows:
+                        yield row
+
+                async def single(self):
+                    return self.rows[0]
+            if query.startswith("MATCH (u:User) CALL"):
+                return Result(boundaries)
+            if "UNWIND $boundaries" in query:
+                rows = [{"id": e, "uid": b["uid"], "revision": 1, "stored": "[]"}
+                        for b in params["boundaries"] for e in pending[b["uid"]]][:params["limit"]]
+                return Result(rows)
+            # The swap is guarded by the revision the candidate was read at
+            assert "coalesce(e.revision, 0) = row.revision" in query
+            assert all(row["revision"] == 1 for row in params["rows"])
+            for row in params["rows"]:
+                pending["u" + row["id"][1:-1]].remove(row["id"])
+            return Result([{"archived": len(params["rows"])}])
+
+    class Session:
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            return False
+
+        async def execute_read(self, fn, *args):
+            return await fn(Tx(), *args)
+
+        execute_write = execute_read
+
+    class Driver:
+        def session(self):
+            return Session()
+
+    report = asyncio.run(Retention(store, after_days=0, keep_recent=3, batch_size=4).archive(Driver()))
+    assert report["archived"] == 10
+    assert sum(query.startswith("MATCH (u:User) CALL") for query in calls) == 1
+    store.release()
+
+
+def test_active_segment_is_never_retired(tmp_path):
+    store = SegmentStore(str(tmp_path), segment_bytes=200)
+    store.append(_records(4))
+    store.append(_records(4, start=4))
+    sealed, active = store.segments()
+    assert store.retire(active) is False
+    assert store.retire(sealed) is True and store.segments() == [active]
+    store.release()
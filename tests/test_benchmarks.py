@@ -0,0 +1,31 @@
+import asyncio
+from loguru import logger
+from benchmarks.load import BenchConfig, run_benchmark, regressions, SCENARIOS
+
+
+def test_load_benchmark_runs_every_scenario_against_stand_ins(monkeypatch):
+    from app.cache import SummaryCache
+    # Keep the benchmark's cache traffic out of the process-wide summary cache counters
+    cache = SummaryCache()
+    monkeypatch.setattr("app.routes.content.summary_cache", cache)
+    monkeypatch.setattr("app.graphiti_client.summary_cache", cache)
+    logger.disable("app")
+    try:
+        report = asyncio.run(run_benchmark(BenchConfig(users=3, conversations=2, requests=12, concurrency=4)))
+    finally:
+        logger.enable("app")
+    for scenario in ("seed",) + SCENARIOS:
+        stats = report[scenario]
+        assert stats["errors"] == 0, scenario
+        assert stats["p50_ms"] <= stats["p95_ms"] <= stats["p99_ms"]
+        assert stats["throughput_rps"] > 0
+    # One write transaction per ingest at most: BEGIN/COMMIT, the Episode and one UNWIND per group
+    assert report["get_conversations"]["round_trips_per_request"] == 3
+    assert report["llm"]["by_path"]["/chat/completions"] > 0
+
+
+def test_regression_check_flags_slower_or_chattier_scenarios():
+    baseline = {"results": {"ingest": {"p95_ms": 100, "throughput_rps": 50, "round_trips_per_request": 6}}}
+    assert regressions({"ingest": {"p95_ms": 110, "throughput_rps": 48, "round_trips_per_request": 6}}, baseline, 0.2) == []
+    problems = regressions({"ingest": {"p95_ms": 150, "throughput_rps": 30, "round_trips_per_request": 9}}, baseline, 0.2)
+    assert [p.split(" ")[1] for p in problems] == ["p95_ms", "round_trips_per_request", "throughput_rps"]
@@ -0,0 +1,93 @@
+import json
+import pytest
+from fastapi.testclient import TestClient
+from app.main import app
+from app.backfill import Checkpoint, iter_source
+import app.graphiti_client as gc
+
+client = TestClient(app)
+
+
+def _conversation(i):
+    return {
+        "uid": f"user{i % 2}",
+        "conversation": [{"speaker": "User", "text": f"I enjoy hobby {i}"}],
+        "conversation_id": f"conv{i}",
+        "created_at": "2025-06-02T12:00:00Z",
+        "updated_at": "2025-06-02T12:00:00Z",
+    }
+
+
+@pytest.fixture
+def batches(monkeypatch):
+    written = []
+
+    async def plan_episode(uid, conv, conversation_id=None, created_at=None, updated_at=None):
+        mode = "unchanged" if conversation_id == "conv3" else "new"
+        return gc.EpisodePlan(episode_id=conversation_id, mode=mode, content_hash="h", turn_count=len(conv))
+
+    async def extract_episode(uid, conv, plan=None):
+        return {("Activity", "ENJOYS"): [conv[0]["text"]]}, None
+
+    async def write_episode_batch(items):
+        written.append([item["conversation_id"] for item in items])
+        return len(items)
+
+    monkeypatch.setattr(gc, "plan_episode", plan_episode)
+    monkeypatch.setattr(gc, "extract_episode", extract_episode)
+    monkeypatch.setattr(gc, "write_episode_batch", write_episode_batch)
+    return written
+
+
+def test_bulk_ndjson_streams_per_item_results(batches):
+    lines = [json.dumps(_conversation(i)) for i in range(5)]
+    lines.insert(2, '{"uid": "broken"}')
+    response = client.post(
+        "/ingest_conversations:bulk?batch_size=2&concurrency=3",
+        content="\n".join(lines) + "\n",
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    assert response.status_code == 200
+    results = [json.loads(line) for line in response.text.splitlines()]
+    assert len(results) == 6
+    by_index = {r["index"]: r for r in results}
+    assert by_index[2]["status"] == "error"
+    assert all(by_index[i]["status"] == "ok" for i in (0, 1, 3, 5))
+    # An unchanged re-post is reported and not written again
+    assert by_index[4]["status"] == "skipped" and by_index[4]["reason"] == "unchanged"
+    # The other valid conversations written in cross-conversation batches of at most two
+    assert sorted(sum(batches, [])) == ["conv0", "conv1", "conv2", "conv4"]
+    assert all(len(batch) <= 2 for batch in batches)
+
+
+def test_bulk_pipeline_pauses_for_a_slow_reader(batches):
+    import asyncio
+    from app.bulk_ingest import ingest_stream
+
+    async def items():
+        for i in range(100):
+            yield _conversation(i)
+
+    async def read_one_then_stall():
+        stream = ingest_stream(items(), concurrency=2, batch_size=1)
+        await stream.__anext__()
+        await asyncio.sleep(0.05)
+        await stream.aclose()
+    asyncio.run(read_one_then_stall())
+    # At most a few results are queued and in flight, not the whole input
+    assert len(batches) <= 10
+
+
+def test_checkpoint_watermark_and_sources(tmp_path):
+    path = tmp_path / "run.ckpt"
+    checkpoint = Checkpoint(path)
+    for index in (1, 0, 3):
+        checkpoint.mark(index)
+    assert checkpoint.done == 2
+    checkpoint.save()
+    assert Checkpoint(path).done == 2
+
+    (tmp_path / "a.json").write_text(json.dumps(_conversation(0)))
+    (tmp_path / "b.jsonl").write_text(json.dumps(_conversation(1)) + "\n\n" + json.dumps(_conversation(2)) + "\n")
+    docs = [json.loads(doc)["conversation_id"] for doc in iter_source(tmp_path)]
+    assert docs == ["conv0", "conv1", "conv2"]
@@ -0,0 +1,79 @@
+import asyncio
+import json
+import time
+import httpx
+from app.main import app
+import app.graphiti_client as gc
+
+# Simulated latency of every Neo4j query and LLM call
+LATENCY = 0.2
+REQUESTS = 20
+
+
+class FakeResult:
+    def __init__(self, records):
+        self._records = records
+
+    async def __aiter__(self):
+        for record in self._records:
+            yield record
+
+    async def single(self):
+        return self._records[0] if self._records else None
+
+
+class FakeTx:
+    async def run(self, query, **params):
+        await asyncio.sleep(LATENCY)
+        if ":CREATED]->(e:Episode)" in query:
+            conv_json = json.dumps([{"speaker": "User", "text": "hi"}])
+            return FakeResult([{"id": "ep1", "created_at": None, "updated_at": None, "turn_count": 1,
+                                "bytes": len(conv_json), "stored": conv_json}])
+        if "u.profile AS profile" in query:
+            profile = {"preferences": {"Activity": [{"name": "hiking", "count": 1, "rank": 1.0, "last_seen": None}]}}
+            return FakeResult([{"profile": json.dumps(profile), "etag": '"1"'}])
+        return FakeResult([{"name": "hiking"}])
+
+
+class FakeSession:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute_read(self, fn, *args):
+        return await fn(FakeTx(), *args)
+
+
+class FakeDriver:
+    def session(self, **kwargs):
+        return FakeSession()
+
+
+def test_overlapping_requests_do_not_block_each_other(monkeypatch):
+    monkeypatch.setattr(gc, "driver", FakeDriver())
+
+    async def slow_generate(preferences):
+        await asyncio.sleep(LATENCY)
+        return f"question about {preferences[0]}"
+    monkeypatch.setattr(gc, "generate_next_question", slow_generate)
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            calls = []
+            for i in range(REQUESTS):
+                if i % 2:
+                    calls.append(client.post("/next_question", json={"uid": f"u{i}", "num_preferences": 3}))
+                else:
+                    calls.append(client.get("/get_conversations", params={"uid": f"u{i}", "n": 1}))
+            start = time.perf_counter()
+            responses = await asyncio.gather(*calls)
+            return time.perf_counter() - start, responses
+
+    elapsed, responses = asyncio.run(run())
+    assert all(r.status_code == 200 for r in responses)
+    assert responses[1].json() == {"question": "question about hiking"}
+    # Serialized on the event loop this would take REQUESTS * LATENCY (4s) or more
+    assert elapsed < REQUESTS * LATENCY / 4
@@ -0,0 +1,105 @@
+import asyncio
+import gc as garbage
+import json
+import tracemalloc
+import pytest
+from loguru import logger
+import app.graphiti_client as gc
+from app.conversation_cache import MemoryConversationCache, SQLiteConversationCache
+
+
+def _conv(i, size=200):
+    return [{"speaker": "User", "text": f"conversation {i} " + "x" * size}]
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_cache(request, tmp_path):
+    def make(**kwargs):
+        if request.param == "sqlite":
+            return SQLiteConversationCache(str(tmp_path / "conversations.sqlite3"), **kwargs)
+        return MemoryConversationCache(**kwargs)
+    return make
+
+
+def test_ring_depth_and_in_place_updates(make_cache):
+    cache = make_cache(max_bytes=1_000_000, depth=3)
+    for i in range(5):
+        cache.put("u1", f"ep{i}", _conv(i))
+    cache.put("u1", "ep3", _conv(33))
+    recent = [json.loads(doc)[0]["text"].split()[1] for doc in cache.recent("u1", 10)]
+    # An updated conversation becomes the newest of its user's ring
+    assert recent == ["33", "4", "2"]
+    assert cache.recent("nobody", 1) == []
+    stats = cache.stats()
+    assert (stats["entries"], stats["ring_drops"], stats["hits"], stats["misses"]) == (3, 2, 1, 1)
+
+
+def test_budget_evicts_least_recently_used_user_first(make_cache):
+    one = len(json.dumps(_conv(0), separators=(",", ":")))
+    cache = make_cache(max_bytes=one * 4, depth=10)
+    for uid in ("a", "b"):
+        cache.put(uid, "ep1", _conv(1))
+        cache.put(uid, "ep2", _conv(2))
+    cache.recent("a", 1)  # "a" is now more recently used than "b"
+    cache.put("c", "ep1", _conv(1))
+    assert len(cache.recent("b", 10)) == 1
+    assert len(cache.recent("a", 10)) == 2
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["resident_bytes"] <= stats["max_bytes"]
+
+
+def test_sqlite_backend_is_shared_between_workers(tmp_path):
+    path = str(tmp_path / "shared.sqlite3")
+    worker_a = SQLiteConversationCache(path, max_bytes=1_000_000, depth=5)
+    worker_b = SQLiteConversationCache(path, max_bytes=1_000_000, depth=5)
+    worker_a.put("u1", "ep1", _conv(1))
+    assert json.loads(worker_b.recent("u1", 1)[0]) == _conv(1)
+
+
+def test_sqlite_running_total_tracks_resident_bytes(tmp_path):
+    cache = SQLiteConversationCache(str(tmp_path / "totals.sqlite3"), max_bytes=2000, depth=3)
+    for i in range(12):
+        asyncio.run(cache.put_async(f"u{i % 3}", f"ep{i % 5}", _conv(i, size=50 + i * 10)))
+    actual = cache._connect().execute("SELECT coalesce(sum(size), 0) FROM conversations").fetchone()[0]
+    assert cache.stats()["resident_bytes"] == actual <= 2000
+
+
+def test_memory_stays_flat_under_ingest_soak(monkeypatch):
+    cache = MemoryConversationCache(max_bytes=256 * 1024, depth=5)
+    monkeypatch.setattr(gc, "conversation_cache", cache)
+
+    async def plan_episode(uid, conv, conversation_id=None, created_at=None, updated_at=None):
+        return gc.EpisodePlan(episode_id=conversation_id, mode="new", content_hash="h", turn_count=len(conv))
+
+    async def extract_episode(uid, conv, plan=None):
+        return {}, None
+
+    async def write_episode(*args, **kwargs):
+        return 0
+
+    monkeypatch.setattr(gc, "plan_episode", plan_episode)
+    monkeypatch.setattr(gc, "extract_episode", extract_episode)
+    monkeypatch.setattr(gc, "_write_episode", write_episode)
+
+    async def soak(start, count):
+        for i in range(start, start + count):
+            await gc.add_episode(f"user{i % 500}", _conv(i, size=500), conversation_id=f"conv{i}")
+
+    logger.disable("app")
+    tracemalloc.start()
+    try:
+        asyncio.run(soak(0, 1000))
+        garbage.collect()
+        warm, _ = tracemalloc.get_traced_memory()
+        asyncio.run(soak(1000, 5000))
+        garbage.collect()
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        logger.enable("app")
+    stats = cache.stats()
+    assert stats["resident_bytes"] <= 256 * 1024
+    assert stats["evictions"] > 0
+    # Five times more conversations ingested, but memory does not grow with them
+    assert after - warm < 256 * 1024
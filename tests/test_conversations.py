@@ -0,0 +1,99 @@
+import json
+import zlib
+import pytest
+from fastapi.testclient import TestClient
+from app.main import app
+from app import episode_store
+import app.graphiti_client as gc
+
+client = TestClient(app)
+
+CONV = [{"speaker": "User", "text": "I love hiking"}, {"speaker": "Assistant", "text": "Where?"},
+        {"speaker": "User", "text": "In the Alps"}]
+
+
+def test_pack_and_unpack_read_compressed_and_legacy_rows():
+    conv_json = json.dumps(CONV)
+    packed = episode_store.pack(conv_json)
+    assert packed["conv_legacy"] is None
+    assert packed["conv_bytes"] == len(conv_json.encode())
+    assert zlib.decompress(packed["conv_z"]).decode() == conv_json
+    assert episode_store.unpack(packed["conv_z"]) == conv_json
+    # Rows written before compression keep a plain JSON string
+    assert episode_store.unpack(conv_json) == conv_json
+    assert episode_store.unpack(None) is None
+
+
+def test_cursor_round_trip_and_rejects_garbage():
+    cursor = episode_store.encode_cursor("2026-01-02T03:04:05Z", "ep-1")
+    assert episode_store.decode_cursor(cursor) == ("2026-01-02T03:04:05Z", "ep-1")
+    with pytest.raises(ValueError):
+        episode_store.decode_cursor("not-a-cursor")
+
+
+@pytest.fixture
+def paged_episodes(monkeypatch):
+    # Five Episodes, newest first; the stored text is deliberately not in json.dumps' format
+    rows = [
+        {"id": f"ep{i}", "created_at": f"2026-01-0{i}T00:00:00Z", "updated_at": None, "turn_count": 3,
+         "bytes": 0, "conversation": json.dumps(CONV, indent=1), "cursor": f"c{i}"}
+        for i in range(5, 0, -1)
+    ]
+    calls = []
+
+    async def page(uid, n, cursor=None):
+        calls.append((n, cursor))
+        start = 0 if cursor is None else next(i for i, row in enumerate(rows) if row["cursor"] == cursor) + 1
+        chunk = rows[start:start + n]
+        return chunk, (chunk[-1]["cursor"] if len(chunk) == n and start + n < len(rows) else None)
+    monkeypatch.setattr(gc, "get_conversation_page", page)
+    monkeypatch.setattr(episode_store, "decode_cursor", lambda cursor: (cursor, cursor))
+    return rows, calls
+
+
+def test_get_conversations_pages_with_cursor(paged_episodes):
+    rows, _ = paged_episodes
+    first = client.get("/get_conversations", params={"uid": "u1", "n": 2})
+    assert first.status_code == 200
+    assert first.json()["conversations"] == [CONV, CONV]
+    # Stored JSON is passed through verbatim
+    assert rows[0]["conversation"] in first.text
+    second = client.get("/get_conversations", params={"uid": "u1", "n": 2, "cursor": first.json()["next_cursor"],
+                                                      "fields": "id,turn_count", "turns": "-1:"})
+    assert second.json() == {"conversations": [{"id": "ep3", "turn_count": 3}, {"id": "ep2", "turn_count": 3}],
+                             "next_cursor": "c2"}
+    projected = client.get("/get_conversations", params={"uid": "u1", "fields": "id,conversation", "turns": "-1:"})
+    assert projected.json()["conversations"] == [{"id": "ep5", "conversation": CONV[-1:]}]
+    assert client.get("/get_conversations", params={"uid": "u1", "fields": "id,secret"}).status_code == 422
+
+
+def test_get_conversations_streams_ndjson(paged_episodes, monkeypatch):
+    import app.routes.conversation_summary as route
+    monkeypatch.setattr(route, "NDJSON_PAGE_SIZE", 2)
+    _, calls = paged_episodes
+    response = client.get("/get_conversations", params={"uid": "u1", "n": 10, "format": "ndjson", "fields": "id"})
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["id"] for line in lines] == ["ep5", "ep4", "ep3", "ep2", "ep1"]
+    assert lines[0]["cursor"] == "c5"
+    assert calls == [(2, None), (2, "c4"), (2, "c2")]
+
+
+def test_pages_continue_across_naive_client_timestamps(monkeypatch):
+    import asyncio
+    from datetime import datetime, timezone
+    from benchmarks.neo4j_standin import StandInDriver
+    monkeypatch.setattr(gc, "driver", StandInDriver())
+
+    async def ingest():
+        # One client sends a naive timestamp, another a zoned one
+        for episode_id, created_at in (("old", datetime(2026, 1, 1, 12)),
+                                       ("new", datetime(2026, 1, 2, 12, tzinfo=timezone.utc))):
+            plan = await gc.plan_episode("u1", CONV, episode_id, created_at, created_at)
+            await gc._write_episode("u1", plan.episode_id, json.dumps(CONV), {}, meta=plan.meta())
+        first, cursor = await gc.get_conversation_page("u1", 1)
+        second, _ = await gc.get_conversation_page("u1", 1, cursor)
+        return first, second
+    first, second = asyncio.run(ingest())
+    assert [first[0]["id"], second[0]["id"]] == ["new", "old"]
+    assert second[0]["created_at"] == "2026-01-01T12:00:00+00:00"
@@ -0,0 +1,76 @@
+import asyncio
+import pytest
+from app import extraction
+from app.llm import llm
+import app.graphiti_client as gc
+
+
+def _turns(n, size=40):
+    return [{"speaker": "User" if i % 2 else "AI", "text": f"{i} " + "x" * size} for i in range(n)]
+
+
+def test_windows_cover_every_turn_once_with_overlap_context():
+    conv = _turns(10)  # ~12 tokens per turn
+    chunks = extraction.windows(conv, context=[{"speaker": "AI", "text": "earlier"}], budget=30, overlap=1)
+    assert [turn for turns, _ in chunks for turn in turns] == conv
+    assert all(len(turns) == 2 for turns, _ in chunks)
+    assert chunks[0][1] == [{"speaker": "AI", "text": "earlier"}]
+    assert chunks[1][1] == [conv[1]]
+    # A turn over the budget still gets a window of its own
+    assert len(extraction.windows(_turns(1, size=400), budget=30)) == 1
+
+
+def test_parser_recovers_complete_objects_from_truncated_output():
+    content = ('Sure:\n```json\n[{"relation": "likes", "object": "jazz [live]", "object_type": "Music"},\n'
+               ' {"relation": "feels", "object": "a \\"calm\\" mood", "object_type": "Emotion"},\n'
+               ' {"relation": "enjoys", "object": "hik')
+    rels = extraction.parse_relations(content)
+    assert [r["object"] for r in rels] == ["jazz [live]", 'a "calm" mood']
+    # Streamed in arbitrary pieces, the same objects come out as they complete
+    parser = extraction.RelationParser()
+    streamed = [obj for i in range(0, len(content), 7) for obj in parser.feed(content[i:i + 7])]
+    assert streamed == rels and parser.started and not parser.complete
+    assert extraction.parse_relations("no relations here") == []
+
+
+def test_long_conversation_extracted_in_parallel_windows(monkeypatch):
+    monkeypatch.setattr(type(llm), "configured", property(lambda self: True))
+    running, peak, prompts = 0, 0, []
+
+    async def complete(messages, **kwargs):
+        nonlocal running, peak
+        prompts.append(messages[1]["content"])
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return '[{"relation": "likes", "object": "Jazz", "object_type": "Music"}, {"relation": "likes", "object": "ja'
+    monkeypatch.setattr(llm, "complete", complete)
+    chunks = extraction.windows(_turns(8), budget=30)
+    monkeypatch.setattr(extraction, "windows", lambda conv, context=None: chunks)
+    rels = asyncio.run(gc.request_relationships("u1", _turns(8)))
+    assert len(prompts) == len(chunks) == 4 and peak > 1
+    assert all("Earlier turns (context only)" in p for p in prompts[1:])
+    # The same relation from every window is written once
+    assert rels == [{"relation": "likes", "object": "Jazz", "object_type": "Music"}]
+
+
+def test_gather_bounded_leaves_no_unawaited_coroutine_after_a_failure():
+    import warnings
+    started = []
+
+    async def fail():
+        started.append("fail")
+        raise RuntimeError("window failed")
+
+    async def window(i):
+        started.append(i)
+        await asyncio.sleep(0.01)
+
+    calls = [fail] + [lambda i=i: window(i) for i in range(5)]
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", RuntimeWarning)
+        with pytest.raises(RuntimeError):
+            asyncio.run(extraction.gather_bounded(calls, limit=1))
+    # The calls still waiting for a slot were never turned into coroutines
+    assert started[0] == "fail" and len(started) <= 2
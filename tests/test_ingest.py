@@ -5,7 +5,9 @@ from app.main import app
 @pytest.fixture(autouse=True)
 def mock_graphiti(monkeypatch):
     import app.graphiti_client as gc
-    monkeypatch.setattr(gc, "add_episode", lambda uid, conv: "dummy_episode_id")
+    async def dummy_add_episode(uid, conv, **ids):
+        return "dummy_episode_id"
+    monkeypatch.setattr(gc, "add_episode", dummy_add_episode)
 
 client = TestClient(app)
 
@@ -31,4 +33,326 @@ def test_ingest_conversation():
     }
     response = client.post("/ingest_conversation", json=payload)
     assert response.status_code == 201
-    assert response.json() == {"status": "ok", "episode_id": "dummy_episode_id"} 
\ No newline at end of file
+    assert response.json() == {"status": "ok", "episode_id": "dummy_episode_id"} 
+def test_ingest_conversation_async_mode(monkeypatch):
+    import time
+    import app.graphiti_client as gc
+    async def dummy_persist_episode(uid, conv, **ids):
+        return gc.EpisodePlan(episode_id="stored_episode_id", mode="new", content_hash="h", turn_count=len(conv))
+    monkeypatch.setattr(gc, "persist_episode", dummy_persist_episode)
+    monkeypatch.setattr(gc, "process_episode", lambda uid, conv, plan: plan.episode_id)
+    payload = {
+        "uid": "1234567890",
+        "conversation": [
+            {"speaker": "AI", "text": "Hi there! What’s on your mind today?"},
+            {"speaker": "User", "text": "Deep breathing helps, but it doesn’t always last."},
+        ],
+        "conversation_id": "1234567890",
+        "created_at": "2025-06-02T12:00:00Z",
+        "updated_at": "2025-06-02T12:00:00Z"
+    }
+    with TestClient(app) as async_client:
+        response = async_client.post("/ingest_conversation?mode=async", json=payload)
+        assert response.status_code == 202
+        body = response.json()
+        assert body["status"] == "accepted"
+        assert body["episode_id"] == "stored_episode_id"
+        for _ in range(50):
+            job = async_client.get(f"/ingest_jobs/{body['job_id']}").json()
+            if job["status"] == "succeeded":
+                break
+            time.sleep(0.02)
+        assert job["status"] == "succeeded"
+        stats = async_client.get("/ingest_stats").json()
+        assert stats["succeeded"] >= 1
+        assert async_client.get("/ingest_jobs/unknown").status_code == 404
+
+def test_write_episode_batches_relations_per_group():
+    import asyncio
+    import app.graphiti_client as gc
+
+    class RecordingResult:
+        async def consume(self):
+            return None
+
+        async def single(self):
+            return None
+
+    class RecordingTx:
+        def __init__(self):
+            self.calls = []
+
+        async def run(self, query, **params):
+            self.calls.append((query, params))
+            return RecordingResult()
+
+    rels = [
+        {"relation": "feels", "object": "panic", "object_type": "emotion"},
+        {"relation": "feels", "object": "anger", "object_type": "emotion"},
+        {"relation": "feels", "object": "panic", "object_type": "emotion"},
+        {"relation": "uses", "object": "deep breathing", "object_type": "coping strategy"},
+    ]
+    groups = gc._sanitize_relations(rels)
+    assert groups == {("Emotion", "FEELS"): ["panic", "anger"], ("CopingStrategy", "USES"): ["deep breathing"]}
+    tx = RecordingTx()
+    assert asyncio.run(gc._write_episode_tx(tx, "u1", "ep1", "[]", groups)) == 3
+    # One statement for user+episode, then one UNWIND per (label, rel_type) group
+    assert len(tx.calls) == 3
+    assert all("UNWIND $objects" in query for query, _ in tx.calls[1:])
+
+def test_relations_are_normalized_onto_the_vocabulary():
+    import app.graphiti_client as gc
+
+    rels = [
+        {"relation": "Likes", "object": "Deep breathing ", "object_type": "Coping strategies"},
+        {"relation": "the user is interested in", "object": "deep  BREATHING", "object_type": "coping_mechanism"},
+        {"relation": "likes", "object": "Breathing exercises.", "object_type": "technique"},
+        {"relation": "is fascinated by", "object": "Quasars", "object_type": "AstronomicalObject"},
+        {"relation": "likes", "object": "  ", "object_type": "hobby"},
+    ]
+    groups = gc._sanitize_relations(rels)
+    # Names keep their first spelling; the folded key is what nodes are merged on
+    assert groups == {
+        ("CopingStrategy", "LIKES"): ["Deep breathing", "Breathing exercises"],
+        ("CopingStrategy", "INTERESTED_IN"): ["deep BREATHING"],
+        # Unknown types and relations collapse onto the fallbacks instead of minting new ones
+        ("Entity", "RELATES_TO"): ["Quasars"],
+    }
+    assert [name.key for name in groups[("CopingStrategy", "LIKES")]] == ["deep breathing", "breathing exercise"]
+    quasar = groups[("Entity", "RELATES_TO")][0]
+    # ...but the extracted type and relation are kept for the write
+    assert quasar.key == "quasar"
+    assert gc.extracted(quasar) == {"type": "AstronomicalObject", "relation": "is fascinated by"}
+
+def test_object_names_keep_words_the_plural_rules_would_corrupt():
+    from app.normalize import fold_name, Vocabulary
+
+    folded = [fold_name(name) for name in ["Glasses", "Dallas", "news", "Movies", "Los Angeles", "hobbies", "dishes"]]
+    assert folded == ["glasses", "dallas", "news", "movie", "los angeles", "hobby", "dish"]
+    vocab = Vocabulary()
+    vocab.extend(invariant=["Sims"])
+    assert vocab.key("The Sims") == "the sims"
+    # The fold only makes the key: the name is written as extracted
+    for name in ["Potatoes", "Knives", "James", "Mercedes", "The Sims"]:
+        assert vocab.name(f" {name}. ") == name
+
+def test_plan_episode_detects_unchanged_appended_and_stale(monkeypatch):
+    import asyncio
+    from datetime import datetime, timezone
+    import app.graphiti_client as gc
+
+    conv = [{"speaker": "AI", "text": f"question {i}"} if i % 2 == 0 else {"speaker": "User", "text": f"answer {i}"}
+            for i in range(10)]
+    stored = {"uid": "u1", "content_hash": gc.conversation_hash(conv[:6]), "turn_count": 6,
+              "updated_at": datetime(2025, 6, 2, 12, tzinfo=timezone.utc), "summary": "User answered 3 questions."}
+
+    async def read_episode_state(episode_id):
+        return stored if episode_id == "conv1" else None
+    monkeypatch.setattr(gc, "read_episode_state", read_episode_state)
+    later = datetime(2025, 6, 2, 13, tzinfo=timezone.utc)
+    earlier = datetime(2025, 6, 2, 11, tzinfo=timezone.utc)
+
+    assert asyncio.run(gc.plan_episode("u1", conv, "other")).mode == "new"
+    assert asyncio.run(gc.plan_episode("u1", conv[:6], "conv1", updated_at=later)).mode == "unchanged"
+    assert asyncio.run(gc.plan_episode("u1", conv, "conv1", updated_at=earlier)).mode == "stale"
+    edited = [dict(conv[0], text="edited")] + conv[1:]
+    assert asyncio.run(gc.plan_episode("u1", edited, "conv1", updated_at=later)).mode == "full"
+    with pytest.raises(gc.EpisodeConflictError):
+        asyncio.run(gc.plan_episode("u2", conv, "conv1"))
+
+    plan = asyncio.run(gc.plan_episode("u1", conv, "conv1", updated_at=later))
+    assert (plan.mode, plan.extract_from, plan.episode_id) == ("delta", 6, "conv1")
+
+    # Only the appended turns are extracted, with a small window of earlier turns as context
+    sent = {}
+    async def request_relationships(uid, turns, context=None):
+        sent["turns"], sent["context"] = turns, context
+        return [{"relation": "likes", "object": "tea", "object_type": "preference"}]
+    async def episode_summary(uid, turns):
+        sent["summary_input"] = turns
+        return "summary"
+    monkeypatch.setattr(gc, "request_relationships", request_relationships)
+    monkeypatch.setattr(gc, "_episode_summary", episode_summary)
+    groups, summary = asyncio.run(gc.extract_episode("u1", conv, plan))
+    assert sent["turns"] == conv[6:]
+    assert sent["context"] == conv[6 - gc.DELTA_CONTEXT_TURNS:6]
+    assert sent["summary_input"][0]["text"] == stored["summary"]
+    assert sent["summary_input"][1:] == conv[6:]
+    assert groups == {("Preference", "LIKES"): ["tea"]}
+
+def test_relation_edges_keep_frequency_and_recency_rank():
+    import asyncio
+    import math
+    from datetime import datetime, timedelta, timezone
+    import app.graphiti_client as gc
+
+    class RecordingResult:
+        async def consume(self):
+            return None
+
+        async def single(self):
+            return None
+
+    class RecordingTx:
+        def __init__(self):
+            self.calls = []
+
+        async def run(self, query, **params):
+            self.calls.append((query, params))
+            return RecordingResult()
+
+    seen = datetime(2025, 6, 2, 12, tzinfo=timezone.utc)
+    tx = RecordingTx()
+    asyncio.run(gc._write_episode_tx(tx, "u1", None, None, {("Activity", "ENJOYS"): ["hiking"]}, meta={"updated_at": seen}))
+    query, params = tx.calls[1]
+    assert "r.count = coalesce(r.count, 0) + 1" in query and "r.last_seen" in query
+    assert params["seen"] == seen and params["rank"] == gc.mention_rank(seen)
+
+    # Folding mentions into `rank` (log-add-exp) orders edges by decayed count:
+    # three mentions two half-lives ago weigh 3/4 of one mention now
+    old = gc.mention_rank(seen - timedelta(days=2 * gc.PREFERENCE_HALF_LIFE_DAYS))
+    folded = old
+    for _ in range(2):
+        folded = max(folded, old) + math.log(1 + math.exp(-abs(folded - old)))
+    assert math.isclose(math.exp(folded - gc.mention_rank(seen)), 0.75)
+    assert "ORDER BY rank DESC LIMIT $k" in gc.PREFERENCES_QUERY
+
+def test_compaction_folds_duplicate_nodes_and_their_edge_counters():
+    import math
+    from app import compaction
+
+    nodes = [
+        {"id": "n1", "label": "CopingStrategy", "name": "Deep breathing", "key": "deep breathing"},
+        {"id": "n2", "label": "Coping_strategy", "name": "deep breathing ", "key": None},
+        {"id": "n3", "label": "Food", "name": "Sushi", "key": "sushi"},
+        {"id": "n4", "label": "Food", "name": "Ramen", "key": "ramen"},
+        {"id": "n5", "label": "Food", "name": "Dumplings", "key": None},
+    ]
+    groups = compaction.plan_groups(nodes, dirty_ids={"n4"})
+    # sushi is already canonical and clean; ramen only has a non-canonical edge type;
+    # dumplings predates object keys and gets one, keeping its name
+    assert groups == [(("CopingStrategy", "deep breathing", "Deep breathing"), nodes[:2]),
+                      (("Food", "ramen", "Ramen"), [nodes[3]]),
+                      (("Food", "dumpling", "Dumplings"), [nodes[4]])]
+
+    targets = {m["id"]: target for target, members in groups for m in members}
+    edges = [
+        {"node": "n1", "uid": "u1", "type": "LIKES", "count": 2, "first_seen": 5, "last_seen": 9, "rank": 1.0},
+        {"node": "n2", "uid": "u1", "type": "IS_FOND_OF", "count": 1, "first_seen": 3, "last_seen": 4, "rank": 1.0},
+        {"node": "n2", "uid": "u1", "type": "like", "count": None, "first_seen": None, "last_seen": None, "rank": None},
+        {"node": "n4", "uid": "u2", "type": "ENJOYS_EATING", "count": 1, "first_seen": 1, "last_seen": 1, "rank": 0.5},
+    ]
+    rows = compaction.merge_edges(edges, targets)
+    assert rows[("CopingStrategy", "LIKES")] == [
+        {"uid": "u1", "key": "deep breathing", "name": "Deep breathing", "count": 4, "first_seen": 3, "last_seen": 9, "rank": 1.0 + math.log(2),
+         "extracted": None},
+    ]
+    assert rows[("Food", "RELATES_TO")][0]["count"] == 1
+    # The edge type that fell back is kept next to the fallback
+    assert rows[("Food", "RELATES_TO")][0]["extracted"] == {"type": None, "relation": "ENJOYS_EATING"}
+
+def test_failed_deferred_extraction_is_redone_by_the_next_post(monkeypatch):
+    import asyncio
+    import app.graphiti_client as gc
+    from benchmarks.neo4j_standin import StandInDriver
+
+    monkeypatch.setattr(gc, "driver", StandInDriver())
+    monkeypatch.setattr(gc, "_USE_GRAPHITI", False)
+    monkeypatch.setattr(gc, "EPISODE_SUMMARY_MODE", "off")
+    conv = [{"speaker": "AI", "text": "How do you relax?"}, {"speaker": "User", "text": "I like tea."}]
+    failing = {"on": True}
+
+    async def request_relationships(uid, turns, context=None):
+        if failing["on"]:
+            raise TimeoutError("LLM timed out")
+        return [{"relation": "likes", "object": "tea", "object_type": "preference"}]
+    monkeypatch.setattr(gc, "request_relationships", request_relationships)
+
+    plan = asyncio.run(gc.persist_episode("u1", conv, "conv1"))
+    with pytest.raises(TimeoutError):
+        asyncio.run(gc.process_episode("u1", conv, plan))
+    # The transcript is stored but not marked as extracted, so a re-post extracts it again
+    plan = asyncio.run(gc.persist_episode("u1", conv, "conv1"))
+    assert plan.mode == "full"
+    failing["on"] = False
+    asyncio.run(gc.process_episode("u1", conv, plan))
+    assert asyncio.run(gc.plan_episode("u1", conv, "conv1")).mode == "unchanged"
+
+def test_re_extracted_episode_counts_each_relation_once(monkeypatch):
+    import asyncio
+    import app.graphiti_client as gc
+    from benchmarks.neo4j_standin import StandInDriver
+
+    driver = StandInDriver()
+    monkeypatch.setattr(gc, "driver", driver)
+    monkeypatch.setattr(gc, "_USE_GRAPHITI", False)
+    monkeypatch.setattr(gc, "EPISODE_SUMMARY_MODE", "off")
+    objects = {"tea": ["tea"], "edited": ["tea", "coffee"]}
+
+    async def request_relationships(uid, turns, context=None):
+        return [{"relation": "likes", "object": name, "object_type": "preference"} for name in objects[turns[-1]["text"]]]
+    monkeypatch.setattr(gc, "request_relationships", request_relationships)
+
+    for text in ["tea", "edited"]:
+        # The edited conversation is re-extracted in full: tea was already counted for this Episode
+        conv = [{"speaker": "User", "text": text}]
+        asyncio.run(gc.process_episode("u1", conv, asyncio.run(gc.persist_episode("u1", conv, "conv1"))))
+    counts = {key: edge["count"] for (_, _, key), edge in driver.graph.edges["u1"].items()}
+    assert counts == {"tea": 1, "coffee": 1}
+    # The same relations from another Episode are new mentions
+    asyncio.run(gc.write_episode_batch([
+        {"uid": "u1", "episode_id": "conv2", "conv": [{"speaker": "User", "text": "tea"}], "summary": None,
+         "groups": gc._sanitize_relations([{"relation": "likes", "object": "Tea", "object_type": "preference"}]),
+         "plan": asyncio.run(gc.plan_episode("u1", [{"speaker": "User", "text": "tea"}], "conv2"))},
+    ]))
+    assert driver.graph.edges["u1"][("Preference", "LIKES", "tea")]["count"] == 2
+
+def test_failed_ingest_job_is_retried_with_backoff(monkeypatch):
+    import asyncio
+    from app import ingest_queue as iq
+    monkeypatch.setattr(iq, "INGEST_RETRY_BACKOFF", 0.01)
+    calls = []
+
+    async def flaky(uid):
+        calls.append(uid)
+        if calls.count(uid) < 3:
+            raise TimeoutError("LLM timed out")
+        return "ep1"
+
+    async def run():
+        queue = iq.IngestQueue(num_workers=1)
+        job = queue.submit("u1", flaky, "u1", retries=2)
+        exhausted = queue.submit("u2", flaky, "u2")
+        for _ in range(200):
+            if job.status in ("succeeded", "failed") and exhausted.status in ("succeeded", "failed"):
+                break
+            await asyncio.sleep(0.01)
+        await queue.stop()
+        return job, exhausted, queue.stats()
+    job, exhausted, stats = asyncio.run(run())
+    assert (job.status, job.attempts, job.episode_id) == ("succeeded", 3, "ep1")
+    # Without retries a failure is final
+    assert (exhausted.status, exhausted.attempts) == ("failed", 1)
+    assert stats["retried"] == 2 and stats["failed"] == 1
+
+def test_retry_waiting_for_a_full_queue_is_kept_until_it_lands():
+    import asyncio
+    import gc
+    from app import ingest_queue as iq
+
+    async def noop(uid):
+        return None
+
+    async def run():
+        queue = iq.IngestQueue(num_workers=0, maxsize=1)
+        queue.start()
+        first = queue.submit("u1", noop, "u1")
+        retry = iq.IngestJob(id="retry", uid="u2", func=noop, args=("u2",))
+        queue._requeue(retry)
+        gc.collect()
+        landed = [queue._queue.get_nowait()]
+        landed.append(await asyncio.wait_for(queue._queue.get(), 1))
+        await queue.stop()
+        return [job.id for job in landed], first.id
+    landed, first = asyncio.run(run())
+    assert landed == [first, "retry"]
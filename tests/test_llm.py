@@ -0,0 +1,152 @@
+import asyncio
+import json
+import httpx
+from app.llm import LLMClient, COMPLETIONS, CHAT
+
+
+def _client(handler):
+    return LLMClient(
+        base_url="http://llm.test/v1", api_key="sk-test", model="test-model",
+        transport=httpx.MockTransport(handler),
+    )
+
+
+def test_completions_fallback_is_detected_once():
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        if request.url.path.endswith("/chat/completions"):
+            return httpx.Response(404)
+        return httpx.Response(200, json={"choices": [{"text": " legacy answer "}]})
+
+    client = _client(handler)
+
+    async def run():
+        first = await client.complete([{"role": "user", "content": "hi"}])
+        second = await client.complete([{"role": "user", "content": "again"}])
+        await client.aclose()
+        return first, second
+
+    assert asyncio.run(run()) == ("legacy answer", "legacy answer")
+    assert client.endpoint == COMPLETIONS
+    # Only the very first call pays for the 404 probe
+    assert calls == ["/v1/chat/completions", "/v1/completions", "/v1/completions"]
+
+
+def test_chat_endpoint_reuses_pooled_client():
+    def handler(request):
+        assert request.headers["Authorization"] == "Bearer sk-test"
+        return httpx.Response(200, json={"choices": [{"message": {"content": "chat answer"}}]})
+
+    client = _client(handler)
+
+    async def run():
+        await client.complete([{"role": "user", "content": "hi"}], max_tokens=8)
+        pooled = client._client
+        await client.complete([{"role": "user", "content": "hi"}])
+        same = client._client is pooled
+        await client.aclose()
+        return same
+
+    assert asyncio.run(run())
+    assert client.endpoint == CHAT
+
+
+def test_embeddings_are_batched_and_memoized(monkeypatch, stub_embeddings):
+    embeddings, batches = stub_embeddings
+    monkeypatch.setattr(embeddings, "EMBEDDING_BATCH_SIZE", 2)
+
+    async def run():
+        first = await embeddings.embed_texts(["tea", "coffee", "jazz", "tea", "hiking", "sushi"])
+        again = await embeddings.embed_query("jazz")
+        return first, again
+
+    first, again = asyncio.run(run())
+    # Five distinct texts in batches of two; the repeat and the later query hit the LRU
+    assert sorted(len(batch) for batch in batches) == [1, 2, 2]
+    assert first.shape[0] == 6 and (first[0] == first[3]).all()
+    assert (again == first[2]).all()
+    assert abs(float(first[0] @ first[0]) - 1.0) < 1e-6
+
+
+def test_neo4j_vector_index_embeds_outside_its_transactions(monkeypatch, stub_embeddings):
+    import app.graphiti_client as gc
+    embeddings, batches = stub_embeddings
+    events = []
+
+    class Tx:
+        async def run(self, query, **params):
+            events.append(("run", query.split(" ")[0]))
+            class Result:
+                def __aiter__(self):
+                    async def rows():
+                        for key in params.get("keys", []):
+                            yield {"key": key, "name": key}
+                    return rows()
+                async def consume(self):
+                    return None
+            return Result()
+
+    class Session:
+        async def __aenter__(self):
+            events.append("open")
+            return self
+        async def __aexit__(self, *exc):
+            events.append("close")
+        async def execute_read(self, work):
+            events.append("read")
+            return await work(Tx())
+        async def execute_write(self, work):
+            events.append("write")
+            return await work(Tx())
+
+    class Driver:
+        def session(self, **kwargs):
+            return Session()
+
+    monkeypatch.setattr(gc, "driver", Driver())
+    real_embed = embeddings.embed_texts
+    async def embed_texts(texts):
+        events.append("embed")
+        return await real_embed(texts)
+    monkeypatch.setattr(embeddings, "embed_texts", embed_texts)
+    count = asyncio.run(embeddings.Neo4jVectorIndex().index("u1", [("Food", "sushi"), ("Hobby", "hiking")]))
+    assert count == 2
+    # Read the missing names, release the session, embed, then write in a managed transaction
+    assert [e for e in events if isinstance(e, str)] == ["open", "read", "close", "embed", "open", "write", "close"]
+
+
+def _sse(*chunks):
+    return "".join(f"data: {json.dumps(chunk)}\n\n" for chunk in chunks) + "data: [DONE]\n\n"
+
+
+def test_stream_relays_chat_deltas_and_falls_back_to_completions():
+    bodies = []
+
+    def handler(request):
+        bodies.append(json.loads(request.content))
+        if request.url.path.endswith("/chat/completions"):
+            if len(bodies) == 1:
+                return httpx.Response(200, text=_sse(
+                    {"choices": [{"delta": {"role": "assistant"}}]},
+                    {"choices": [{"delta": {"content": "Hel"}}]},
+                    {"choices": [{"delta": {"content": "lo"}}]},
+                ))
+            return httpx.Response(404)
+        return httpx.Response(200, text=_sse({"choices": [{"text": "leg"}]}, {"choices": [{"text": "acy"}]}))
+
+    async def collect(client):
+        return [text async for text in client.stream([{"role": "user", "content": "hi"}])]
+
+    async def run():
+        chat = _client(handler)
+        tokens = await collect(chat)
+        await chat.aclose()
+        legacy = _client(handler)
+        fallback = await collect(legacy)
+        await legacy.aclose()
+        return tokens, fallback, legacy.endpoint
+
+    assert asyncio.run(run()) == (["Hel", "lo"], ["leg", "acy"], COMPLETIONS)
+    assert all(body["stream"] is True for body in bodies)
@@ -0,0 +1,73 @@
+import asyncio
+import time
+import httpx
+from fastapi.testclient import TestClient
+from app.main import app
+from app import metrics
+from app.llm import LLMClient
+import app.graphiti_client as gc
+
+client = TestClient(app)
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = metrics.Histogram("demo_seconds", "Demo", ("stage",), buckets=(0.1, 1))
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value, stage="parse")
+    lines = histogram.render()
+    assert 'demo_seconds_bucket{stage="parse",le="0.1"} 1' in lines
+    assert 'demo_seconds_bucket{stage="parse",le="1"} 2' in lines
+    assert 'demo_seconds_bucket{stage="parse",le="+Inf"} 3' in lines
+    assert 'demo_seconds_count{stage="parse"} 3' in lines
+
+
+def test_metrics_endpoint_reports_routes_queries_and_llm(monkeypatch):
+    async def prefs(uid, top_k):
+        return ["tea"]
+    async def generate(preferences):
+        return "question"
+    monkeypatch.setattr(gc, "get_preferences", prefs)
+    monkeypatch.setattr(gc, "generate_next_question", generate)
+    assert client.post("/next_question", json={"uid": "m1", "num_preferences": 1}).status_code == 200
+
+    @metrics.timed_query("demo_lookup")
+    async def lookup(tx):
+        return 1
+    asyncio.run(lookup(None))
+
+    def handler(request):
+        return httpx.Response(200, json={"choices": [{"message": {"content": "ok"}}],
+                                         "model": "test-model", "usage": {"prompt_tokens": 12, "completion_tokens": 3}})
+    llm = LLMClient(base_url="http://llm.test/v1", api_key="sk-test", model="test-model", transport=httpx.MockTransport(handler))
+    async def run():
+        await llm.complete([{"role": "user", "content": "hi"}])
+        await llm.aclose()
+    asyncio.run(run())
+
+    body = client.get("/metrics").text
+    assert 'http_request_seconds_count{method="POST",route="/next_question",status="200"}' in body
+    assert 'neo4j_query_seconds_count{query="demo_lookup"} 1' in body
+    assert 'llm_request_seconds_count{endpoint="chat",model="test-model",status="200"}' in body
+    assert metrics.LLM_TOKENS.value(endpoint="chat", model="test-model", kind="prompt") >= 12
+    assert "# TYPE ingest_queue_depth gauge" in body
+
+
+def test_profiler_is_toggled_at_runtime(monkeypatch):
+    assert client.post("/debug/profiler/start").status_code == 403
+    monkeypatch.setattr(metrics, "PROFILER_ENABLED", True)
+    assert client.post("/debug/profiler/start", params={"interval": 0.001}).json()["running"] is True
+    time.sleep(0.05)
+    report = client.post("/debug/profiler/stop").json()
+    assert report["running"] is False
+    assert report["samples"] > 0 and report["stacks"]
+
+
+def test_profiler_report_is_safe_while_sampling():
+    profiler = metrics.SamplingProfiler()
+    profiler.start(interval=0.0001)
+    try:
+        # Reports taken while the sampler keeps adding new stacks
+        reports = [profiler.report() for _ in range(500)]
+    finally:
+        profiler.stop()
+    assert all(report["running"] for report in reports)
@@ -0,0 +1,46 @@
+import asyncio
+import json
+from fastapi.testclient import TestClient
+from app.main import app
+import app.graphiti_client as gc
+from benchmarks.neo4j_standin import StandInDriver
+
+
+def test_profile_is_maintained_on_ingest_and_served_with_etag(monkeypatch):
+    driver = StandInDriver()
+    monkeypatch.setattr(gc, "driver", driver)
+    meta = {"content_hash": "h", "turn_count": 1, "created_at": None, "updated_at": None}
+
+    async def ingest():
+        # The first write builds the document from the graph, later ones fold their mentions in
+        await gc._write_episode("u1", "ep1", json.dumps([]), {("Activity", "ENJOYS"): ["hiking"],
+                                                             ("Emotion", "FEELS"): ["calm"]}, "went hiking", meta)
+        await gc._write_episode("u1", "ep2", json.dumps([]), {("Activity", "ENJOYS"): ["hiking", "chess"],
+                                                             ("Problem", "STRUGGLES_WITH"): ["sleep"]}, None, meta)
+        await gc._write_episode("u1", "ep2", None, {}, "played chess")
+    asyncio.run(ingest())
+
+    client = TestClient(app)
+    response = client.get("/users/u1/profile")
+    assert response.status_code == 200
+    profile = response.json()
+    assert [e["name"] for e in profile["preferences"]["Activity"]] == ["hiking", "chess"]
+    assert profile["preferences"]["Activity"][0]["count"] == 2
+    assert [e["name"] for e in profile["emotions"]] == ["calm"]
+    assert [e["name"] for e in profile["problems"]] == ["sleep"]
+    assert profile["episode_count"] == 2
+    assert [(e["id"], e["summary"]) for e in profile["recent_episodes"]] == [("ep2", "played chess"), ("ep1", "went hiking")]
+
+    etag = response.headers["ETag"]
+    assert client.get("/users/u1/profile", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/users/nobody/profile").status_code == 404
+
+    # Readers are one lookup on the profile
+    before = driver.round_trips
+    assert asyncio.run(gc.get_preferences("u1", 2)) == ["hiking", "chess"]
+    assert asyncio.run(gc.get_recent_episodes("u1", 1)) == [{"id": "ep2", "revision": 1, "summary": "played chess"}]
+    assert driver.round_trips - before == 2 * 3
+
+    # A new mention changes the document and its ETag
+    asyncio.run(gc._write_episode("u1", None, None, {("Activity", "ENJOYS"): ["chess"]}, meta=meta))
+    assert client.get("/users/u1/profile", headers={"If-None-Match": etag}).status_code == 200
@@ -7,7 +7,9 @@ import app.graphiti_client as gc
 @pytest.fixture(autouse=True)
 def mock_graphiti_calls(monkeypatch):
     # Mock get_preferences to return a fixed list
-    monkeypatch.setattr(gc, "get_preferences", lambda uid, top_k: ["pref1", "pref2", "pref3"])
+    async def dummy_get_preferences(uid, top_k):
+        return ["pref1", "pref2", "pref3"]
+    monkeypatch.setattr(gc, "get_preferences", dummy_get_preferences)
     # Mock generate_next_question to return a predictable question
     async def dummy_generate(preferences):
         return "dummy question"
@@ -21,9 +23,55 @@ def test_next_question():
     assert response.status_code == 200
     assert response.json() == {"question": "dummy question"}
 
-@pytest.mark.skip(reason="Context-aware route not implemented yet")
-def test_next_question_with_context():
+def test_next_question_served_from_buffer_and_invalidated(monkeypatch):
+    import time
+    import app.question_buffer as qb
+    buffer = qb.QuestionBuffer(depth=2)
+    monkeypatch.setattr(qb, "question_buffer", buffer)
+    monkeypatch.setattr("app.routes.questions.question_buffer", buffer)
+    generated = []
+    async def counting_generate(preferences):
+        generated.append(len(generated))
+        return f"question {len(generated)}"
+    monkeypatch.setattr(gc, "generate_next_question", counting_generate)
+
+    def wait_for_refill():
+        for _ in range(100):
+            if not buffer.stats()["pending_refills"]:
+                return
+            time.sleep(0.01)
+
+    payload = {"uid": "user123", "num_preferences": 3}
+    with TestClient(app) as buffered_client:
+        before = buffered_client.get("/ingest_stats").json()
+        # Miss: generated live, then the buffer is filled in the background
+        assert buffered_client.post("/next_question", json=payload).json() == {"question": "question 1"}
+        wait_for_refill()
+        assert buffered_client.post("/next_question", json=payload).json() == {"question": "question 2"}
+        wait_for_refill()
+        # Preferences changed: buffered questions are dropped and regenerated
+        buffered_client.portal.call(buffer.invalidate, "user123")
+        wait_for_refill()
+        assert buffered_client.post("/next_question", json=payload).json() == {"question": "question 5"}
+        stats = buffered_client.get("/question_buffer/stats").json()
+        queues = buffered_client.get("/ingest_stats").json()
+    # Refills run on the background queue and never count as ingests
+    assert queues["submitted"] == before["submitted"]
+    assert queues["background"]["submitted"] - before["background"]["submitted"] >= 3
+    assert (stats["hits"], stats["misses"], stats["invalidations"]) == (2, 1, 1)
+    assert stats["refill_lag_ms"]["p50"] is not None
+
+def test_next_question_with_context(monkeypatch, stub_embeddings):
     # This test will validate /next_question_with_context when enabled
+    import asyncio
+    embeddings, batches = stub_embeddings
+    groups = {("Music", "LIKES"): ["jazz music", "deep breathing calms me"], ("Food", "ENJOYS"): ["sushi"]}
+    assert asyncio.run(embeddings.index_objects("user123", groups)) == 3
+    received = []
+    async def recording_generate(preferences):
+        received.append(preferences)
+        return "dummy question"
+    monkeypatch.setattr(gc, "generate_next_question", recording_generate)
     payload = {
         "uid": "user123",
         "previous_question": "What calms you?",
@@ -31,4 +79,80 @@ def test_next_question_with_context():
     }
     response = client.post("/next_question_with_context", json=payload)
     assert response.status_code == 200
-    assert response.json() == {"question": "dummy question"} 
\ No newline at end of file
+    assert response.json() == {"question": "dummy question"}
+    # Most similar preference first, the remaining slot filled from the ranked preferences
+    assert received == [["deep breathing calms me", "pref1"]]
+    # Repeating the same previous question is served from the embedding memo
+    before = len(batches)
+    client.post("/next_question_with_context", json=payload)
+    assert len(batches) == before
+
+def test_local_vector_index_is_rebuilt_from_the_graph(monkeypatch, stub_embeddings):
+    # A fresh process (or another worker) has no vectors for the user until it loads their objects
+    import asyncio
+    embeddings, _ = stub_embeddings
+    loads = []
+    async def graph_objects(uid, limit):
+        loads.append(uid)
+        return ["jazz music", "deep breathing calms me", "sushi"]
+    monkeypatch.setattr(gc, "get_ranked_preferences", graph_objects)
+    received = []
+    async def recording_generate(preferences):
+        received.append(preferences)
+        return "dummy question"
+    monkeypatch.setattr(gc, "generate_next_question", recording_generate)
+    payload = {"uid": "restarted", "previous_question": "What calms you?", "num_preferences": 1}
+    assert client.post("/next_question_with_context", json=payload).status_code == 200
+    assert received == [["deep breathing calms me"]]
+    # Later ingests extend the loaded matrix instead of replacing it
+    assert asyncio.run(embeddings.index_objects("restarted", {("Food", "ENJOYS"): ["sushi", "ramen"]})) == 1
+    assert loads == ["restarted"]
+
+def test_next_questions_pauses_generation_for_a_slow_reader(monkeypatch):
+    import asyncio
+    import app.question_buffer as qb
+    from app.batch_questions import next_questions_stream
+    from app.models.question_request import NextQuestionIn
+    monkeypatch.setattr("app.batch_questions.question_buffer", qb.QuestionBuffer(depth=0))
+    async def preferences_many(uids, top_k):
+        return {uid: ["pref"] for uid in uids}
+    monkeypatch.setattr(gc, "get_preferences_many", preferences_many)
+    started = []
+    async def generate(preferences):
+        started.append(preferences)
+        return "question"
+    monkeypatch.setattr(gc, "generate_next_question", generate)
+
+    async def read_one_then_stall():
+        stream = next_questions_stream([NextQuestionIn(uid=f"u{i}", num_preferences=1) for i in range(100)], concurrency=2)
+        await stream.__anext__()
+        await asyncio.sleep(0.05)
+        await stream.aclose()
+    asyncio.run(read_one_then_stall())
+    # One result read, four queued and two generations holding their slots while waiting to put
+    assert len(started) <= 1 + 4 + 2
+
+def test_next_questions_batch_streams_per_item_results(monkeypatch):
+    import json
+    import app.question_buffer as qb
+    monkeypatch.setattr("app.batch_questions.question_buffer", qb.QuestionBuffer(depth=0))
+    lookups = []
+    async def preferences_many(uids, top_k):
+        lookups.append((list(uids), top_k))
+        return {uid: [f"{uid}-pref{i}" for i in range(top_k)] for uid in uids}
+    monkeypatch.setattr(gc, "get_preferences_many", preferences_many)
+    async def generate(preferences):
+        if preferences[0].startswith("bad"):
+            raise RuntimeError("llm failed")
+        return f"question about {', '.join(preferences)}"
+    monkeypatch.setattr(gc, "generate_next_question", generate)
+
+    items = [{"uid": "u1", "num_preferences": 1}, {"uid": "bad", "num_preferences": 2}, {"uid": "u2", "num_preferences": 2}]
+    response = client.post("/next_questions?concurrency=2", json=items)
+    assert response.status_code == 200
+    results = sorted((json.loads(line) for line in response.text.splitlines()), key=lambda r: r["index"])
+    # One preference query for the whole batch, at the largest k; each item keeps its own k
+    assert lookups == [(["u1", "bad", "u2"], 2)]
+    assert results[0] == {"index": 0, "uid": "u1", "status": "ok", "question": "question about u1-pref0"}
+    assert results[1] == {"index": 1, "uid": "bad", "status": "error", "error": "llm failed"}
+    assert results[2]["question"] == "question about u2-pref0, u2-pref1"
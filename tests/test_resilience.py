@@ -0,0 +1,90 @@
+import asyncio
+import time
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from app.main import app
+import app.graphiti_client as gc
+from app.llm import LLMClient
+from app.resilience import UpstreamGuard, UpstreamUnavailableError, CircuitOpenError, OverloadedError
+
+
+def _client(handler, **guard):
+    guard = UpstreamGuard("llm", backoff_base=0.01, backoff_cap=0.05, failures=(httpx.TransportError,), **guard)
+    return LLMClient(base_url="http://llm.test/v1", api_key="sk-test", model="test-model",
+                     transport=httpx.MockTransport(handler), guard=guard)
+
+
+def test_throttled_requests_are_retried_honouring_retry_after():
+    statuses = [429, 503, 200]
+
+    def handler(request):
+        status = statuses.pop(0)
+        if status != 200:
+            return httpx.Response(status, headers={"Retry-After": "0"})
+        return httpx.Response(200, json={"choices": [{"message": {"content": "answer"}}]})
+
+    client = _client(handler, concurrency=8)
+    assert asyncio.run(client.complete([{"role": "user", "content": "hi"}])) == "answer"
+    assert statuses == []
+    # Two overload signals halved the concurrency limit twice; the success adds back a fraction
+    assert client.guard.stats()["limit"] == 2
+
+
+def test_breaker_opens_and_fails_fast_while_the_upstream_is_down():
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        return httpx.Response(500)
+
+    client = _client(handler, retries=1, breaker_threshold=2, breaker_reset=60)
+
+    async def run():
+        with pytest.raises(UpstreamUnavailableError):
+            await client.complete([{"role": "user", "content": "hi"}])
+        with pytest.raises(CircuitOpenError) as opened:
+            await client.complete([{"role": "user", "content": "again"}])
+        return opened.value
+
+    error = asyncio.run(run())
+    assert len(calls) == 2
+    assert client.guard.stats()["circuit"] == "open"
+    assert 0 < error.retry_after <= 60
+
+
+def test_calls_waiting_past_the_deadline_are_shed():
+    guard = UpstreamGuard("neo4j", concurrency=1, max_concurrency=1, queue_deadline=0.05)
+
+    async def run():
+        async def hold():
+            async with guard.admit():
+                await asyncio.sleep(0.2)
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        start = time.monotonic()
+        with pytest.raises(OverloadedError):
+            async with guard.admit():
+                pass
+        waited = time.monotonic() - start
+        await holder
+        return waited
+
+    assert asyncio.run(run()) < 0.2
+    assert guard.stats()["in_flight"] == 0
+
+
+def test_unavailable_upstream_returns_503_with_retry_after(monkeypatch):
+    async def get_preferences(uid, top_k):
+        return []
+
+    async def overloaded(preferences):
+        raise OverloadedError("llm overloaded", "llm", retry_after=2.5)
+    monkeypatch.setattr(gc, "get_preferences", get_preferences)
+    monkeypatch.setattr(gc, "generate_next_question", overloaded)
+
+    response = TestClient(app).post("/next_question_with_context",
+                                    json={"uid": "u1", "previous_question": "hi", "num_preferences": 3})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "3"
@@ -0,0 +1,41 @@
+import asyncio
+from app import schema
+
+
+class RecordingResult:
+    async def consume(self):
+        return None
+
+
+class RecordingSession:
+    def __init__(self):
+        self.queries = []
+
+    async def run(self, query, **params):
+        self.queries.append(query)
+        return RecordingResult()
+
+
+def test_label_index_registered_once(monkeypatch):
+    monkeypatch.setattr(schema, "_indexed_labels", set())
+    session = RecordingSession()
+
+    async def run():
+        await schema.ensure_label_index(session, "Emotion")
+        await schema.ensure_label_index(session, "Emotion")
+        await schema.ensure_label_index(session, "User")
+
+    asyncio.run(run())
+    assert session.queries == [
+        "CREATE INDEX `emotion_key` IF NOT EXISTS FOR (o:`Emotion`) ON (o.key)"
+    ]
+
+
+def test_plan_operators_flag_label_scans():
+    plan = {
+        "operatorType": "ProduceResults@neo4j",
+        "children": [{"operatorType": "NodeByLabelScan@neo4j", "children": []}],
+    }
+    operators = schema._plan_operators(plan)
+    assert operators == ["ProduceResults", "NodeByLabelScan"]
+    assert [op for op in operators if op in schema.SCAN_OPERATORS] == ["NodeByLabelScan"]
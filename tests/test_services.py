@@ -0,0 +1,63 @@
+import asyncio
+import subprocess
+import sys
+from pathlib import Path
+from app.services import Services, LazyDriver
+
+
+def test_importing_the_app_opens_nothing():
+    # No NEO4J_URI is needed and neither neo4j nor graphiti_core is imported
+    code = "import sys, app.main; print('neo4j' in sys.modules, 'graphiti_core' in sys.modules)"
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                         env={"PATH": "", "PYTHONPATH": str(Path(__file__).parent.parent)}).stdout.split()
+    assert out[-2:] == ["False", "False"]
+
+
+class FakeDriver:
+    def __init__(self):
+        self.pings = 0
+        self.verified = False
+        self.closed = False
+
+    async def verify_connectivity(self):
+        self.verified = True
+
+    def session(self):
+        driver = self
+
+        class Session:
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *exc):
+                return False
+
+            async def run(self, query):
+                driver.pings += 1
+
+                class Result:
+                    async def consume(self):
+                        return None
+                return Result()
+        return Session()
+
+    async def close(self):
+        self.closed = True
+
+
+def test_services_warm_up_and_close_lazily_built_driver(monkeypatch):
+    container = Services()
+    fake = FakeDriver()
+    lazy = LazyDriver(container)
+
+    async def run():
+        # Nothing is built until first use; closing an unbuilt driver is a no-op
+        await lazy.close()
+        assert not container.driver_created
+        container._driver = fake
+        await container.warm_up(min_pool=3)
+        await lazy.close()
+
+    asyncio.run(run())
+    assert fake.verified and fake.pings == 3 and fake.closed
+    assert not container.driver_created
@@ -0,0 +1,59 @@
+import asyncio
+import httpx
+from app.main import app
+from app.singleflight import SingleFlight
+import app.graphiti_client as gc
+
+
+def test_concurrent_duplicates_share_result_and_error():
+    flight = SingleFlight(endpoints={"demo"})
+    calls = []
+
+    async def work(value):
+        calls.append(value)
+        await asyncio.sleep(0.05)
+        if value == "boom":
+            raise RuntimeError("upstream failed")
+        return value
+
+    async def run():
+        results = await asyncio.gather(*(flight.do("demo", "k", work, "ok") for _ in range(5)))
+        errors = await asyncio.gather(*(flight.do("demo", "e", work, "boom") for _ in range(3)), return_exceptions=True)
+        # Once the flight has landed the next call runs again; disabled endpoints never coalesce
+        await flight.do("demo", "k", work, "ok")
+        await asyncio.gather(*(flight.do("other", "k", work, "ok") for _ in range(2)))
+        return results, errors
+
+    results, errors = asyncio.run(run())
+    assert results == ["ok"] * 5
+    assert all(isinstance(e, RuntimeError) for e in errors)
+    assert calls == ["ok", "boom", "ok", "ok", "ok"]
+    stats = flight.stats()
+    assert stats["coalesced"] == 6
+    assert stats["by_endpoint"]["demo"] == {"calls": 9, "coalesced": 6}
+    assert stats["in_flight"] == 0
+
+
+def test_conversation_summary_burst_makes_one_llm_call(monkeypatch):
+    import app.routes.conversation_summary as route
+    flight = SingleFlight(endpoints={"conversation_summary"})
+    monkeypatch.setattr(route, "single_flight", flight)
+    calls = []
+
+    async def summarize(uid, conv):
+        calls.append(uid)
+        await asyncio.sleep(0.1)
+        return "short summary"
+    monkeypatch.setattr(gc, "summarize_conversation", summarize)
+    payload = {"uid": "u1", "conversation": [{"speaker": "User", "text": "I like tea"}],
+               "conversation_id": "c1", "created_at": "2026-01-01T00:00:00Z", "updated_at": "2026-01-01T00:00:00Z"}
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await asyncio.gather(*(client.post("/conversation_summary", json=payload) for _ in range(4)))
+
+    responses = asyncio.run(run())
+    assert [r.json() for r in responses] == [{"summary": "short summary"}] * 4
+    assert calls == ["u1"]
+    assert flight.stats()["by_endpoint"]["conversation_summary"]["coalesced"] == 3
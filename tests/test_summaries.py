@@ -0,0 +1,96 @@
+import asyncio
+import json
+from app import summaries
+from app.llm import llm
+
+
+def test_pack_groups_respects_budget():
+    texts = ["x" * 40] * 5  # ~11 tokens each
+    groups = summaries.pack_groups(texts, budget=25)
+    assert [len(g) for g in groups] == [2, 3]
+    assert sum(groups, []) == texts
+
+
+def test_compose_single_summary_needs_no_llm(monkeypatch):
+    async def fail(*args, **kwargs):
+        raise AssertionError("no LLM call expected")
+    monkeypatch.setattr(llm, "complete", fail)
+    assert asyncio.run(summaries.compose(["only one"], "summary")) == "only one"
+
+
+def test_compose_map_reduces_over_budget(monkeypatch):
+    calls = []
+
+    async def complete(messages, **kwargs):
+        calls.append(messages[1]["content"])
+        return "merged"
+    monkeypatch.setattr(llm, "complete", complete)
+    result = asyncio.run(summaries.compose(["y" * 400] * 8, "summary", budget=250))
+    assert result == "merged"
+    # Map calls over groups first, then exactly one final combine over the short merged texts
+    assert len(calls) > 1
+    assert calls[-1].startswith(summaries.PROMPTS["summary"][1])
+    assert "y" * 400 not in calls[-1]
+
+
+def _events(text):
+    return [json.loads(line[5:]) for line in text.splitlines() if line.startswith("data:")]
+
+
+def test_conversation_content_streams_and_fills_cache(monkeypatch):
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.cache import SummaryCache, summary_key
+    import app.graphiti_client as gc
+
+    async def recent_episodes(uid, n):
+        return [{"id": "ep2", "revision": 3, "summary": None}, {"id": "ep1", "revision": 1, "summary": None}]
+    calls = []
+
+    async def episodes_stream(ids, kind, known=None):
+        calls.append(ids)
+        for token in ["Loves ", "hiking."]:
+            yield token
+    monkeypatch.setattr(gc, "get_recent_episodes", recent_episodes)
+    monkeypatch.setattr(gc, "summarize_episodes_stream", episodes_stream)
+    summary_cache = SummaryCache()
+    monkeypatch.setattr("app.routes.content.summary_cache", summary_cache)
+    client = TestClient(app)
+    payload = {"uid": "streamer", "num_conversations": 2}
+    response = client.post("/conversation_content?stream=true", json=payload)
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert _events(response.text) == [{"token": "Loves "}, {"token": "hiking."}, {"summary": "Loves hiking."}]
+    assert summary_cache.get(summary_key("streamer", ["ep2", "ep1"], "content", llm.model, revisions=[3, 1])) == "Loves hiking."
+    # The completed stream filled the cache: no second LLM stream, the JSON mode is served from it too
+    assert _events(client.post("/conversation_content?stream=true", json=payload).text)[-1] == {"summary": "Loves hiking."}
+    assert client.post("/conversation_content", json=payload).json() == {"summary": "Loves hiking."}
+    assert len(calls) == 1
+
+
+def test_cancelled_relay_closes_upstream_and_skips_cache():
+    from app.sse import relay
+    closed, completed = [], []
+
+    async def upstream():
+        try:
+            yield "first"
+            await asyncio.sleep(10)
+            yield "never"
+        finally:
+            closed.append(True)
+
+    async def run():
+        async def consume():
+            async for _ in relay(upstream(), completed.append):
+                pass
+        task = asyncio.create_task(consume())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(run())
+    assert closed == [True]
+    assert completed == []
@@ -0,0 +1,112 @@
+import pytest
+from fastapi.testclient import TestClient
+from app.main import app
+from app.cache import SummaryCache, summary_key, summary_cache
+from app.llm import llm
+import app.graphiti_client as gc
+
+client = TestClient(app)
+
+
+def test_lru_eviction_ttl_and_invalidation(monkeypatch):
+    cache = SummaryCache(max_entries=2, ttl=60)
+    cache.set(summary_key("a", ["e1"], "summary", "m"), "A1")
+    cache.set(summary_key("b", ["e2"], "summary", "m"), "B1")
+    assert cache.get(summary_key("a", ["e1"], "summary", "m")) == "A1"
+    # "b" is now least recently used and is evicted
+    cache.set(summary_key("a", ["e1"], "content", "m"), "A2")
+    assert cache.get(summary_key("b", ["e2"], "summary", "m")) is None
+    assert cache.invalidate_uid("a") == 2
+    assert cache.stats()["entries"] == 0
+    assert cache.stats()["evictions"] == 1
+
+    expired = SummaryCache(max_entries=2, ttl=-1)
+    expired.set(summary_key("a", ["e1"], "summary", "m"), "A1")
+    assert expired.get(summary_key("a", ["e1"], "summary", "m")) is None
+    assert expired.stats()["expirations"] == 1
+
+
+def test_summary_computed_before_an_invalidation_is_not_cached():
+    cache = SummaryCache(max_entries=2, ttl=60)
+    key = summary_key("a", ["e1"], "summary", "m", cache.generation("a"))
+    # A delta ingest rewrites e1 while the summary is being generated
+    cache.invalidate_uid("a")
+    cache.set(key, "stale")
+    assert cache.get(key) is None
+    assert cache.stats()["stale_sets"] == 1
+    fresh = summary_key("a", ["e1"], "summary", "m", cache.generation("a"))
+    cache.set(fresh, "fresh")
+    assert cache.get(fresh) == "fresh"
+    # Once "a" is forgotten its generation never falls back to the one the stale key holds
+    cache.invalidate_uid("b")
+    cache.invalidate_uid("c")
+    cache.set(key, "stale")
+    assert cache.get(key) is None
+
+
+@pytest.fixture
+def episodes(monkeypatch):
+    summary_cache.clear()
+    ids = ["ep2", "ep1"]
+    revisions = {"ep2": 1, "ep1": 1}
+
+    async def recent_episodes(uid, n):
+        return [{"id": i, "revision": revisions.get(i, 1), "summary": None} for i in ids[:n]]
+
+    async def episode_summaries(episode_ids, known=None):
+        return [f"summary of {i}" for i in episode_ids]
+
+    calls = []
+
+    async def complete(messages, **kwargs):
+        calls.append(messages)
+        return f"summary #{len(calls)}"
+
+    monkeypatch.setattr(gc, "get_recent_episodes", recent_episodes)
+    monkeypatch.setattr(gc, "get_episode_summaries", episode_summaries)
+    monkeypatch.setattr(llm, "complete", complete)
+    return ids, calls, revisions
+
+
+def test_conversation_content_served_from_cache(episodes):
+    ids, calls, _ = episodes
+    payload = {"uid": "user123", "num_conversations": 2}
+    first = client.post("/conversation_content", json=payload).json()
+    second = client.post("/conversation_content", json=payload).json()
+    assert first == second == {"summary": "summary #1"}
+    assert len(calls) == 1
+    # A new episode changes the key, so the next request goes back to the LLM
+    ids.insert(0, "ep3")
+    assert client.post("/conversation_content", json=payload).json() == {"summary": "summary #2"}
+    stats = client.get("/summary_cache/stats").json()
+    assert stats["hits"] == 1 and stats["misses"] == 2
+
+
+def test_conversation_summary_of_recent_episodes_served_from_cache(episodes):
+    ids, calls, _ = episodes
+    # Without a posted conversation the user's last Episodes are summarized
+    payload = {"uid": "recent-summary", "num_conversations": 2}
+    first = client.post("/conversation_summary", json=payload).json()
+    assert client.post("/conversation_summary", json=payload).json() == first == {"summary": "summary #1"}
+    assert len(calls) == 1
+    assert summary_cache.get(summary_key("recent-summary", ids, "summary", llm.model,
+                                         summary_cache.generation("recent-summary"), [1, 1])) == "summary #1"
+
+
+def test_delta_ingest_in_another_worker_misses_the_cache(episodes):
+    ids, calls, revisions = episodes
+    payload = {"uid": "other-worker", "num_conversations": 2}
+    assert client.post("/conversation_content", json=payload).json() == {"summary": "summary #1"}
+    # Another worker appended turns to ep2: same ids, no local invalidation, but a new revision
+    revisions["ep2"] = 2
+    assert client.post("/conversation_content", json=payload).json() == {"summary": "summary #2"}
+    assert len(calls) == 2
+
+
+def test_invalid_posted_conversation_is_rejected_not_summarized_from_history(episodes):
+    ids, calls, _ = episodes
+    # A conversation without its conversation_id must not fall back to the recent-Episodes summary
+    payload = {"uid": "recent-summary", "conversation": [{"speaker": "AI", "text": "hi"}]}
+    response = client.post("/conversation_summary", json=payload)
+    assert response.status_code == 422
+    assert calls == []